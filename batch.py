@@ -0,0 +1,181 @@
+# coding=utf-8
+
+"""
+Renders a catalog of MIDI files through a durable job queue (see musicbox.jobs), on a pool of worker processes.
+
+    $ python batch.py catalog.db OUTPUT_DIR songs/*.mid [--box 2] [--workers 8]
+
+Every MIDI file becomes a job that renders OUTPUT_DIR/<file name>.pdf, so MIDI files with the same name are refused
+instead of overwriting each other. When a run is interrupted (a crash, running out of memory, Ctrl+C), running the
+same command again only renders what isn't done yet. Without MIDI files, it resumes the queue. Several batch.py
+processes, on one or more machines sharing the directory, can work on the same queue.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import box_arg, fit_song, load_music_boxes, paper_size_arg, resolve_box
+from musicbox.jobs import DEFAULT_LEASE, DEFAULT_MAX_ATTEMPTS, JobQueue, PENDING, STATES, write_output
+from musicbox.paper import PAPER_SIZES
+
+
+def render_job(params, output_file, music_boxes):
+    """ Renders the song of a job to its output file. Returns the SHA-256 of the output """
+    from musicbox.cache import NoteCache
+    from musicbox.session import thread_session
+
+    # Jobs already run on every core
+    notes = NoteCache().render_to_box(params["midi_file"], workers=1)
+    box_index, notes, _ = fit_song(notes, music_boxes, params["box"],
+                                   transpose=params["transpose"],
+                                   auto_transpose=params["auto_transpose"],
+                                   transpose_range=params["transpose_range"],
+                                   fold_octaves=params["fold_octaves"])
+    session = thread_session(music_boxes[box_index], paper_size=params["paper_size"])
+    pdf, _ = session.render(None, None, song_title=params["song_title"], song_author=params["song_author"],
+                            parsed_notes=notes, columns=params["columns"])
+    return write_output(output_file, pdf)
+
+
+def work(queue_file, music_boxes, lease=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """ Renders jobs until the queue has none left. Returns (jobs done, jobs that failed) """
+    queue = JobQueue(queue_file, lease=lease, max_attempts=max_attempts)
+    done = failed = 0
+    try:
+        while True:
+            job = queue.claim()
+            if job is None:
+                return done, failed
+            start = time.perf_counter()
+            try:
+                output_hash = render_job(job["params"], job["output_file"], music_boxes)
+            except Exception as e:
+                state = queue.fail(job, f"{type(e).__name__}: {e}")
+                failed += 1
+                print("Failed '{}' (attempt {}{}): {}".format(job["output_file"], job["attempts"],
+                                                            ", will retry" if state == PENDING else "", e))
+                continue
+            seconds = time.perf_counter() - start
+            if queue.complete(job, output_hash, seconds):
+                done += 1
+                print("Generated '{}' in {:.2f}s".format(job["output_file"], seconds))
+    finally:
+        queue.close()
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Renders many MIDI files through a resumable job queue")
+    ap.add_argument("queue_file", metavar="QUEUE_FILE", help="SQLite file of the queue. Created if missing")
+    ap.add_argument("output_dir", metavar="OUTPUT_DIR", help="Directory where to put the PDFs")
+    ap.add_argument("midi_files", metavar="MIDI_FILE", nargs="*", help="MIDI files to queue. Files already queued "
+                                                                       "are skipped")
+    ap.add_argument("--author", help="Author of the songs", default="NO-AUTHOR")
+    ap.add_argument("--box", "-b", help="Music box to use, index starting at 1 (defaults to the last one), name, or "
+                                        "'auto' to pick the one that can play most of each song", type=box_arg)
+    ap.add_argument("--paper-size", help="Paper size, as a name ({}) or WIDTHxHEIGHT in mm".format(
+        ", ".join(PAPER_SIZES)), type=paper_size_arg, default=(215.9, 279.4))
+    ap.add_argument("--transpose", "-t", help="Semitones to shift every note", type=int, default=0)
+    ap.add_argument("--auto-transpose", help="Pick the shift that maximizes the notes the box can play",
+                    action="store_true")
+    ap.add_argument("--transpose-range", help="Max semitones to try in either direction with --auto-transpose",
+                    type=int, default=12)
+    ap.add_argument("--fold-octaves", help="Move notes outside the box range by octaves until they fit",
+                    action="store_true")
+    ap.add_argument("--columns", help="Cut strips in this many columns per page and pack them to save paper",
+                    type=int)
+    ap.add_argument("--workers", "-w", help="Render processes. Defaults to the CPU count", type=int)
+    ap.add_argument("--lease", help="(s) Time after which the job of a worker that stopped responding is handed out "
+                                    "again", type=float, default=DEFAULT_LEASE)
+    ap.add_argument("--max-attempts", help="Attempts before a job is marked failed", type=int,
+                    default=DEFAULT_MAX_ATTEMPTS)
+    ap.add_argument("--retry-failed", help="Queue the failed jobs again", action="store_true")
+    ap.add_argument("--verify", help="Queue again the done jobs whose PDF is missing or was modified",
+                    action="store_true")
+    ap.add_argument("--status", help="Only show the jobs by state, and the errors of the failed ones",
+                    action="store_true")
+    args = ap.parse_args()
+    if not os.path.isdir(args.output_dir):
+        ap.error("Directory '{}' doesn't exist".format(args.output_dir))
+    if args.columns is not None and args.columns < 1:
+        ap.error("--columns must be at least 1")
+    if args.transpose_range < 0:
+        ap.error("--transpose-range can't be negative")
+    return args
+
+
+def print_status(queue):
+    counts = queue.counts()
+    print(", ".join(f"{counts[state]} {state}" for state in STATES))
+    for job in queue.jobs("failed"):
+        print("\t'{}': {}".format(job["output_file"], job["error"]))
+
+
+def main():
+    parsed_args = parse_args()
+    queue = JobQueue(parsed_args.queue_file, lease=parsed_args.lease, max_attempts=parsed_args.max_attempts)
+    try:
+        if parsed_args.status:
+            print_status(queue)
+            return
+        registry = load_music_boxes(verbose=False)
+        box = resolve_box(registry, parsed_args.box)
+        # The output file is the job key: two MIDI files with the same name would share it
+        sources = dict()
+        if parsed_args.midi_files:
+            sources = {job["output_file"]: job["params"]["midi_file"] for job in queue.jobs()}
+        collisions = list()
+        jobs = list()
+        for midi_file in parsed_args.midi_files:
+            midi_file = os.path.abspath(midi_file)
+            name = os.path.splitext(os.path.basename(midi_file))[0]
+            output_file = os.path.abspath(os.path.join(parsed_args.output_dir, f"{name}.pdf"))
+            source = sources.setdefault(output_file, midi_file)
+            if source != midi_file:
+                collisions.append(f"\t'{midi_file}' and '{source}' would both render '{output_file}'")
+                continue
+            jobs.append((output_file,
+                         {"midi_file": midi_file,
+                          "song_title": name[:50] or "NO-TITLE",
+                          "song_author": parsed_args.author[:50],
+                          "box": box,
+                          "paper_size": parsed_args.paper_size,
+                          "transpose": parsed_args.transpose,
+                          "auto_transpose": parsed_args.auto_transpose,
+                          "transpose_range": parsed_args.transpose_range,
+                          "fold_octaves": parsed_args.fold_octaves,
+                          "columns": parsed_args.columns}))
+        if collisions:
+            raise SystemExit("MIDI files with the same name, queue them with different output directories:\n"
+                             + "\n".join(collisions))
+        if jobs:
+            added = queue.add(jobs)
+            print(f"Queued {added} songs ({len(jobs) - added} were already queued)")
+        if parsed_args.retry_failed:
+            print(f"Queued {queue.retry_failed()} failed songs again")
+        if parsed_args.verify:
+            for output_file in queue.verify():
+                print(f"Queued '{output_file}' again: missing or modified")
+        print_status(queue)
+    finally:
+        queue.close()
+
+    start = time.perf_counter()
+    workers = parsed_args.workers or os.cpu_count() or 1
+    args = (parsed_args.queue_file, list(registry), parsed_args.lease, parsed_args.max_attempts)
+    if workers == 1:
+        results = [work(*args)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [future.result() for future in [pool.submit(work, *args) for _ in range(workers)]]
+    done, failed = (sum(counts) for counts in zip(*results))
+    print(f"Rendered {done} songs in {time.perf_counter() - start:.1f}s, {failed} failed attempts")
+    queue = JobQueue(parsed_args.queue_file)
+    try:
+        print_status(queue)
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+"""
+Event loop latency benchmark for render_async.
+
+Runs several renders at once on an event loop while a ticker measures how late it gets scheduled, first with
+Renderer.generate called straight from a coroutine and then with render_async. Fails when the worst delay with
+render_async is over --max-lag. Run from the repository root:
+
+    $ python benchmarks/async_latency.py [--renders 8] [--concurrency 4]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musicbox.aio import AsyncRenderPool  # noqa: E402
+from musicbox.midi import Parser, TICKS_PER_BEAT  # noqa: E402
+from musicbox.pdf import Renderer  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+SONG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "tests",
+                    "test6_longer_song.mid")
+
+
+async def ticker(lags, interval=0.001):
+    """ Records how late every tick is """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+
+async def blocking_render(music_box, notes, output_file):
+    Renderer(music_box, style=music_box.style).generate(None, output_file, parsed_notes=notes)
+
+
+async def measure(renders):
+    lags = list()
+    tick = asyncio.create_task(ticker(lags))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*renders)
+    seconds = time.perf_counter() - start
+    # Let the ticker record the tick a blocking render delayed
+    await asyncio.sleep(0.01)
+    tick.cancel()
+    return seconds, max(lags, default=0)
+
+
+async def run(parsed_args, music_box, notes, output_file):
+    """ Returns (seconds, worst delay) blocking and with render_async """
+    blocking = await measure([blocking_render(music_box, notes, output_file) for _ in range(parsed_args.renders)])
+    pool = AsyncRenderPool(max_concurrent=parsed_args.concurrency)
+    non_blocking = await measure([pool.render(music_box, None, io.BytesIO(), parsed_notes=notes,
+                                              style=music_box.style) for _ in range(parsed_args.renders)])
+    return blocking, non_blocking
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measures how long renders block the event loop")
+    ap.add_argument("--renders", help="Renders started at once", type=int, default=8)
+    ap.add_argument("--concurrency", help="Renders running at once", type=int, default=4)
+    ap.add_argument("--repeat", help="Times the example song is repeated", type=int, default=20)
+    ap.add_argument("--max-lag", help="(ms) Max event loop delay with render_async", type=float, default=50)
+    parsed_args = ap.parse_args()
+
+    music_box = BoxRegistry.load().by_index(2)
+    song = Parser.render_to_box(SONG)
+    length = song[-1]["tick"] + TICKS_PER_BEAT
+    notes = [Parser.at_tick(note, note["tick"] + i * length) for i in range(parsed_args.repeat) for note in song]
+    print(f"{parsed_args.renders} renders of {len(notes)} notes, {parsed_args.concurrency} at once")
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(parsed_args, music_box, notes, os.path.join(tmp_dir, "song.pdf")))
+    for name, (seconds, lag) in zip(("Blocking", "render_async"), results):
+        print(f"{name}: {seconds:.2f}s, worst loop delay {lag * 1000:.0f}ms")
+    ok = lag * 1000 <= parsed_args.max_lag
+    print(f"{'OK  ' if ok else 'FAIL'} worst loop delay {lag * 1000:.0f}ms (max {parsed_args.max_lag:.0f}ms)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
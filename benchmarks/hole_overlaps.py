@@ -0,0 +1,49 @@
+# coding=utf-8
+
+"""
+Overlapping holes benchmark.
+
+Builds synthetic songs of increasing size for a box (random chords, like benchmarks/punch_travel.py), then finds and
+fixes the overlapping holes of each and reports the time per hole, which should stay about the same as songs grow.
+Run from the repository root:
+
+    $ python benchmarks/hole_overlaps.py [--holes 10000 100000 300000] [--box 2]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.punch_travel import synthetic_notes  # noqa: E402
+from musicbox.holes import HoleOverlaps  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measures finding and fixing overlapping holes")
+    ap.add_argument("--holes", help="Holes in each synthetic song", nargs="+", type=int,
+                    default=[10000, 100000, 300000])
+    ap.add_argument("--box", help="Music box index, starting at 1", type=int, default=2)
+    ap.add_argument("--hole-radius", help="(mm) Defaults to the box's. Larger holes overlap more", type=float)
+    parsed_args = ap.parse_args()
+
+    music_box = BoxRegistry.load().by_index(parsed_args.box)
+    holes = HoleOverlaps(music_box, hole_radius=parsed_args.hole_radius)
+    print(f"{music_box.name}: {holes.diameter:g}mm holes, {music_box.pin_width:g}mm between pins")
+    for count in sorted(parsed_args.holes):
+        notes = synthetic_notes(music_box, count)
+        start = time.perf_counter()
+        overlaps = holes.find(notes)
+        find_time = time.perf_counter() - start
+        start = time.perf_counter()
+        kept, dropped = holes.fix(notes)
+        fix_time = time.perf_counter() - start
+        print(f"{count:>8} holes: {len(overlaps)} overlapping pairs in {find_time:.2f}s "
+              f"({find_time / count * 1e6:.1f}us/hole), {len(dropped)} dropped in {fix_time:.2f}s "
+              f"({fix_time / count * 1e6:.1f}us/hole)")
+
+
+if __name__ == "__main__":
+    main()
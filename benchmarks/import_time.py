@@ -0,0 +1,68 @@
+# coding=utf-8
+
+"""
+Import time benchmark for the command line.
+
+Runs main.py with `python -X importtime` for a few cheap invocations and fails when a heavy module gets imported
+or the total import time goes over budget. Run from the repository root:
+
+    $ python benchmarks/import_time.py [--runs N]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_MIDI = os.path.join("examples", "tests", "test.mid")
+
+# (name, main.py arguments, modules that must not be imported, budget in ms)
+SCENARIOS = [
+    ("help", ["--help"], ["fpdf", "midi", "six", "yaml"], 50),
+    ("bad arguments", [SAMPLE_MIDI, "title"], ["fpdf", "midi", "six", "yaml"], 50),
+    ("dry run", [SAMPLE_MIDI, "title", "author", "--dry-run"], ["fpdf", "midi", "six"], 80),
+]
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(args):
+    """ Returns the imported top level modules and the total import time in ms """
+    result = subprocess.run([sys.executable, "-X", "importtime", "main.py"] + args,
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = set()
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        modules.add(name.split(".")[0])
+        # Nested imports are already counted in their parent's cumulative time
+        if len(indent) == 1:
+            total_us += int(cumulative)
+    return modules, total_us / 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Checks that cheap command line invocations stay cheap")
+    ap.add_argument("--runs", "-n", help="Runs per scenario, the median is compared", type=int, default=5)
+    parsed_args = ap.parse_args()
+
+    failed = False
+    for name, args, forbidden, budget_ms in SCENARIOS:
+        runs = [measure(args) for _ in range(parsed_args.runs)]
+        imported = set.union(*(modules for modules, _ in runs))
+        median_ms = statistics.median(total for _, total in runs)
+        leaked = sorted(imported.intersection(forbidden))
+        ok = not leaked and median_ms <= budget_ms
+        failed |= not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {median_ms:.1f}ms (budget {budget_ms}ms)"
+              + (f", imported {', '.join(leaked)}" if leaked else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
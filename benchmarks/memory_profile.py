@@ -0,0 +1,169 @@
+# coding=utf-8
+
+"""
+Memory profile of every render stage.
+
+Renders synthetic midi files of increasing size, each one in a separate process, and measures every stage:
+reading the midi package Pattern, extracting the notes, drawing the pages and writing the pdf. For each stage it
+records the tracemalloc peak, the memory the stage keeps (its structure), the peak RSS so far and the top allocation
+sites. Growth is fitted against the amount of notes, and the check fails when the peak per note of a stage goes
+over the budget stored in memory_budget.json. Run from the repository root:
+
+    $ python benchmarks/memory_profile.py [--events 10000 30000 60000] [--update-budget]
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.streaming_memory import write_synthetic_midi  # noqa: E402
+
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_budget.json")
+STAGES = ("pattern", "notes", "pages", "output")
+
+
+def _site(frame):
+    path = os.path.relpath(frame.filename, ROOT)
+    if path.startswith(".."):
+        # Installed packages: keep package/module.py
+        path = os.path.join(*frame.filename.split(os.sep)[-2:])
+    return f"{path}:{frame.lineno}"
+
+
+def _measure(stage, func, results, top=3):
+    """ Runs func, recording its tracemalloc peak, what it keeps allocated and the lines that allocated it """
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    grown = [stat for stat in after.compare_to(before, "lineno") if stat.size_diff > 0][:top]
+    results[stage] = {
+        "peak": peak - start,
+        "retained": current - start,
+        "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "sites": ["{} {:.0f}KB".format(_site(stat.traceback[0]), stat.size_diff / 1024) for stat in grown],
+    }
+    return result
+
+
+def child(midi_file):
+    """ Profiles every stage in this process and prints the results as json """
+    import midi
+    from musicbox.midi import Parser
+    from musicbox.pdf import Renderer, StripGenerator
+    from musicbox.registry import BoxRegistry
+
+    music_box = BoxRegistry.load().by_index(2)
+    results = dict()
+    tracemalloc.start()
+    pattern = _measure("pattern", lambda: midi.read_midifile(midi_file), results)
+    del pattern
+    notes = _measure("notes", lambda: Parser.render_to_box(midi_file), results)
+    doc = Renderer(music_box, paper_size=(215.9, 279.4), style=music_box.style)
+
+    def _draw_pages():
+        # Same steps as Renderer.generate, without the output
+        doc.add_page()
+        StripGenerator(music_box_object=music_box, song_title="Title", song_author="Author", styles=doc.styles,
+                       diagnostics=doc.diagnostics).draw_strips(doc, list(notes), doc.strip_separation)
+        return doc
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _measure("pages", _draw_pages, results)
+        pdf = _measure("output", lambda: doc.write_output(), results)
+    tracemalloc.stop()
+    print(json.dumps({"notes": len(notes), "pdf": len(pdf), "stages": results}))
+
+
+def profile(midi_file):
+    result = subprocess.run([sys.executable, __file__, "--child", midi_file], cwd=ROOT, stdout=subprocess.PIPE,
+                            text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def fit(sizes, values):
+    """ Least squares line values = slope * sizes + intercept, and the exponent of the growth between the ends """
+    n = len(sizes)
+    mean_x, mean_y = sum(sizes) / n, sum(values) / n
+    variance = sum((x - mean_x) ** 2 for x in sizes)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(sizes, values)) / variance if variance else 0
+    exponent = None
+    if sizes[0] != sizes[-1] and values[0] > 0 and values[-1] > 0:
+        exponent = math.log(values[-1] / values[0]) / math.log(sizes[-1] / sizes[0])
+    return slope, mean_y - slope * mean_x, exponent
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Profiles the memory of every render stage and checks it against "
+                                             "a budget per note")
+    ap.add_argument("--events", help="Midi events of each synthetic file", nargs="+", type=int,
+                    default=[10000, 30000, 60000])
+    ap.add_argument("--update-budget", help="Store the measured peaks per note, plus a margin, as the new budget",
+                    action="store_true")
+    ap.add_argument("--margin", help="Margin over the measured peaks with --update-budget", type=float, default=1.25)
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    parsed_args = ap.parse_args()
+    if parsed_args.child:
+        return child(parsed_args.child)
+
+    from musicbox.registry import BoxRegistry
+    pitches = BoxRegistry.load().by_index(2).pitches
+    runs = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        midi_file = os.path.join(tmp_dir, "song.mid")
+        for events in sorted(parsed_args.events):
+            write_synthetic_midi(midi_file, events, pitches)
+            run = profile(midi_file)
+            runs.append(run)
+            print(f"{run['notes']:>7} notes ({os.path.getsize(midi_file) / 1024:.0f}KB midi, "
+                  f"{run['pdf'] / 1024:.0f}KB pdf)")
+            for stage in STAGES:
+                result = run["stages"][stage]
+                print(f"    {stage:<8} peak {result['peak'] / 2 ** 20:7.1f}MB, keeps {result['retained'] / 2 ** 20:7.1f}MB,"
+                      f" RSS {result['rss'] / 2 ** 20:6.0f}MB   {'; '.join(result['sites'])}")
+
+    sizes = [run["notes"] for run in runs]
+    budget = dict()
+    if os.path.exists(BUDGET_FILE):
+        with open(BUDGET_FILE) as f:
+            budget = json.load(f)
+    print("\nGrowth per note (least squares over the sizes) and exponent (1 is linear):")
+    ok = True
+    measured = dict()
+    for stage in STAGES:
+        peak_slope, _, peak_exponent = fit(sizes, [run["stages"][stage]["peak"] for run in runs])
+        kept_slope, _, _ = fit(sizes, [run["stages"][stage]["retained"] for run in runs])
+        measured[stage] = peak_slope
+        limit = budget.get(stage)
+        over = limit is not None and peak_slope > limit
+        ok = ok and not over
+        exponent = f"{peak_exponent:.2f}" if peak_exponent is not None else "-"
+        print(f"{'FAIL' if over else 'OK  '} {stage:<8} peak {peak_slope:7.0f}B/note (budget "
+              f"{limit if limit is not None else '-'}), keeps {kept_slope:7.0f}B/note, exponent {exponent}")
+    dominant = max(STAGES, key=measured.get)
+    print(f"Largest peak per note: {dominant}")
+    if parsed_args.update_budget:
+        with open(BUDGET_FILE, "w") as f:
+            json.dump({stage: math.ceil(slope * parsed_args.margin) for stage, slope in measured.items()}, f, indent=4)
+            f.write("\n")
+        print(f"Budget updated in {BUDGET_FILE}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
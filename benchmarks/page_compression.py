@@ -0,0 +1,63 @@
+# coding=utf-8
+
+"""
+Page compression benchmark.
+
+Draws a synthetic song once per setting and times only writing the pdf, where the content streams are compressed:
+serially (as FPDF does), on a thread pool, at a faster level and uncompressed. Run from the repository root:
+
+    $ python benchmarks/page_compression.py [--holes 50000] [--box 2]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.punch_travel import synthetic_notes  # noqa: E402
+from musicbox.pdf import DEFAULT_COMPRESSION_LEVEL, Renderer, StripGenerator  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+
+def draw(music_box, notes, compression_level, compression_workers):
+    """ Renderer with every page drawn, ready to be written """
+    doc = Renderer(music_box, style=music_box.style, compression_level=compression_level,
+                   compression_workers=compression_workers)
+    doc.add_page()
+    StripGenerator(music_box_object=music_box, song_title="Title", song_author="Author", styles=doc.styles,
+                   diagnostics=doc.diagnostics).draw_strips(doc, notes, doc.strip_separation)
+    return doc
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measures the time to write the pdf for every compression setting")
+    ap.add_argument("--holes", help="Holes in the synthetic song", type=int, default=50000)
+    ap.add_argument("--box", help="Music box index, starting at 1", type=int, default=2)
+    ap.add_argument("--workers", help="Threads of the parallel runs. Defaults to the amount of cores", type=int)
+    parsed_args = ap.parse_args()
+
+    music_box = BoxRegistry.load().by_index(parsed_args.box)
+    notes = synthetic_notes(music_box, parsed_args.holes)
+    workers = parsed_args.workers or os.cpu_count()
+    settings = (("serial", DEFAULT_COMPRESSION_LEVEL, 1),
+                ("parallel", DEFAULT_COMPRESSION_LEVEL, workers),
+                ("level 1", 1, workers),
+                ("uncompressed", 0, workers))
+    baseline = None
+    for name, level, threads in settings:
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Drawing consumes the notes
+            doc = draw(music_box, list(notes), level, threads)
+        start = time.perf_counter()
+        pdf = doc.write_output()
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{name:<13} level {level}, {threads:>2} threads: {elapsed:.3f}s ({baseline / elapsed:.1f}x), "
+              f"{len(pdf) / 2 ** 20:.1f}MB, {doc.page} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# coding=utf-8
+
+"""
+Parallel midi parsing benchmark.
+
+Writes a synthetic midi file with many tracks and parses it with the midi package (Parser.render_to_box) and with
+Parser.render_tracks in one process and in a process pool, checking that all give the same notes. Run from the
+repository root:
+
+    $ python benchmarks/parallel_parse.py [--events 400000] [--tracks 16] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.streaming_memory import write_synthetic_midi  # noqa: E402
+from musicbox.midi import Parser  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compares decoding midi tracks in one process and in a process pool")
+    ap.add_argument("--events", help="Midi events of the synthetic file", type=int, default=400000)
+    ap.add_argument("--tracks", help="Tracks of the synthetic file", type=int, default=16)
+    ap.add_argument("--workers", help="Processes of the pool. Defaults to the amount of cores", type=int)
+    parsed_args = ap.parse_args()
+
+    pitches = BoxRegistry.load().by_index(2).pitches
+    workers = parsed_args.workers or os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        midi_file = os.path.join(tmp_dir, "song.mid")
+        write_synthetic_midi(midi_file, parsed_args.events, pitches, tracks=parsed_args.tracks)
+        notes, package_seconds = timed(Parser.render_to_box, midi_file)
+        serial, serial_seconds = timed(Parser.render_tracks, midi_file, workers=1)
+        parallel, parallel_seconds = timed(Parser.render_tracks, midi_file, workers=workers)
+        assert serial == notes and parallel == notes
+        print(f"{len(notes)} notes in {parsed_args.tracks} tracks ({os.path.getsize(midi_file) / 2 ** 20:.1f}MB midi)")
+        print(f"midi package: {package_seconds:.2f}s")
+        print(f"Tracks, 1 process: {serial_seconds:.2f}s ({package_seconds / serial_seconds:.1f}x)")
+        print(f"Tracks, {workers} processes: {parallel_seconds:.2f}s ({package_seconds / parallel_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# coding=utf-8
+
+"""
+Parse cache benchmark.
+
+Writes a synthetic midi file, parses it with the midi package and then loads it from a fresh NoteCache, reporting
+the time of each step. Run from the repository root:
+
+    $ python benchmarks/parse_cache.py [--events 200000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.streaming_memory import write_synthetic_midi  # noqa: E402
+from musicbox.cache import NoteCache  # noqa: E402
+from musicbox.midi import Parser  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compares parsing a midi file with loading its notes from the cache")
+    ap.add_argument("--events", help="Midi events of the synthetic file", type=int, default=200000)
+    parsed_args = ap.parse_args()
+
+    pitches = BoxRegistry.load().by_index(2).pitches
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        midi_file = os.path.join(tmp_dir, "song.mid")
+        write_synthetic_midi(midi_file, parsed_args.events, pitches)
+        with open(midi_file, "rb") as f:
+            content = f.read()
+        notes, parse_seconds = timed(Parser.render_to_box, midi_file)
+        cache = NoteCache(os.path.join(tmp_dir, "cache"))
+        _, miss_seconds = timed(cache.render_to_box, midi_file)
+        cached, hit_seconds = timed(NoteCache(cache.cache_dir).render_to_box, midi_file)
+        arrays, map_seconds = timed(cache.get, cache.key(content))
+        assert cached == notes
+        print(f"{len(notes)} notes ({len(content) / 2 ** 20:.1f}MB midi, "
+              f"{os.path.getsize(cache._path(cache.key(content))) / 2 ** 20:.1f}MB cached)")
+        print(f"Parse: {parse_seconds * 1000:.0f}ms, first cached parse: {miss_seconds * 1000:.0f}ms")
+        print(f"Cache hit: {hit_seconds * 1000:.1f}ms as notes, arrays mapped in {map_seconds * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
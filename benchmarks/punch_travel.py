@@ -0,0 +1,62 @@
+# coding=utf-8
+
+"""
+Punching order benchmark.
+
+Builds a synthetic song with the given amount of holes for a box, orders the holes of every strip and reports the
+time it took and the tool travel against punching in beat order. Run from the repository root:
+
+    $ python benchmarks/punch_travel.py [--holes 100000] [--box 2]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musicbox.midi import Parser, TICKS_PER_BEAT  # noqa: E402
+from musicbox.punch import PunchJob  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+
+def synthetic_notes(music_box, holes, notes_per_beat=6, seed=0):
+    """ Random chords, notes_per_beat notes on average, on the pitches the box can play """
+    rng = random.Random(seed)
+    notes = list()
+    beat = 0
+    while len(notes) < holes:
+        beat += rng.choice((0.5, 1, 1, 2))
+        for pitch in sorted(rng.sample(music_box.pitches, min(rng.randint(1, 2 * notes_per_beat - 1),
+                                                             len(music_box.pitches)))):
+            notes.append(Parser.make_note(pitch, int(beat * TICKS_PER_BEAT)))
+    return notes[:holes]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measures hole ordering time and travel savings")
+    ap.add_argument("--holes", help="Holes in the synthetic song", type=int, default=100000)
+    ap.add_argument("--box", help="Music box index, starting at 1", type=int, default=2)
+    ap.add_argument("--strip-length", help="(mm) Length of each strip", type=float, default=263.4)
+    parsed_args = ap.parse_args()
+
+    music_box = BoxRegistry.load().by_index(parsed_args.box)
+    notes = synthetic_notes(music_box, parsed_args.holes)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        job = PunchJob(music_box, notes, parsed_args.strip_length)
+    layout_time = time.perf_counter() - start
+    start = time.perf_counter()
+    job.optimize()
+    optimize_time = time.perf_counter() - start
+    optimized, naive = job.travel()
+    print(f"{job.holes_count()} holes in {len(job.strips)} strips ({music_box.name})")
+    print(f"Layout: {layout_time:.2f}s, ordering: {optimize_time:.2f}s")
+    print(f"Travel: {optimized / 1000:.1f}m, beat order {naive / 1000:.1f}m ({naive / optimized:.1f}x shorter)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# coding=utf-8
+
+"""
+Render session benchmark.
+
+Renders the same short song many times with a new Renderer each time and with one RenderSession, checking that the
+PDFs are the same, and reports the time per song. Run from the repository root:
+
+    $ python benchmarks/render_session.py [--songs 200] [--box 2]
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.punch_travel import synthetic_notes  # noqa: E402
+from musicbox.pdf import Renderer  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+from musicbox.session import RenderSession  # noqa: E402
+
+PAPER_SIZE = (215.9, 279.4)
+
+
+def _without_date(pdf):
+    return re.sub(rb"/CreationDate \(D:\d+\)", b"", pdf)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compares rendering songs on new Renderers and on one RenderSession")
+    ap.add_argument("--songs", help="Songs rendered each way", type=int, default=200)
+    ap.add_argument("--holes", help="Holes of each song", type=int, default=100)
+    ap.add_argument("--box", help="Music box index, starting at 1", type=int, default=2)
+    parsed_args = ap.parse_args()
+
+    music_box = BoxRegistry.load().by_index(parsed_args.box)
+    notes = synthetic_notes(music_box, parsed_args.holes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(parsed_args.songs):
+            fresh = Renderer(music_box, paper_size=PAPER_SIZE, style=music_box.style).generate(
+                None, None, song_title="Title", song_author="Author", parsed_notes=notes)
+        fresh_seconds = (time.perf_counter() - start) / parsed_args.songs
+        start = time.perf_counter()
+        session = RenderSession(music_box, paper_size=PAPER_SIZE, style=music_box.style)
+        setup_seconds = time.perf_counter() - start
+        for _ in range(parsed_args.songs):
+            reused, _ = session.render(None, None, song_title="Title", song_author="Author", parsed_notes=notes)
+        session_seconds = (time.perf_counter() - start - setup_seconds) / parsed_args.songs
+    assert _without_date(fresh) == _without_date(reused)
+    print(f"{parsed_args.songs} songs of {parsed_args.holes} holes ({music_box.name})")
+    print(f"New Renderer: {fresh_seconds * 1000:.1f}ms per song")
+    print(f"RenderSession: {session_seconds * 1000:.1f}ms per song ({fresh_seconds / session_seconds:.0f}x), "
+          f"{setup_seconds * 1000:.0f}ms setup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# coding=utf-8
+
+"""
+Peak memory benchmark for giant midi files.
+
+Writes synthetic midi files of increasing size, renders each one in a separate process with StreamingRenderer
+(and with Renderer for the smaller ones) and reports the peak RSS. Fails when the streaming peak grows more than
+--max-growth times from the smallest file to the largest. Run from the repository root:
+
+    $ python benchmarks/streaming_memory.py [--events 100000 1000000 3000000]
+"""
+import argparse
+import contextlib
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _varlen(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(data)
+
+
+def write_synthetic_midi(path, events, pitches, tracks=2, resolution=220, seed=0):
+    """
+    Writes a format 1 midi file with about the given amount of events, split in tracks.
+    Every note is a note on and a note off (using running status), with some control changes in between.
+    """
+    rng = random.Random(seed)
+    with open(path, "wb") as f:
+        f.write(b"MThd" + struct.pack(">LHHH", 6, 1, tracks, resolution))
+        for track in range(tracks):
+            f.write(b"MTrk" + struct.pack(">L", 0))
+            start = f.tell()
+            f.write(b"\x00\xff\x03" + _varlen(5) + b"Track")
+            chunk = bytearray()
+            running_status = False
+            for note in range(events // tracks // 2):
+                pitch = rng.choice(pitches)
+                delta = rng.choice((0, resolution // 4, resolution // 2, resolution))
+                if note % 32 == 0:
+                    chunk += _varlen(delta) + bytes((0xB0 | track, 7, 100))
+                    delta = 0
+                    running_status = False
+                chunk += _varlen(delta)
+                if not running_status:
+                    chunk.append(0x90 | track)
+                    running_status = True
+                # Note on, then note off as a note on with velocity 0
+                chunk += bytes((pitch, 90)) + _varlen(resolution // 8) + bytes((pitch, 0))
+                if len(chunk) > 1 << 16:
+                    f.write(chunk)
+                    chunk = bytearray()
+            f.write(chunk + b"\x00\xff\x2f\x00")
+            end = f.tell()
+            f.seek(start - 4)
+            f.write(struct.pack(">L", end - start))
+            f.seek(end)
+
+
+def child(mode, midi_file, output_file):
+    """ Renders in this process and prints the peak RSS in KB and the time in seconds """
+    from musicbox.registry import BoxRegistry
+    from musicbox.pdf import Renderer
+    from musicbox.stream import StreamingRenderer
+
+    music_box = BoxRegistry.load().by_index(2)
+    renderer = StreamingRenderer if mode == "stream" else Renderer
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        renderer(music_box, paper_size=(215.9, 279.4), style=music_box.style).generate(midi_file, output_file)
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, time.perf_counter() - start)
+
+
+def measure(mode, midi_file, output_file):
+    result = subprocess.run([sys.executable, __file__, "--child", mode, midi_file, output_file],
+                            cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True)
+    peak_kb, seconds = result.stdout.split()
+    return int(peak_kb) / 1024, float(seconds)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Checks that streaming renders keep memory flat as songs grow")
+    ap.add_argument("--events", help="Midi events of each synthetic file", nargs="+", type=int,
+                    default=[100000, 1000000, 3000000])
+    ap.add_argument("--in-memory-limit", help="Only compare with Renderer up to this many events", type=int,
+                    default=200000)
+    ap.add_argument("--max-growth", help="Max ratio between the largest and smallest streaming peaks", type=float,
+                    default=1.25)
+    ap.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    parsed_args = ap.parse_args()
+    if parsed_args.child:
+        return child(*parsed_args.child)
+
+    from musicbox.registry import BoxRegistry
+    pitches = BoxRegistry.load().by_index(2).pitches
+    peaks = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        midi_file = os.path.join(tmp_dir, "song.mid")
+        output_file = os.path.join(tmp_dir, "song.pdf")
+        for events in sorted(parsed_args.events):
+            write_synthetic_midi(midi_file, events, pitches)
+            size_mb = os.path.getsize(midi_file) / 2 ** 20
+            peak_mb, seconds = measure("stream", midi_file, output_file)
+            peaks.append(peak_mb)
+            line = f"{events:>9} events ({size_mb:.1f}MB midi, {os.path.getsize(output_file) / 2 ** 20:.1f}MB pdf): " \
+                   f"streaming {peak_mb:.0f}MB in {seconds:.1f}s"
+            if events <= parsed_args.in_memory_limit:
+                peak_mb, seconds = measure("memory", midi_file, output_file)
+                line += f", in memory {peak_mb:.0f}MB in {seconds:.1f}s"
+            print(line)
+    growth = peaks[-1] / peaks[0]
+    ok = growth <= parsed_args.max_growth
+    print(f"{'OK  ' if ok else 'FAIL'} streaming peak grew {growth:.2f}x (max {parsed_args.max_growth}x)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
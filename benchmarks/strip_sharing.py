@@ -0,0 +1,65 @@
+# coding=utf-8
+
+"""
+Strip sharing benchmark.
+
+Renders a song made of a repeated chorus with and without share_strips, and reports the PDF size, the time and
+what sharing saved. Run from the repository root:
+
+    $ python benchmarks/strip_sharing.py [--repeat 40] [--box 2]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from musicbox.midi import Parser, TICKS_PER_BEAT  # noqa: E402
+from musicbox.pdf import Renderer, Strip  # noqa: E402
+from musicbox.registry import BoxRegistry  # noqa: E402
+
+SONG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "tests",
+                    "test6_longer_song.mid")
+
+
+def chorus_song(music_box, repeat, chorus_strips=2):
+    """
+    The first chorus_strips strips of the example song, repeated. Each repeat starts on a new strip, like a
+    chorus copied verbatim, so strips repeat their holes
+    """
+    doc = Renderer(music_box, style=music_box.style)
+    strip_beats = Strip.beats_in(doc.w - doc.l_margin - doc.r_margin, music_box.beat_width)
+    notes = Parser.render_to_box(SONG)
+    length = chorus_strips * strip_beats * TICKS_PER_BEAT
+    chorus = [note for note in notes if note["tick"] < length]
+    return [Parser.at_tick(note, note["tick"] + i * length) for i in range(repeat) for note in chorus]
+
+
+def render(music_box, notes, share_strips):
+    doc = Renderer(music_box, style=music_box.style, share_strips=share_strips)
+    start = time.perf_counter()
+    pdf = doc.generate(None, None, "Chorus", "Benchmark", parsed_notes=notes)
+    return doc, pdf, time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measures what sharing identical strips saves")
+    ap.add_argument("--repeat", help="Times the chorus is repeated", type=int, default=40)
+    ap.add_argument("--box", help="Music box index, starting at 1", type=int, default=2)
+    parsed_args = ap.parse_args()
+
+    music_box = BoxRegistry.load().by_index(parsed_args.box)
+    notes = chorus_song(music_box, parsed_args.repeat)
+    _, inline_pdf, inline_seconds = render(music_box, notes, False)
+    doc, shared_pdf, shared_seconds = render(music_box, notes, True)
+    summary = doc.sharing_summary()
+    print(f"{len(notes)} notes, {summary['strips']} strips shared as {summary['forms']} forms ({music_box.name})")
+    print(f"Inline: {len(inline_pdf) / 1024:.0f}KB in {inline_seconds:.2f}s")
+    print(f"Shared: {len(shared_pdf) / 1024:.0f}KB in {shared_seconds:.2f}s")
+    print(f"Saved {summary['operators_saved']} operators, {summary['bytes_saved'] / 1024:.0f}KB of content "
+          f"before compression, about {summary['seconds_saved']:.2f}s of drawing")
+
+
+if __name__ == "__main__":
+    main()
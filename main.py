@@ -5,13 +5,49 @@ Contains all the logic to generate the paper strips
 """
 import os
 import argparse
-import yaml
-from musicbox.box import MusicBox
-from musicbox.pdf import Renderer
+import struct
+import time
 from musicbox.midi import Parser
+from musicbox.paper import PAPER_SIZES
+from musicbox.registry import BoxRegistry
 
+# yaml, fpdf and the midi package are imported where they're used, so that --help, argument errors and
+# --dry-run don't pay for them. See benchmarks/import_time.py
 
-def parse_args(parsed_boxes):
+
+def box_arg(s):
+    """ argparse type of a box: an index starting at 1, a name (see resolve_box) or 'auto' """
+    if s.strip().lower() == "auto":
+        return "auto"
+    if s.strip().isdigit() and int(s) < 1:
+        raise argparse.ArgumentTypeError(f"Box index must start at 1, got '{s}'")
+    return s.strip()
+
+
+def paper_size_arg(s):
+    """ argparse type of a paper size: a name from PAPER_SIZES or WIDTHxHEIGHT in mm """
+    if s.lower() in PAPER_SIZES:
+        return PAPER_SIZES[s.lower()]
+    try:
+        width, height = (float(v) for v in s.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Unknown paper size '{s}'")
+    return width, height
+
+
+def resolve_box(registry, box):
+    """ Index starting at 1 of a box given to box_arg, the last one if None, or 'auto'. Exits on unknown boxes """
+    if box is None:
+        return len(registry)
+    if box == "auto":
+        return box
+    try:
+        return registry.index_of(registry.find(box))
+    except KeyError as e:
+        raise SystemExit(e.args[0])
+
+
+def parse_args():
     def _midi_file(s):
         # check if exists
         if not os.path.exists(s):
@@ -19,8 +55,8 @@ def parse_args(parsed_boxes):
         _, ext = os.path.splitext(s)
         if ext.lower() != ".mid":
             raise argparse.ArgumentTypeError("Unsupported extension: '{}'. Use a midi file only".format(s))
-        # Check if valid midi file
-        if not Parser.file_is_valid(s):
+        # Check if it looks like a midi file. It's fully parsed later
+        if not Parser.has_midi_header(s):
             raise argparse.ArgumentTypeError("Unable to process midi file")
 
         return s
@@ -37,11 +73,6 @@ def parse_args(parsed_boxes):
             raise argparse.ArgumentTypeError("Directory '{}' doesn't exist".format(s))
         return s
 
-    def _existing_box(s):
-        if not 1 <= int(s) <= len(parsed_boxes):
-            raise argparse.ArgumentTypeError(f'Box index {s} out of range ({len(parsed_boxes)} boxes were found in definition)')
-        return int(s)
-
     ap = argparse.ArgumentParser(description="MIDI Music paper strips generator for Kikkerland's music box")
     ap.add_argument("midi_file", metavar="MIDI_FILE", type=_midi_file, help="MIDI file to parse")
     ap.add_argument("song_title", metavar="SONG_TITLE", type=_title_string, help="Title of the song")
@@ -51,66 +82,491 @@ def parse_args(parsed_boxes):
 
     ap.add_argument("--paper_size", "-s", help="(mm) Size of the paper where to print", nargs=2, default=[215.9, 279.4],
                     type=float)
-    ap.add_argument("--box", "-b", help="Music box to use, from musicboxes.yml", type=_existing_box, default=0)
+    ap.add_argument("--box", "-b", help="Music box to use, from musicboxes.yml. Index starting at 1 (defaults to the "
+                                        "last one), name, or 'auto' to pick the box that can play most of the song",
+                    type=box_arg)
+    ap.add_argument("--dry-run", help="Only check the arguments and show what would be generated",
+                    action="store_true")
+    ap.add_argument("--transpose", "-t", help="Semitones to shift every note", type=int, default=0)
+    ap.add_argument("--auto-transpose", help="Pick the shift that maximizes the notes the box can play",
+                    action="store_true")
+    ap.add_argument("--transpose-range", help="Max semitones to try in either direction with --auto-transpose",
+                    type=int, default=12)
+    ap.add_argument("--fold-octaves", help="Move notes outside the box range by octaves until they fit",
+                    action="store_true")
+    ap.add_argument("--watch", help="Keep running and update the output every time the midi file changes. Only the "
+                                    "strips that changed are drawn again", action="store_true")
+    ap.add_argument("--columns", help="Cut strips in this many columns per page and pack them to save paper",
+                    type=int)
+    ap.add_argument("--optimize-paper", help="Pick the paper size, orientation and beat width using the least pages",
+                    action="store_true")
+    ap.add_argument("--paper-sizes", help="Paper sizes allowed with --optimize-paper or rendered with --matrix, as names ({}) or WIDTHxHEIGHT "
+                                          "in mm. Defaults to --paper_size".format(", ".join(PAPER_SIZES)),
+                    nargs="+", type=paper_size_arg)
+    ap.add_argument("--beat-width-range", help="(mm) Beat widths allowed with --optimize-paper. Defaults to half to "
+                                               "double the box's", nargs=2, type=float, metavar=("MIN", "MAX"))
+    ap.add_argument("--min-hole-spacing", help="(mm) Minimum distance between holes of the same pin. Defaults to the "
+                                               "hole diameter", type=float)
+    ap.add_argument("--overlaps", help="Holes closer than a hole diameter, on the same or nearby pins: report them, "
+                                       "fix them by dropping the later hole, or ignore them",
+                    choices=["report", "fix", "ignore"], default="report")
+    ap.add_argument("--svg", help="Write an SVG preview of each page instead of the PDF", action="store_true")
+    ap.add_argument("--punch", help="Write the holes of each strip for a CNC or plotter instead of the PDF, in an "
+                                    "order that keeps travel short", choices=["gcode", "dxf"])
+    ap.add_argument("--wav", help="Write a WAV of what the strips will play on the box instead of the PDF",
+                    action="store_true")
+    ap.add_argument("--feed-speed", help="(mm/s) Paper speed through the box for --wav. Defaults to the box's",
+                    type=float)
+    ap.add_argument("--stream", help="Read the midi file and write the PDF page by page, so memory stays the same for "
+                                     "songs of any length", action="store_true")
+    ap.add_argument("--share-strips", help="Draw the strip grid and each repeated pattern of holes once and reuse "
+                                           "them. Makes songs with repeated parts much smaller", action="store_true")
+    ap.add_argument("--compression", help="zlib level of the PDF content streams, from 1 (fastest) to 9 (smallest). "
+                                          "0 leaves them uncompressed: bigger files, written faster, for local "
+                                          "previews", type=int, choices=range(10), default=6, metavar="LEVEL")
+    ap.add_argument("--matrix", help="Render one PDF for every combination of --boxes, --paper-sizes and "
+                                     "--transpositions, parsing the song once, and compare them", action="store_true")
+    ap.add_argument("--boxes", help="Boxes rendered with --matrix, as indexes or names. Defaults to all", nargs="+",
+                    type=box_arg)
+    ap.add_argument("--transpositions", help="Semitones tried with --matrix. Defaults to --transpose", nargs="+",
+                    type=int)
+    ap.add_argument("--no-cache", help="Parse the midi file even if its notes are cached from a previous run",
+                    action="store_true")
+    ap.add_argument("--parse-workers", help="Processes decoding the midi tracks concurrently. Defaults to one per core",
+                    type=int)
+    ap.add_argument("--verbosity", "-v", help="0: no report of skipped notes, 1: counts per reason, 2: also sample "
+                                              "notes and the loaded boxes", type=int, choices=[0, 1, 2], default=1)
     args = ap.parse_args()
+    if args.watch and args.columns is not None:
+        ap.error("--watch can't be used with --columns")
+    if (args.svg or args.punch) and (args.watch or args.columns is not None):
+        ap.error("--svg and --punch can't be used with --watch or --columns")
+    if args.svg and args.punch:
+        ap.error("--svg can't be used with --punch")
+    if args.wav and (args.watch or args.svg or args.punch):
+        ap.error("--wav can't be used with --watch, --svg or --punch")
+    if args.stream and (args.watch or args.columns is not None or args.svg or args.punch or args.wav or
+                        args.optimize_paper):
+        ap.error("--stream can't be used with --watch, --columns, --svg, --punch, --wav or --optimize-paper")
+    if args.matrix and (args.watch or args.svg or args.punch or args.wav or args.stream or args.optimize_paper or
+                        args.auto_transpose or args.share_strips):
+        ap.error("--matrix can't be used with --watch, --svg, --punch, --wav, --stream, --optimize-paper, "
+                 "--auto-transpose or --share-strips")
+    if args.parse_workers is not None and args.parse_workers < 1:
+        ap.error("--parse-workers must be at least 1")
+    if args.transpose_range < 0:
+        ap.error("--transpose-range can't be negative")
+    if args.matrix and "auto" in (args.boxes or []):
+        ap.error("--matrix takes explicit boxes")
+    if args.share_strips and (args.watch or args.svg or args.punch):
+        ap.error("--share-strips can't be used with --watch, --svg or --punch")
     if not args.output_dir:
         args.output_dir = os.path.dirname(args.midi_file)
     return args
 
 
-def load_music_boxes():
-    settings_file = "musicboxes.yml"
-    if not os.path.isfile(settings_file) or not settings_file.strip().lower().endswith(".yml"):
-        raise IOError("No valid music boxes config file could be found!!")
+def load_music_boxes(verbose=True):
+    try:
+        registry = BoxRegistry.load()
+    except ValueError as e:
+        raise SystemExit(f"Invalid music boxes config file: {e}")
+    if verbose:
+        print("Loaded '{}'".format(registry.settings_file))
+        print(f"Settings file version: {registry.version}\n")
+
+        print("Definitions found:")
+        [ print(f"\t{index+1}: {box.description} ({box.name})") for index, box in enumerate(registry) ]
+
+        print(f"Total boxes: {len(registry)}\n")
+
+    return registry
+
+
+def fit_song(notes, music_boxes, box, transpose=0, auto_transpose=False, transpose_range=12, fold_octaves=False):
+    """
+    Picks the music box and transposition for a song, and applies them.
+
+    Parameters
+    ----------
+    notes: list
+        Notes as returned by Parser.render_to_box
+    music_boxes: list
+        MusicBox instances, in musicboxes.yml order
+    box: Box index starting at 1, or "auto" to use the one that plays most notes
+    transpose: Semitones to shift. Ignored if auto_transpose is set
+    auto_transpose: Whether to pick the shift that maximizes playable notes
+    transpose_range: Max semitones to try in either direction with auto_transpose
+    fold_octaves: Whether to move notes outside the box range by octaves until they fit
+
+    Returns
+    -------
+    tuple
+        (box index starting at 0, fitted notes, lines describing the choice, see choose_fit)
+    """
+    box_index, shift, report = choose_fit(notes, music_boxes, box, transpose, auto_transpose, transpose_range,
+                                          fold_octaves)
+    musicbox = music_boxes[box_index]
+    notes = Parser.transpose(notes, shift)
+    if fold_octaves:
+        notes = Parser.fit_octaves(notes, musicbox)
+    return box_index, notes, report
+
+
+def choose_fit(notes, music_boxes, box, transpose=0, auto_transpose=False, transpose_range=12, fold_octaves=False):
+    """
+    Picks the music box and transposition for a song, like fit_song, without applying them.
+    notes can be any iterable: it's read once, and only if the box or the shift are automatic.
+
+    Returns
+    -------
+    tuple
+        (box index starting at 0, semitones to shift, lines describing the box and the automatic choices). Nothing is
+        printed: the command line shows the lines with print_fit
+    """
+    report = list()
+    shift = transpose
+    histogram = Parser.pitch_histogram(notes) if box == "auto" or auto_transpose else None
+    if box == "auto":
+        if auto_transpose:
+            box_index, shift, playable = Parser.best_box(None, music_boxes,
+                                                         max_shift=transpose_range,
+                                                         fold_octaves=fold_octaves,
+                                                         histogram=histogram)
+        else:
+            # Shifting the histogram is the same as shifting the notes
+            shifted = [0] * 128
+            for pitch, count in enumerate(histogram):
+                if 0 <= pitch + shift < 128:
+                    shifted[pitch + shift] = count
+            box_index, _, playable = Parser.best_box(None, music_boxes, fold_octaves=fold_octaves,
+                                                     histogram=shifted)
+        report.append(f"Auto box selection: {box_index + 1}, {shift:+d} semitones ({playable}/{sum(histogram)} notes "
+                      f"playable)")
+    else:
+        box_index = box - 1
+    musicbox = music_boxes[box_index]
+    report.append(f"\n {musicbox}")
+
+    if auto_transpose and box != "auto":
+        shift, playable = Parser.best_transposition(None, musicbox,
+                                                    max_shift=transpose_range,
+                                                    fold_octaves=fold_octaves,
+                                                    histogram=histogram)
+        report.append(f"Auto transposition: {shift:+d} semitones ({playable}/{sum(histogram)} notes playable)")
+    return box_index, shift, report
+
+
+def print_fit(report):
+    """ Shows the box and transposition picked by choose_fit """
+    for line in report:
+        print(line)
+
+
+def report_skipped(notes, musicbox, verbosity):
+    """ Prints the notes the box can't play, for outputs that don't go through Renderer """
+    from musicbox.diagnostics import Diagnostics
+
+    diagnostics = Diagnostics()
+    diagnostics.check_notes(notes, musicbox)
+    diagnostics.print_summary(verbosity)
+
+
+def check_overlaps(notes, musicbox, fix, verbosity):
+    """ Reports the holes that overlap, or drops them if fix is set. Returns the notes to draw """
+    from musicbox.diagnostics import Diagnostics
+    from musicbox.holes import HoleOverlaps
+
+    holes = HoleOverlaps(musicbox)
+    if fix:
+        notes, dropped = holes.fix(notes)
+        print_overlaps(holes, fix, len(dropped), [Diagnostics.format_note(note) for note in dropped[:5]], verbosity)
+        return notes
+    overlaps = holes.find(notes)
+    print_overlaps(holes, fix, len(overlaps), [holes.describe(notes, overlap) for overlap in overlaps[:5]], verbosity)
+    return notes
+
+
+def print_overlaps(holes, fix, count, samples, verbosity):
+    """ Shows the overlapping pairs found, or the holes dropped if fix is set, with a few samples """
+    if not count or verbosity < 1:
+        return
+    if fix:
+        print(f"Dropped {count} holes overlapping earlier ones (closer than {holes.diameter:g}mm)")
+    else:
+        print(f"Found {count} pairs of overlapping holes (closer than {holes.diameter:g}mm). "
+              f"Use --overlaps fix to drop the later hole of each")
+    if verbosity >= 2:
+        print(f"\t{', '.join(samples)}{', ...' if count > len(samples) else ''}")
+
+
+def report_sharing(doc):
+    summary = doc.sharing_summary()
+    print(f"Shared {summary['strips']} strips as {summary['forms']} forms. Saved {summary['operators_saved']} "
+          f"operators, {summary['bytes_saved'] / 1024:.0f}KB before compression and about "
+          f"{summary['seconds_saved'] * 1000:.0f}ms of drawing")
 
-    # Try to parse file settings
-    settings_dict = yaml.load(open(settings_file))
-    print("Loaded '{}'".format(settings_file))
-    print(f"Settings file version: {settings_dict['version']}\n")
 
-    print("Definitions found:")
-    [ print(f"\t{index+1}: {box['meta']['description']}") for index, box in enumerate(settings_dict['boxes']) ]
+def render_matrix(parsed_args, registry, notes, pdf_name):
+    """ Renders every combination of boxes, paper sizes and transpositions, and prints the comparison table """
+    from musicbox.matrix import RenderMatrix
 
-    print(f"Total boxes: {len(settings_dict['boxes'])}\n")
+    try:
+        boxes = [registry.index_of(registry.find(box)) - 1 for box in parsed_args.boxes or range(1, len(registry) + 1)]
+    except KeyError as e:
+        raise SystemExit(e.args[0])
+    matrix = RenderMatrix(notes, list(registry), boxes,
+                          paper_sizes=parsed_args.paper_sizes or [parsed_args.paper_size],
+                          transpositions=parsed_args.transpositions or [parsed_args.transpose],
+                          song_title=parsed_args.song_title,
+                          song_author=parsed_args.song_author,
+                          fold_octaves=parsed_args.fold_octaves,
+                          columns=parsed_args.columns,
+                          overlaps=parsed_args.overlaps)
+    print(f"Rendering {len(matrix.combinations)} combinations...")
+    start = time.perf_counter()
+    results = matrix.run(parsed_args.output_dir, os.path.splitext(pdf_name)[0])
+    print(matrix.table(results))
+    print(f"Done in {time.perf_counter() - start:.2f}s. Generated in '{parsed_args.output_dir}'")
 
-    return settings_dict['boxes']
+
+def stream_song(parsed_args, music_boxes, paper_size, output_file):
+    """
+    Renders the song without holding it in memory. The midi file is read incrementally, and once more before that
+    if the box or the shift are automatic.
+    """
+    from musicbox.holes import HoleOverlaps, OverlapStream
+    from musicbox.stream import StreamingRenderer
+
+    try:
+        box_index, shift, report = choose_fit(Parser.iter_notes(parsed_args.midi_file), music_boxes, parsed_args.box,
+                                              transpose=parsed_args.transpose,
+                                              auto_transpose=parsed_args.auto_transpose,
+                                              transpose_range=parsed_args.transpose_range,
+                                              fold_octaves=parsed_args.fold_octaves)
+        print_fit(report)
+        musicbox = music_boxes[box_index]
+        doc = StreamingRenderer(musicbox,
+                                strip_separation=0,
+                                paper_size=paper_size,
+                                style=musicbox.style,
+                                share_strips=parsed_args.share_strips,
+                                compression_level=parsed_args.compression)
+        notes = Parser.iter_fitted(Parser.iter_notes(parsed_args.midi_file), shift,
+                                   musicbox if parsed_args.fold_octaves else None)
+        overlaps = None
+        if parsed_args.overlaps != "ignore":
+            # Overlaps only involve holes close to each other, so they're checked as the notes are read
+            overlaps = OverlapStream(HoleOverlaps(musicbox), fix=parsed_args.overlaps == "fix")
+            notes = overlaps.filter(notes)
+        print("Starting document generation (streaming)...")
+        doc.generate(midi_file=None,
+                     output_file=output_file,
+                     song_title=parsed_args.song_title,
+                     song_author=parsed_args.song_author,
+                     parsed_notes=notes)
+    except (TypeError, ValueError, AssertionError, struct.error) as e:
+        raise SystemExit(f"Unable to process midi file: {e}")
+    if overlaps is not None:
+        print_overlaps(overlaps.holes, overlaps.fix, overlaps.count, overlaps.samples, parsed_args.verbosity)
+    doc.diagnostics.print_summary(parsed_args.verbosity)
+    if parsed_args.share_strips:
+        report_sharing(doc)
+    print("Done. Generated as '{}'".format(output_file))
+
+
+def read_notes(parsed_args):
+    """ Notes of the midi file, from the parse cache unless --no-cache is set """
+    from musicbox.cache import NoteCache
+
+    if parsed_args.no_cache:
+        return Parser.render_tracks(parsed_args.midi_file, workers=parsed_args.parse_workers)
+    return NoteCache().render_to_box(parsed_args.midi_file, workers=parsed_args.parse_workers)
+
+
+def watch_song(parsed_args, music_boxes, box_index, notes, paper_size, orientation, output_file):
+    """ Renders the song, then renders it again every time the midi file changes, until interrupted """
+    from musicbox.watch import IncrementalRenderer, watch_file
+
+    musicbox = music_boxes[box_index]
+    renderer = IncrementalRenderer(musicbox,
+                                   song_title=parsed_args.song_title,
+                                   song_author=parsed_args.song_author,
+                                   paper_size=paper_size,
+                                   style=musicbox.style,
+                                   orientation=orientation,
+                                   compression_level=parsed_args.compression)
+    renderer.update(notes)
+    renderer.write(output_file)
+    report_skipped(notes, musicbox, parsed_args.verbosity)
+    print("Done. Generated as '{}'. Watching '{}' for changes (Ctrl+C to stop)".format(output_file,
+                                                                                     parsed_args.midi_file))
+
+    def _on_change():
+        start = time.perf_counter()
+        try:
+            changed_notes = read_notes(parsed_args)
+        except Exception as e:
+            print(f"Unable to process midi file: {e}")
+            return
+        # Keep the box so strips stay in place
+        _, changed_notes, report = fit_song(changed_notes, music_boxes, box_index + 1,
+                                            transpose=parsed_args.transpose,
+                                            auto_transpose=parsed_args.auto_transpose,
+                                            transpose_range=parsed_args.transpose_range,
+                                            fold_octaves=parsed_args.fold_octaves)
+        print_fit(report)
+        if parsed_args.overlaps != "ignore":
+            changed_notes = check_overlaps(changed_notes, musicbox, parsed_args.overlaps == "fix",
+                                           parsed_args.verbosity)
+        redrawn = renderer.update(changed_notes)
+        renderer.write(output_file)
+        report_skipped(changed_notes, musicbox, parsed_args.verbosity)
+        print(f"Updated '{output_file}': {redrawn}/{len(renderer.strips)} strips redrawn "
+              f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    try:
+        watch_file(parsed_args.midi_file, _on_change)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
     # Get and parse args
-    parsed_boxes = load_music_boxes()
-    parsed_args = parse_args(parsed_boxes)
-    # Check if selected box exists
-    box_def = parsed_boxes[parsed_args.box - 1]
-    musicbox = MusicBox(**box_def)
-    print("\n", musicbox)
+    parsed_args = parse_args()
+    registry = load_music_boxes(verbose=parsed_args.verbosity >= 2)
+    parsed_args.box = resolve_box(registry, parsed_args.box)
+
+    # Create unique pdf name located where midi file is
+    pdf_name_core = "{}".format(os.path.splitext(os.path.basename(parsed_args.midi_file))[0])
+    pdf_name = "{}.pdf".format(pdf_name_core)
+    n = 0
+    while os.path.exists(os.path.join(parsed_args.output_dir, "{}".format(pdf_name))):
+        n += 1
+        pdf_name = "{}_{}.pdf".format(pdf_name_core, n)
+    if parsed_args.dry_run:
+        print("Dry run. Would generate '{}' with box {} on paper {}".format(
+            os.path.join(parsed_args.output_dir, pdf_name), parsed_args.box, parsed_args.paper_size))
+        return
+
+    music_boxes = list(registry)
+    if parsed_args.stream:
+        stream_song(parsed_args, music_boxes, parsed_args.paper_size, os.path.join(parsed_args.output_dir, pdf_name))
+        return
+
+    from musicbox.pdf import Renderer
+    from musicbox.layout import LayoutPlanner
+    try:
+        notes = read_notes(parsed_args)
+    except Exception as e:
+        raise SystemExit(f"Unable to process midi file: {e}")
+    if parsed_args.matrix:
+        render_matrix(parsed_args, registry, notes, pdf_name)
+        return
+    box_index, notes, report = fit_song(notes, music_boxes, parsed_args.box,
+                                        transpose=parsed_args.transpose,
+                                        auto_transpose=parsed_args.auto_transpose,
+                                        transpose_range=parsed_args.transpose_range,
+                                        fold_octaves=parsed_args.fold_octaves)
+    print_fit(report)
+    musicbox = music_boxes[box_index]
+
+    paper_size = parsed_args.paper_size
+    orientation = "l"
+    if parsed_args.optimize_paper:
+        planner = LayoutPlanner(musicbox, notes,
+                                min_hole_spacing=parsed_args.min_hole_spacing,
+                                song_title=parsed_args.song_title,
+                                song_author=parsed_args.song_author)
+        beat_widths = LayoutPlanner.beat_width_range(*(parsed_args.beat_width_range or
+                                                       [musicbox.beat_width / 2, musicbox.beat_width * 2]))
+        try:
+            best = planner.optimize(parsed_args.paper_sizes or [paper_size], beat_widths)
+        except ValueError as e:
+            raise SystemExit(e)
+        paper_size, orientation = best["paper_size"], best["orientation"]
+        musicbox.beat_width = best["beat_width"]
+        print(f"Optimized layout: {best['pages']} pages, {best['strips']} strips, paper {paper_size} "
+              f"({orientation}), beat width {best['beat_width']}mm")
+    if parsed_args.overlaps != "ignore":
+        notes = check_overlaps(notes, musicbox, parsed_args.overlaps == "fix", parsed_args.verbosity)
+
+    if parsed_args.wav:
+        from musicbox.audio import AudioPreview
+        report_skipped(notes, musicbox, parsed_args.verbosity)
+        audio = AudioPreview(musicbox, feed_speed=parsed_args.feed_speed)
+        wav_file = os.path.join(parsed_args.output_dir, "{}.wav".format(os.path.splitext(pdf_name)[0]))
+        duration = audio.write_wav(notes, wav_file)
+        print(f"{duration:.1f}s at {audio.beats_per_second:.2f} beats per second")
+        print("Done. Generated as '{}'".format(wav_file))
+        return
+
+    if parsed_args.svg:
+        from musicbox.svg import SvgPreview
+        report_skipped(notes, musicbox, parsed_args.verbosity)
+        preview = SvgPreview(musicbox,
+                             song_title=parsed_args.song_title,
+                             song_author=parsed_args.song_author,
+                             paper_size=paper_size,
+                             style=musicbox.style,
+                             orientation=orientation)
+        for page, svg in enumerate(preview.render_pages(notes), 1):
+            svg_file = os.path.join(parsed_args.output_dir, "{}_page{}.svg".format(os.path.splitext(pdf_name)[0], page))
+            with open(svg_file, "w") as f:
+                f.write(svg)
+            print("Generated '{}'".format(svg_file))
+        return
 
     # Generate instance
     doc = Renderer(musicbox,
                                strip_separation=0,
-                               paper_size=parsed_args.paper_size,
-                               style=box_def['style'])
+                               paper_size=paper_size,
+                               style=musicbox.style,
+                               orientation=orientation,
+                               share_strips=parsed_args.share_strips,
+                               compression_level=parsed_args.compression)
 
     print("Will generate with settings:\n"
           "\tPaper size: {paper_size} (Warning: HP p1102w printer supported dimensions are [76.2-215.9]x[127-356]\n"
           "\tOutput dir: {out_dir}\n"
-          .format(paper_size=parsed_args.paper_size,
+          .format(paper_size=paper_size,
                   out_dir=parsed_args.output_dir))
 
+    if parsed_args.punch:
+        from musicbox.punch import PunchJob
+        report_skipped(notes, musicbox, parsed_args.verbosity)
+        job = PunchJob(musicbox, notes, doc.w - doc.l_margin - doc.r_margin,
+                       song_title=parsed_args.song_title,
+                       song_author=parsed_args.song_author,
+                       style=musicbox.style)
+        job.optimize()
+        travel, naive_travel = job.travel()
+        punch_file = os.path.join(parsed_args.output_dir,
+                                  "{}.{}".format(os.path.splitext(pdf_name)[0], parsed_args.punch))
+        with open(punch_file, "w") as f:
+            if parsed_args.punch == "gcode":
+                job.write_gcode(f)
+            else:
+                job.write_dxf(f)
+        print(f"{job.holes_count()} holes in {len(job.strips)} strips. Travel: {travel / 1000:.2f}m "
+              f"({naive_travel / 1000:.2f}m in beat order)")
+        print("Done. Generated as '{}'".format(punch_file))
+        return
+
     print("Starting document generation...")
-    # Create unique pdf name located where midi file is
-    midi_folder = os.path.dirname(parsed_args.midi_file)
-    pdf_name_core = "{}".format(os.path.splitext(os.path.basename(parsed_args.midi_file))[0])
-    pdf_name = "{}.pdf".format(pdf_name_core)
-    n = 0
-    while os.path.exists(os.path.join(parsed_args.output_dir, "{}".format(pdf_name))):
-        n += 1
-        pdf_name = "{}_{}.pdf".format(pdf_name_core, n)
+    if parsed_args.watch:
+        watch_song(parsed_args, music_boxes, box_index, notes, paper_size, orientation,
+                   os.path.join(parsed_args.output_dir, pdf_name))
+        return
     # generate
     doc.generate(midi_file=parsed_args.midi_file,
                  output_file=os.path.join(parsed_args.output_dir, pdf_name),
                  song_title=parsed_args.song_title,
-                 song_author=parsed_args.song_author)
+                 song_author=parsed_args.song_author,
+                 parsed_notes=notes,
+                 columns=parsed_args.columns)
+    doc.diagnostics.print_summary(parsed_args.verbosity)
+    if parsed_args.share_strips:
+        report_sharing(doc)
 
     print("Done. Generated as '{}'".format(os.path.join(parsed_args.output_dir, pdf_name)))
 
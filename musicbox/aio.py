@@ -0,0 +1,145 @@
+"""
+Asyncio API: renders without blocking the event loop.
+
+Parsing and drawing run in an executor, one page at a time, and every page is written to the output as soon as it's
+ready. Between pages the event loop is free, which is also where cancellation takes effect.
+
+    pdf = io.BytesIO()
+    await render_async(music_box, "song.mid", pdf, song_title="Song", song_author="Author")
+"""
+import asyncio
+import io
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from .midi import Parser
+from .stream import StreamingRenderer
+
+# Renders in progress at once per event loop when no pool is given
+DEFAULT_CONCURRENCY = 8
+
+
+class AsyncRenderPool:
+    """
+    Limits how many renders are in progress at once. Renders beyond max_concurrent wait for a free slot.
+
+    Drawing is pure Python and holds the GIL, so by default every step runs on a single thread shared by the renders
+    of the pool: renders in progress take turns page by page, and the event loop only waits for the GIL once per
+    switch interval. With more threads they would queue for the GIL in front of the event loop.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_CONCURRENCY, executor=None):
+        """
+
+        Parameters
+        ----------
+        max_concurrent: Renders in progress at once
+        executor: concurrent.futures.Executor for parsing, drawing and file writes. Defaults to a single thread.
+            Steps share state with the render, so it can't be a process pool
+        """
+        self.max_concurrent = max_concurrent
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="musicbox-render")
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def render(self, music_box_object, midi_file, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR",
+                     parsed_notes=None, paper_size=(279.4, 215.9), strip_separation=0, style={}, orientation="l"):
+        """
+        Renders a song like Renderer.generate. Cancelling it stops after the page being drawn.
+        An output file given by path is removed if the render doesn't finish.
+
+        Parameters
+        ----------
+        music_box_object: MusicBox
+        midi_file: Path or binary file object with the midi file
+        output_file: Path, binary file object or asyncio.StreamWriter where the pdf will be written, page by page
+        song_title
+        song_author
+        parsed_notes: Notes sorted by beat, like Parser.render_to_box. If given, midi_file is not read
+        paper_size
+        strip_separation
+        style
+        orientation
+
+        Returns
+        -------
+        Diagnostics
+            Notes that couldn't be drawn and pages written
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            if parsed_notes is None:
+                parsed_notes = await self._run(loop, Parser.render_to_box, midi_file)
+            doc = StreamingRenderer(music_box_object, paper_size=paper_size, strip_separation=strip_separation,
+                                    style=style, orientation=orientation)
+            buffer = io.BytesIO()
+            strips = doc.iter_strips(parsed_notes, buffer, song_title, song_author)
+            own_file = None
+            done = False
+            try:
+                if isinstance(output_file, str):
+                    own_file = await self._run(loop, open, output_file, "wb")
+                    output_file = own_file
+                while not done:
+                    done = await self._run(loop, self._draw_page, strips)
+                    data = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                    await self._write(loop, output_file, data)
+            finally:
+                strips.close()
+                if own_file is not None:
+                    await self._run(loop, own_file.close)
+                    if not done:
+                        await self._run(loop, os.remove, own_file.name)
+            return doc.diagnostics
+
+    @staticmethod
+    def _draw_page(strips):
+        """ Draws strips until one lands on a new page, so the previous page gets written. True when done """
+        first_page = None
+        for page in strips:
+            if first_page is None:
+                first_page = page
+            elif page != first_page:
+                return False
+        return True
+
+    async def _write(self, loop, output_file, data):
+        if not data:
+            return
+        if hasattr(output_file, "drain"):
+            output_file.write(data)
+            await output_file.drain()
+        else:
+            await self._run(loop, output_file.write, data)
+
+    async def _run(self, loop, func, *args):
+        """ Runs func in the executor. If cancelled meanwhile, waits for it to finish, since threads can't be stopped """
+        future = loop.run_in_executor(self.executor, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+
+# One default pool per event loop, as semaphores can't be shared between loops
+_default_pools = weakref.WeakKeyDictionary()
+
+
+async def render_async(music_box_object, midi_file, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR",
+                       parsed_notes=None, paper_size=(279.4, 215.9), strip_separation=0, style={}, orientation="l",
+                       pool=None):
+    """
+    Renders a song without blocking the event loop. See AsyncRenderPool.render.
+    Without a pool, renders share one allowing DEFAULT_CONCURRENCY renders at once.
+    """
+    if pool is None:
+        loop = asyncio.get_running_loop()
+        pool = _default_pools.get(loop)
+        if pool is None:
+            pool = _default_pools[loop] = AsyncRenderPool()
+    return await pool.render(music_box_object, midi_file, output_file, song_title=song_title,
+                             song_author=song_author, parsed_notes=parsed_notes, paper_size=paper_size,
+                             strip_separation=strip_separation, style=style, orientation=orientation)
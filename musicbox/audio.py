@@ -0,0 +1,123 @@
+"""
+Audio preview: what the strips will sound like on the box, as a WAV file.
+
+Only the holes Strip draws are played (notes the box can't play are dropped, like on paper), at the speed the box
+feeds the paper. Each pin has its own tone, a plucked tooth of the comb: the bending modes of a cantilever, the
+higher ones fading faster, and low teeth ringing longer than high ones. Tones are mixed with NumPy, pin by pin.
+"""
+import wave
+
+import numpy as np
+
+from .midi import TICKS_PER_BEAT
+
+DEFAULT_SAMPLE_RATE = 22050
+# Frequency ratios and relative amplitudes of the first bending modes of a tooth (a clamped cantilever)
+COMB_MODES = ((1.0, 1.0), (6.267, 0.3), (17.547, 0.08))
+# (s) Decay time of the fundamental of a C4 tooth. Lower teeth ring longer
+DECAY_C4 = 0.45
+ATTACK = 0.003
+# Tones are cut once the fundamental is this many decay times down (about -35dB)
+TAIL = 4
+
+
+class AudioPreview:
+    def __init__(self, music_box, sample_rate=DEFAULT_SAMPLE_RATE, feed_speed=None):
+        """
+
+        Parameters
+        ----------
+        music_box: MusicBox
+        sample_rate: Samples per second of the output
+        feed_speed: (mm/s) Paper speed through the box. Defaults to the box's feed_speed
+        """
+        self.music_box = music_box
+        self.sample_rate = sample_rate
+        self.feed_speed = feed_speed or music_box.feed_speed
+        self._tones = dict()
+
+    @property
+    def beats_per_second(self):
+        return self.feed_speed / self.music_box.beat_width
+
+    def holes(self, notes):
+        """
+        Ticks and pins of the holes Strip draws for the notes, as arrays.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box, after transposing or folding
+        """
+        pins = np.fromiter((self.music_box.find_pitch(note["raw_pitch"]) for note in notes), np.int64, len(notes))
+        ticks = np.fromiter((note["tick"] for note in notes), np.int64, len(notes))
+        drawn = (pins >= 0) & (ticks >= 0)
+        return ticks[drawn], pins[drawn]
+
+    def tone(self, pin):
+        """ Samples of one pluck of a pin's tooth """
+        if pin not in self._tones:
+            pitch = self.music_box.pitches[pin]
+            frequency = 440 * 2 ** ((pitch - 69) / 12)
+            decay = DECAY_C4 * (261.63 / frequency) ** 0.5
+            t = np.arange(int(TAIL * decay * self.sample_rate)) / self.sample_rate
+            samples = np.zeros_like(t)
+            for ratio, amplitude in COMB_MODES:
+                if frequency * ratio < self.sample_rate / 2:
+                    samples += amplitude * np.exp(-t * ratio / decay) * np.sin(2 * np.pi * frequency * ratio * t)
+            samples *= np.minimum(t / ATTACK, 1)
+            self._tones[pin] = samples.astype(np.float32)
+        return self._tones[pin]
+
+    def render_holes(self, ticks, pins):
+        """
+        Mixes one pluck per hole, placed by its tick (see midi.TICKS_PER_BEAT).
+
+        Returns
+        -------
+        numpy.ndarray
+            Samples in [-1, 1]
+        """
+        samples_per_tick = self.sample_rate / self.beats_per_second / TICKS_PER_BEAT
+        onsets = np.round(np.asarray(ticks) * samples_per_tick).astype(np.int64)
+        pins = np.asarray(pins)
+        longest = max((len(self.tone(pin)) for pin in np.unique(pins)), default=0)
+        output = np.zeros((onsets.max() + 1 if len(onsets) else 0) + longest, np.float32)
+        for pin in np.unique(pins):
+            tone = self.tone(pin)
+            pin_onsets = np.unique(onsets[pins == pin])
+            # Writable view where row i is output[i:i + len(tone)]. Rows of one pass can't overlap, so each pass takes
+            # every n-th pluck of the pin, n being the most plucks that ring at once
+            windows = np.lib.stride_tricks.sliding_window_view(output, len(tone), writeable=True)
+            ringing = np.searchsorted(pin_onsets, pin_onsets + len(tone)) - np.arange(len(pin_onsets))
+            passes = ringing.max()
+            for first in range(passes):
+                windows[pin_onsets[first::passes]] += tone
+        peak = np.abs(output).max() if len(output) else 0
+        return output / peak if peak > 0 else output
+
+    def render(self, notes):
+        return self.render_holes(*self.holes(notes))
+
+    def write_wav(self, notes, output_file):
+        """
+        Writes the preview as a 16 bit mono WAV.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box, after transposing or folding
+        output_file: Path or binary file object
+
+        Returns
+        -------
+        float
+            Duration in seconds
+        """
+        samples = (self.render(notes) * 0.9 * 32767).astype("<i2")
+        with wave.open(output_file, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes(samples.tobytes())
+        return len(samples) / self.sample_rate
@@ -1,6 +1,13 @@
 """Defines a music box instance."""
+import math
 import re
 
+NOTE_NAMES = "C C# D D# E F F# G G# A A# B".split(" ")
+FLAT_TO_SHARP = {"db": "c#", "eb": "d#", "gb": "f#", "ab": "g#", "bb": "a#"}
+# (mm/s) Paper speed when cranking, for boxes that don't set feed_speed
+DEFAULT_FEED_SPEED = 16.0
+
+
 class MusicBox:
     def __init__(self, **kwargs):
         for (key, value) in kwargs['meta'].items():
@@ -9,11 +16,26 @@ class MusicBox:
         for (key, value) in kwargs['dimensions'].items(): 
             setattr(self, key, value)
 
+        if not hasattr(self, "name"):
+            self.name = MusicBox._slugify(self.description)
+        if not hasattr(self, "feed_speed"):
+            self.feed_speed = DEFAULT_FEED_SPEED
+        self.style = kwargs.get('style', {})
+
         # load notes as (note, octave) tuples
         self.notes = [MusicBox._note_str_to_tuple(note) for note in kwargs['music_props']['notes']]
         self.highlighted = [] if not 'highlight' in kwargs['music_props'] else kwargs['music_props']['highlight']
         self.clef = kwargs["music_props"]["clef"]
 
+        # pitch -> pin lookup table, so notes can be matched without string comparisons
+        self.pitches = [MusicBox._note_tuple_to_pitch(note) for note in self.notes]
+        self.pitch_table = {pitch: index for index, pitch in enumerate(self.pitches)}
+        self.highlighted_pitches = set(MusicBox._note_tuple_to_pitch(MusicBox._note_str_to_tuple(note))
+                                       for note in self.highlighted)
+        self.min_pitch = min(self.pitches)
+        self.max_pitch = max(self.pitches)
+        self._playable_masks = dict()
+
     def __str__(self):
         return "{cls} instance\n" \
                "- Description: {description}\n" \
@@ -34,11 +56,36 @@ class MusicBox:
         # note string has to be like [note][octave], for example F#3, bb4
         return self.find_note(note_str) >= 0
 
+    def has_pitch(self, pitch):
+        """Checks if a given midi pitch is playable in the loaded music box."""
+        return pitch in self.pitch_table
+
+    def find_pitch(self, pitch):
+        """Returns the pin index for a midi pitch, or -1 if the box can't play it."""
+        return self.pitch_table.get(pitch, -1)
+
+    def fold_pitch(self, pitch):
+        """Moves a pitch by whole octaves until it falls inside the box range, if possible."""
+        if pitch < self.min_pitch:
+            pitch += 12 * math.ceil((self.min_pitch - pitch) / 12)
+        elif pitch > self.max_pitch:
+            pitch -= 12 * math.ceil((pitch - self.max_pitch) / 12)
+        return pitch
+
+    def playable_mask(self, fold_octaves=False, size=128):
+        """Returns a list where item i tells if midi pitch i can be played (after octave folding if requested)."""
+        key = (fold_octaves, size)
+        if key not in self._playable_masks:
+            if fold_octaves:
+                mask = [self.fold_pitch(pitch) in self.pitch_table for pitch in range(size)]
+            else:
+                mask = [pitch in self.pitch_table for pitch in range(size)]
+            self._playable_masks[key] = mask
+        return self._playable_masks[key]
+
     def is_note_highlighted(self, note):
-        for highlighted_note in self.highlighted:
-            if MusicBox._note_equals(note, highlighted_note):
-                return True
-        return False
+        """Checks if a (note, octave) tuple is highlighted. Enharmonics are the same pitch, so they match."""
+        return MusicBox._note_tuple_to_pitch(note) in self.highlighted_pitches
 
     def find_note(self, note_tuple):
         for index, note in enumerate(self.notes):
@@ -67,6 +114,10 @@ class MusicBox:
         return a_parts[1] == b_parts[1] and \
             (a_parts[0] == b_parts[0] or sorted((a_parts[0], b_parts[0])) in enharmonics)
 
+    @staticmethod
+    def _slugify(text):
+        return re.sub('[^a-z0-9]+', '-', text.lower()).strip('-')
+
     @staticmethod
     def _note_str_to_tuple(note_str):
         """Takes note string and returns a tuple with note name + octave."""
@@ -76,6 +127,13 @@ class MusicBox:
     def _note_tuple_to_str(note_tuple):
         return f"{note_tuple[0]}{note_tuple[1]}"
 
+    @staticmethod
+    def _note_tuple_to_pitch(note_tuple):
+        """Takes a (note, octave) tuple and returns its midi pitch. Flats are accepted."""
+        name = note_tuple[0].strip().lower()
+        name = FLAT_TO_SHARP.get(name, name)
+        return 12 * (note_tuple[1] + 1) + [n.lower() for n in NOTE_NAMES].index(name)
+
     @property
     def notes_count(self):
         return len(self.notes)
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Persistent cache of parsed songs.
+
+The notes of a midi file are stored as two flat arrays (ticks as int64, pitches as uint8) in a small binary file
+named after the hash of the midi content and the parser version. Hits map the file and read the arrays in place,
+without the midi package. The cache directory is kept under a size limit by removing the least recently used songs.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from .midi import Parser, PARSER_VERSION, TICKS_PER_BEAT
+
+MAGIC = b"MBNC"
+# Magic, parser version, notes count. Ticks start right after, aligned to 8 bytes
+HEADER = struct.Struct("<4sII")
+HEADER_SIZE = 16
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class NoteArrays:
+    """ Ticks and pitches of a song, sorted by tick. Views over the cache file when loaded from it """
+
+    def __init__(self, ticks, pitches):
+        self.ticks = ticks
+        self.pitches = pitches
+
+    def __len__(self):
+        return len(self.pitches)
+
+    @staticmethod
+    def from_notes(notes):
+        return NoteArrays([note["tick"] for note in notes], bytes(note["raw_pitch"] for note in notes))
+
+    def to_bytes(self):
+        data = bytearray(HEADER.pack(MAGIC, PARSER_VERSION, len(self)))
+        data += bytes(HEADER_SIZE - len(data))
+        data += struct.pack(f"<{len(self)}q", *self.ticks)
+        data += bytes(self.pitches)
+        return bytes(data)
+
+    @staticmethod
+    def from_buffer(buffer):
+        """ Arrays over a buffer that starts with the output of to_bytes. Raises ValueError if it doesn't """
+        if len(buffer) < HEADER_SIZE:
+            raise ValueError("Truncated notes file")
+        magic, version, count = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != PARSER_VERSION or len(buffer) < HEADER_SIZE + 9 * count:
+            raise ValueError("Not a notes file of this parser version")
+        view = memoryview(buffer)[:HEADER_SIZE + 9 * count]
+        ticks_end = HEADER_SIZE + 8 * count
+        if sys.byteorder == "little":
+            ticks = view[HEADER_SIZE:ticks_end].cast("q")
+        else:
+            ticks = struct.unpack_from(f"<{count}q", buffer, HEADER_SIZE)
+        return NoteArrays(ticks, view[ticks_end:])
+
+    def to_notes(self):
+        """ Notes as returned by Parser.render_to_box """
+        names = {pitch: Parser.pitch_to_note(pitch) for pitch in set(self.pitches)}
+        notes = list()
+        for tick, pitch in zip(self.ticks, self.pitches):
+            note, octave = names[pitch]
+            notes.append({"note": note, "octave": octave, "beat": tick / TICKS_PER_BEAT, "tick": tick,
+                          "raw_pitch": pitch})
+        return notes
+
+
+class NoteCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+
+        Parameters
+        ----------
+        cache_dir: Defaults to ~/.cache/musicbox/notes (or under $XDG_CACHE_HOME)
+        max_bytes: Size the cache files are kept under
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))),
+                                     "musicbox", "notes")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(content):
+        return hashlib.sha1(content).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}-v{PARSER_VERSION}.notes")
+
+    def render_to_box(self, midi_file, workers=None):
+        """
+        Same as Parser.render_to_box, from the cache when the same content was parsed before.
+
+        Parameters
+        ----------
+        midi_file: Path, binary file object or bytes
+        workers: Processes decoding the tracks when the song isn't cached (see Parser.render_tracks)
+        """
+        if isinstance(midi_file, str):
+            with open(midi_file, "rb") as f:
+                content = f.read()
+        elif isinstance(midi_file, (bytes, bytearray, memoryview)):
+            content = bytes(midi_file)
+        else:
+            content = midi_file.read()
+        key = self.key(content)
+        arrays = self.get(key)
+        if arrays is not None:
+            return arrays.to_notes()
+        notes = Parser.render_tracks(midi_file if isinstance(midi_file, str) else content, workers)
+        self.put(key, NoteArrays.from_notes(notes))
+        return notes
+
+    def get(self, key):
+        """ NoteArrays of a cached song, or None. The file stays mapped while the arrays are referenced """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Missing, or empty (mmap refuses those)
+            return None
+        try:
+            arrays = NoteArrays.from_buffer(mapped)
+        except ValueError:
+            mapped.close()
+            return None
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key, arrays):
+        # Write and rename, so concurrent readers never see half a file. A read-only cache is not an error
+        path = self._path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(arrays.to_bytes())
+            os.replace(tmp_file, path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Removes the least recently used songs until the cache is under max_bytes """
+        entries = list()
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".notes"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,125 @@
+"""
+Render diagnostics: what happened to the notes of a song, reported once as a summary instead of note by note.
+"""
+from collections import Counter
+
+
+class Diagnostics:
+    """
+    Counts per reason, with the first few samples of each (notes formatted as NAME+OCTAVE@BEAT, or messages).
+    """
+    OUT_OF_RANGE = "out of range"
+    NOT_IN_BOX = "not in box"
+    BEFORE_STRIP = "before strip start"
+    INVALID_FILE = "invalid file"
+    # Reasons that mean a note of the song wasn't drawn
+    SKIPPED_NOTES = (OUT_OF_RANGE, NOT_IN_BOX, BEFORE_STRIP)
+
+    def __init__(self, max_samples=5):
+        self.max_samples = max_samples
+        self.counts = Counter()
+        self.samples = dict()
+        # Notes checked and pages written, filled by the renderers
+        self.notes = 0
+        self.pages = 0
+
+    def add(self, reason, sample=None, count=1):
+        self.counts[reason] += count
+        if sample is not None:
+            samples = self.samples.setdefault(reason, list())
+            if len(samples) < self.max_samples:
+                samples.append(sample)
+
+    @staticmethod
+    def format_note(note):
+        return "{}{}@{:g}".format(note["note"], note["octave"], note["beat"])
+
+    @staticmethod
+    def classify_pitch(music_box, pitch):
+        """ Reason why Strip doesn't draw a pitch, or None if it's drawn """
+        if not music_box.min_pitch <= pitch <= music_box.max_pitch:
+            return Diagnostics.OUT_OF_RANGE
+        if not music_box.has_pitch(pitch):
+            return Diagnostics.NOT_IN_BOX
+        return None
+
+    def check_notes(self, notes, music_box):
+        """
+        Counts the notes that Strip will skip, up front.
+        Each distinct pitch is classified once; notes are only visited again to pick samples.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box
+        music_box: MusicBox
+        """
+        histogram = Counter(note["raw_pitch"] for note in notes)
+        self.notes += len(notes)
+        skipped = dict()
+        for pitch, count in histogram.items():
+            reason = self.classify_pitch(music_box, pitch)
+            if reason is not None:
+                skipped[pitch] = reason
+                self.counts[reason] += count
+        if not skipped:
+            return
+        missing_samples = {reason: self.max_samples - len(self.samples.get(reason, ()))
+                           for reason in set(skipped.values())}
+        for note in notes:
+            reason = skipped.get(note["raw_pitch"])
+            if reason is not None and missing_samples[reason] > 0:
+                self.samples.setdefault(reason, list()).append(self.format_note(note))
+                missing_samples[reason] -= 1
+                if not any(missing_samples.values()):
+                    break
+
+    def iter_checked(self, notes, music_box):
+        """ Same as check_notes for notes that can only be read once, like Parser.iter_notes. Yields every note """
+        reasons = dict()
+        for note in notes:
+            self.notes += 1
+            pitch = note["raw_pitch"]
+            if pitch not in reasons:
+                reasons[pitch] = self.classify_pitch(music_box, pitch)
+            if reasons[pitch] is not None:
+                self.add(reasons[pitch], self.format_note(note))
+            yield note
+
+    def skipped(self):
+        return sum(self.counts[reason] for reason in self.SKIPPED_NOTES)
+
+    def summary(self, verbosity=1):
+        """
+        Readable summary.
+
+        Parameters
+        ----------
+        verbosity: 0 for nothing, 1 for the counts, 2 to add the samples of each reason
+        """
+        if verbosity < 1 or not self.counts:
+            return ""
+        lines = list()
+        if self.skipped():
+            lines.append("Skipped {} of {} notes: {}".format(
+                self.skipped(), self.notes,
+                ", ".join(f"{self.counts[reason]} {reason}" for reason in self.SKIPPED_NOTES if self.counts[reason])))
+        other = [reason for reason in self.counts if reason not in self.SKIPPED_NOTES]
+        if other:
+            lines.append(", ".join(f"{self.counts[reason]} {reason}" for reason in other))
+        if verbosity >= 2:
+            for reason, samples in self.samples.items():
+                more = ", ..." if self.counts[reason] > len(samples) else ""
+                lines.append(f"\t{reason}: {', '.join(samples)}{more}")
+        return "\n".join(lines)
+
+    def print_summary(self, verbosity=1):
+        summary = self.summary(verbosity)
+        if summary:
+            print(summary)
+
+    def to_dict(self):
+        return {"notes": self.notes,
+                "pages": self.pages,
+                "counts": dict(self.counts),
+                "samples": {reason: list(samples) for reason, samples in self.samples.items()}}
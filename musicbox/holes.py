@@ -0,0 +1,215 @@
+"""
+Geometric check of the holes of a song, before drawing anything: holes closer than a hole diameter overlap, and the
+paper between them tears when punched.
+
+Holes are placed like Strip draws them, in mm: along the song (from their tick) and across it (pin * pin_width).
+Each pin is a row. Rows are sorted once and swept, comparing each hole only with the holes of its own row and of the
+rows close enough to reach it, found by bisection, so the cost grows with the holes and not with their pairs.
+
+Songs read as a stream (see Parser.iter_notes) go through OverlapStream instead, which only keeps the holes close
+enough to the current beat.
+"""
+import bisect
+import collections
+import itertools
+import math
+
+from .diagnostics import Diagnostics
+from .midi import TICKS_PER_BEAT
+
+
+class HoleOverlaps:
+    def __init__(self, music_box_object, beat_width=None, hole_radius=None):
+        """
+
+        Parameters
+        ----------
+        music_box_object: MusicBox
+        beat_width: (mm) Defaults to the box's
+        hole_radius: (mm) Defaults to the box's
+        """
+        self.music_box_object = music_box_object
+        self.beat_width = beat_width or music_box_object.beat_width
+        self.diameter = 2 * (hole_radius or music_box_object.hole_radius)
+        pin_width = music_box_object.pin_width
+        # Item k: how close along the song two holes k pins apart can be before they overlap
+        self.reach = list()
+        while len(self.reach) * pin_width < self.diameter:
+            self.reach.append(math.sqrt(self.diameter ** 2 - (len(self.reach) * pin_width) ** 2))
+
+    def rows(self, notes):
+        """ For every pin with holes, the x of its holes (sorted) and the index of the first note of each """
+        pitch_table = self.music_box_object.pitch_table
+        holes = dict()
+        for index, note in enumerate(notes):
+            if note["raw_pitch"] in pitch_table:
+                holes.setdefault(pitch_table[note["raw_pitch"]], list()).append((note["tick"], index))
+        mm_per_tick = self.beat_width / TICKS_PER_BEAT
+        rows = dict()
+        for pin, row in holes.items():
+            row.sort()
+            # Notes at the same tick and pitch are the same hole
+            row = [hole for position, hole in enumerate(row) if position == 0 or hole[0] != row[position - 1][0]]
+            rows[pin] = ([tick * mm_per_tick for tick, _ in row], [index for _, index in row])
+        return rows
+
+    def find(self, notes):
+        """
+        Pairs of overlapping holes. Notes at the same beat and pitch are the same hole, not an overlap.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box, after transposing or folding
+
+        Returns
+        -------
+        list
+            (index, index, distance in mm) of each pair, the first note being the one of the lower pin, or the
+            earlier one on the same pin
+        """
+        rows = self.rows(notes)
+        pin_width = self.music_box_object.pin_width
+        overlaps = list()
+        for pin, (xs, indexes) in rows.items():
+            # Same row: only the next holes can be closer than a diameter
+            for position, x in enumerate(xs):
+                end = bisect.bisect_left(xs, x + self.reach[0], position + 1)
+                for other in range(position + 1, end):
+                    overlaps.append((indexes[position], indexes[other], xs[other] - x))
+            # Rows above, as long as they're close enough
+            for k in range(1, len(self.reach)):
+                if pin + k not in rows:
+                    continue
+                other_xs, other_indexes = rows[pin + k]
+                for position, x in enumerate(xs):
+                    start = bisect.bisect_right(other_xs, x - self.reach[k])
+                    end = bisect.bisect_left(other_xs, x + self.reach[k], start)
+                    for other in range(start, end):
+                        overlaps.append((indexes[position], other_indexes[other],
+                                         math.hypot(other_xs[other] - x, k * pin_width)))
+        return overlaps
+
+    def fix(self, notes):
+        """
+        Drops the holes that overlap an earlier one, sweeping the song once in beat order.
+
+        Returns
+        -------
+        tuple
+            (kept notes, dropped notes). Notes the box can't play are kept, Strip skips them
+        """
+        pitch_table = self.music_box_object.pitch_table
+        order = sorted((note["tick"], pitch_table[note["raw_pitch"]], index) for index, note in enumerate(notes)
+                       if note["raw_pitch"] in pitch_table)
+        mm_per_tick = self.beat_width / TICKS_PER_BEAT
+        neighbours = [(k, self.reach[abs(k)]) for k in range(1 - len(self.reach), len(self.reach))]
+        # x of the last hole kept in each pin
+        last = dict()
+        dropped = set()
+        for tick, pin, index in order:
+            x = tick * mm_per_tick
+            if last.get(pin) == x:
+                # Same hole as the last one
+                continue
+            for k, reach in neighbours:
+                if x - last.get(pin + k, -math.inf) < reach:
+                    dropped.add(index)
+                    break
+            else:
+                last[pin] = x
+        return ([note for index, note in enumerate(notes) if index not in dropped],
+                [note for index, note in enumerate(notes) if index in dropped])
+
+    @staticmethod
+    def describe(notes, overlap):
+        """ Readable overlap, like C4@12 - D4@12.25 (1.2mm) """
+        first, second, distance = overlap
+        return HoleOverlaps.describe_notes(notes[first], notes[second], distance)
+
+    @staticmethod
+    def describe_notes(first, second, distance):
+        return "{} - {} ({:.2g}mm)".format(Diagnostics.format_note(first), Diagnostics.format_note(second), distance)
+
+
+class OverlapStream:
+    """
+    Finds or fixes the overlapping holes of notes read as a stream in beat order, with the same results as
+    HoleOverlaps.find and HoleOverlaps.fix. Holes only overlap holes less than a diameter away along the song, so
+    only those are kept. Notes at the same beat are taken together, in pin order like fix.
+
+        stream = OverlapStream(HoleOverlaps(music_box), fix=True)
+        for note in stream.filter(Parser.iter_notes(midi_file)):
+            ...
+        stream.count, stream.samples
+    """
+    # Overlaps or dropped notes kept to show
+    MAX_SAMPLES = 5
+
+    def __init__(self, holes, fix=False):
+        """
+
+        Parameters
+        ----------
+        holes: HoleOverlaps
+        fix: Whether to drop the holes that overlap an earlier one, instead of only finding the pairs
+        """
+        self.holes = holes
+        self.fix = fix
+        # Pairs of overlapping holes found, or holes dropped with fix
+        self.count = 0
+        # Descriptions of the first of them, like HoleOverlaps.describe, or like Diagnostics.format_note with fix
+        self.samples = list()
+
+    def filter(self, notes):
+        """ Yields the notes to draw: all of them, or the ones fix would keep """
+        pitch_table = self.holes.music_box_object.pitch_table
+        mm_per_tick = self.holes.beat_width / TICKS_PER_BEAT
+        reach = self.holes.reach
+        pin_width = self.holes.music_box_object.pin_width
+        neighbours = [(k, reach[abs(k)]) for k in range(1 - len(reach), len(reach))]
+        # x of the last hole kept in each pin, with fix. Otherwise the (x, note) of each pin less than reach[0] back
+        last = dict()
+        recent = collections.defaultdict(collections.deque)
+        for tick, group in itertools.groupby(notes, key=lambda note: note["tick"]):
+            group = list(group)
+            x = tick * mm_per_tick
+            # Notes at the same beat and pitch are the same hole
+            pins = dict()
+            for index, note in enumerate(group):
+                if note["raw_pitch"] in pitch_table:
+                    pins.setdefault(pitch_table[note["raw_pitch"]], list()).append(index)
+            dropped = set()
+            for pin, indexes in sorted(pins.items()):
+                if self.fix:
+                    if last.get(pin) == x:
+                        continue
+                    if any(x - last.get(pin + k, -math.inf) < reach_k for k, reach_k in neighbours):
+                        dropped.update(indexes)
+                    else:
+                        last[pin] = x
+                    continue
+                index = indexes[0]
+                for k, reach_k in neighbours:
+                    row = recent.get(pin + k)
+                    if not row:
+                        continue
+                    # Compared like find does, so float rounding gives the same pairs
+                    while row and row[0][0] + reach[0] <= x and row[0][0] <= x - reach[0]:
+                        row.popleft()
+                    for other_x, other in row:
+                        if (other_x > x - reach_k if k > 0 else x < other_x + reach_k) and (k != 0 or other_x != x):
+                            first, second = (other, group[index]) if k <= 0 else (group[index], other)
+                            self._sample(HoleOverlaps.describe_notes(first, second,
+                                                                     math.hypot(x - other_x, k * pin_width)))
+                recent[pin].append((x, group[index]))
+            for index, note in enumerate(group):
+                if index in dropped:
+                    self._sample(Diagnostics.format_note(note))
+                else:
+                    yield note
+
+    def _sample(self, sample):
+        self.count += 1
+        if len(self.samples) < self.MAX_SAMPLES:
+            self.samples.append(sample)
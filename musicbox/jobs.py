@@ -0,0 +1,230 @@
+"""
+Durable job queue for batch renders, kept in a SQLite file.
+
+A job is one output file to render: its parameters (stored as JSON), its state, how many times it was attempted, when
+it was queued, started and finished, how long rendering took and the SHA-256 of the output once done. Jobs are
+identified by their output file, so adding a catalog again only adds the songs that aren't queued yet, and finished
+outputs are never rendered again.
+
+Any number of worker processes can share the queue. A worker claims the next job in a write transaction, so no job is
+handed out twice, and holds it for a lease: jobs of a worker that crashed or was killed are handed out again once
+their lease expires. Jobs that keep failing are given up after max_attempts.
+
+States: pending -> running -> done, or back to pending on errors, or failed after the last attempt.
+"""
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, DONE, FAILED)
+# (s) How long a claimed job belongs to its worker. Longer than any render, shorter than waiting for a dead worker
+DEFAULT_LEASE = 600
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    output_file TEXT NOT NULL UNIQUE,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    queued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    output_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+def file_hash(path):
+    """ SHA-256 of a file, as hex """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_output(output_file, data):
+    """
+    Writes an output so that it's either complete or missing, never half written: to a temporary file, then renamed.
+    Returns the SHA-256 of the data
+    """
+    tmp_file = f"{output_file}.{os.getpid()}.part"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, output_file)
+    # Left by workers killed while writing the same output
+    for stale_file in glob.glob(f"{glob.escape(output_file)}.*.part"):
+        with contextlib.suppress(OSError):
+            os.remove(stale_file)
+    return hashlib.sha256(data).hexdigest()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, owned by someone else
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, path, lease=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Opens the queue, creating it if needed. Each process (or thread) opens its own JobQueue.
+
+        Parameters
+        ----------
+        path: SQLite file
+        lease: (s) How long a worker owns a job it claimed
+        max_attempts: Attempts before a job is marked failed
+        """
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        # Autocommit, with explicit transactions where reads and writes must go together. Writers wait for each other
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        # Readers don't block the writer and the other way around
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, jobs):
+        """
+        Queues jobs, in one transaction, skipping the ones whose output file is already queued.
+
+        Parameters
+        ----------
+        jobs: Iterable of (output file, params). The output file identifies the job; params is a JSON serializable
+            dict with what the worker needs
+
+        Returns
+        -------
+        int
+            Jobs added
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            added = sum(self.db.execute("INSERT OR IGNORE INTO jobs (output_file, params, queued_at) VALUES (?, ?, ?)",
+                                        (os.path.abspath(output_file), json.dumps(params, sort_keys=True),
+                                         now)).rowcount
+                        for output_file, params in jobs)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, worker=None):
+        """
+        Hands out the oldest pending job, or one whose lease expired, and marks it running.
+
+        Returns
+        -------
+        dict
+            The job (id, output_file, params as a dict, attempts counting this one...), or None if there's nothing
+            left to do
+        """
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Workers of this machine that are gone don't need to wait for their lease to expire
+            host = socket.gethostname()
+            for row in self.db.execute("SELECT id, worker FROM jobs WHERE state = ? AND worker LIKE ?",
+                                       (RUNNING, host + ":%")).fetchall():
+                if not _process_alive(int(row["worker"].rpartition(":")[2])):
+                    self.db.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (now - 1, row["id"]))
+            # Jobs lost on their last attempt aren't handed out again
+            self.db.execute("UPDATE jobs SET state = ?, lease_until = NULL, error = 'Worker lost' "
+                            "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                            (FAILED, RUNNING, now, self.max_attempts))
+            row = self.db.execute("SELECT id FROM jobs WHERE state = ? OR (state = ? AND lease_until < ?) "
+                                  "ORDER BY id LIMIT 1", (PENDING, RUNNING, now)).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            self.db.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, worker = ?, lease_until = ?, "
+                            "started_at = ? WHERE id = ?", (RUNNING, worker, now + self.lease, now, row["id"]))
+            job = self.db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return self._job(job)
+
+    def complete(self, job, output_hash, seconds):
+        """ Marks a claimed job done. Returns False if the job was meanwhile handed to another worker """
+        cursor = self.db.execute("UPDATE jobs SET state = ?, lease_until = NULL, error = NULL, finished_at = ?, "
+                                 "seconds = ?, output_hash = ? WHERE id = ? AND worker = ? AND state = ?",
+                                 (DONE, time.time(), seconds, output_hash, job["id"], job["worker"], RUNNING))
+        return cursor.rowcount == 1
+
+    def fail(self, job, error):
+        """ Records the error of a claimed job. It's tried again later, unless that was its last attempt """
+        state = FAILED if job["attempts"] >= self.max_attempts else PENDING
+        self.db.execute("UPDATE jobs SET state = ?, lease_until = NULL, error = ?, finished_at = ? "
+                        "WHERE id = ? AND worker = ? AND state = ?",
+                        (state, str(error), time.time(), job["id"], job["worker"], RUNNING))
+        return state
+
+    def retry_failed(self):
+        """ Gives failed jobs another max_attempts. Returns how many """
+        return self.db.execute("UPDATE jobs SET state = ?, attempts = 0 WHERE state = ?", (PENDING, FAILED)).rowcount
+
+    def verify(self):
+        """
+        Queues again the done jobs whose output is missing or changed since it was written.
+        Returns their output files
+        """
+        requeued = list()
+        for row in self.db.execute("SELECT id, output_file, output_hash FROM jobs WHERE state = ?", (DONE,)).fetchall():
+            if not os.path.exists(row["output_file"]) or file_hash(row["output_file"]) != row["output_hash"]:
+                requeued.append(row["output_file"])
+                self.db.execute("UPDATE jobs SET state = ?, attempts = 0, output_hash = NULL WHERE id = ?",
+                                (PENDING, row["id"]))
+        return requeued
+
+    def counts(self):
+        """ Jobs by state """
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return counts
+
+    def jobs(self, state=None):
+        """ Every job, or the ones in a state, in queue order """
+        if state is None:
+            rows = self.db.execute("SELECT * FROM jobs ORDER BY id")
+        else:
+            rows = self.db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,))
+        return [self._job(row) for row in rows.fetchall()]
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
@@ -0,0 +1,135 @@
+"""Analytic page layout: how many strips and pages a song needs, without rendering it."""
+import math
+
+from .midi import TICKS_PER_BEAT
+from .pdf import Renderer, Strip
+
+
+class LayoutPlanner:
+    """
+    Predicts the strips and pages Renderer would produce for a song, using the same geometry.
+    All units in mm, beats are the ones returned by Parser.render_to_box.
+    """
+
+    def __init__(self, music_box_object, notes, strip_separation=0, min_hole_spacing=None,
+                 song_title=None, song_author=None):
+        """
+
+        Parameters
+        ----------
+        music_box_object: MusicBox
+        notes: list
+            Notes as returned by Parser.render_to_box
+        strip_separation: Separation between strips in the paper
+        min_hole_spacing: Minimum distance between two holes on the same pin. Defaults to the hole diameter
+        song_title
+        song_author
+            Used to size the header. If missing, the largest header is assumed
+        """
+        self.music_box_object = music_box_object
+        self.strip_separation = strip_separation
+        self.min_hole_spacing = 2 * music_box_object.hole_radius if min_hole_spacing is None else min_hole_spacing
+        self.last_tick = max((note["tick"] for note in notes), default=0)
+        self.min_gap = LayoutPlanner.min_pin_gap(music_box_object, notes)
+        if song_title is None or song_author is None:
+            self.header_width = Strip.header_width()
+        else:
+            self.header_width = Strip.header_width(Strip.title_font_size(music_box_object, song_title, song_author))
+
+    @staticmethod
+    def min_pin_gap(music_box_object, notes):
+        """ Smallest distance (in beats) between two consecutive holes of the same pin. None if no pin repeats """
+        ticks_per_pin = dict()
+        for note in notes:
+            if music_box_object.has_pitch(note["raw_pitch"]):
+                ticks_per_pin.setdefault(note["raw_pitch"], set()).add(note["tick"])
+        min_gap = None
+        for ticks in ticks_per_pin.values():
+            ticks = sorted(ticks)
+            for a, b in zip(ticks, ticks[1:]):
+                if min_gap is None or b - a < min_gap:
+                    min_gap = b - a
+        return None if min_gap is None else min_gap / TICKS_PER_BEAT
+
+    def min_beat_width(self):
+        """ Smallest beat width that keeps every pair of holes punchable """
+        if not self.min_gap:
+            return 0
+        return self.min_hole_spacing / self.min_gap
+
+    def evaluate(self, paper_size, orientation, beat_width):
+        """
+        Computes the strips and pages needed for a configuration.
+
+        Returns
+        -------
+        dict
+            Configuration plus "strips", "pages", "strips_per_page", "beats_per_strip" and "punchable".
+            "pages" is None when a strip doesn't fit in the page.
+        """
+        # Same page geometry as Renderer
+        width, height = paper_size if orientation == "p" else reversed(paper_size)
+        l_margin, t_margin, r_margin = Renderer.MARGINS
+        strip_height = Strip.height(self.music_box_object)
+        strip_length = width - l_margin - r_margin
+        usable_height = height - t_margin - Renderer.BOTTOM_MARGIN
+
+        layout = {
+            "paper_size": tuple(paper_size),
+            "orientation": orientation,
+            "beat_width": beat_width,
+            "beats_per_strip": Strip.beats_in(strip_length, beat_width),
+            "punchable": beat_width >= self.min_beat_width(),
+            "strips": None,
+            "strips_per_page": 0,
+            "pages": None,
+        }
+        first_strip_beats = Strip.beats_in(strip_length - self.header_width, beat_width)
+        if usable_height < strip_height or first_strip_beats < 1:
+            return layout
+
+        # The first strip holds the header, notes exactly on a strip end are drawn in that strip
+        strips = 1
+        first_strip_ticks = first_strip_beats * TICKS_PER_BEAT
+        if self.last_tick > first_strip_ticks:
+            # Ceiling division, on integer ticks
+            strips += -(-(self.last_tick - first_strip_ticks) // (layout["beats_per_strip"] * TICKS_PER_BEAT))
+        strips_per_page = int((usable_height - strip_height) / (strip_height + self.strip_separation)) + 1
+        layout.update(strips=strips,
+                      strips_per_page=strips_per_page,
+                      pages=math.ceil(strips / strips_per_page))
+        return layout
+
+    def candidates(self, paper_sizes, beat_widths, orientations=("l", "p")):
+        """ Evaluates every combination, skipping the ones that can't be printed or punched """
+        for paper_size in paper_sizes:
+            for orientation in orientations:
+                for beat_width in beat_widths:
+                    layout = self.evaluate(paper_size, orientation, beat_width)
+                    if layout["pages"] is not None and layout["punchable"]:
+                        yield layout
+
+    def optimize(self, paper_sizes, beat_widths, orientations=("l", "p")):
+        """
+        Finds the configuration that uses the least paper.
+        Ties go to fewer strips, then to the beat width closest to the box's own.
+
+        Returns
+        -------
+        dict
+            Best layout, as returned by evaluate
+        """
+        preferred_width = self.music_box_object.beat_width
+        best = min(self.candidates(paper_sizes, beat_widths, orientations),
+                   key=lambda c: (c["pages"], c["strips"], abs(c["beat_width"] - preferred_width)),
+                   default=None)
+        if best is None:
+            raise ValueError(f"No printable configuration found. Holes need a beat width of at least "
+                             f"{self.min_beat_width():.2f}mm")
+        return best
+
+    @staticmethod
+    def beat_width_range(start, stop, step=0.1):
+        """ Inclusive range of beat widths """
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 6) for i in range(count)]
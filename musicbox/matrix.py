@@ -0,0 +1,137 @@
+"""
+Render matrix: one song rendered for every combination of boxes, paper sizes and transpositions.
+
+The song is parsed once. Its notes go to the worker processes through shared memory, in the same compact layout
+as the parse cache (see cache.NoteArrays), so they are not pickled for every combination.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .cache import NoteArrays
+from .midi import Parser
+
+# Per worker process state, filled once by _init_worker
+_worker = {}
+
+
+def _init_worker(shared_name, music_boxes):
+    shared = shared_memory.SharedMemory(name=shared_name)
+    try:
+        _worker["notes"] = NoteArrays.from_buffer(shared.buf).to_notes()
+    finally:
+        shared.close()
+    _worker["music_boxes"] = music_boxes
+
+
+def _render(combination, output_file, song_title, song_author, fold_octaves, columns, overlaps):
+    """ Runs in a worker. Renders one combination and returns its row of the comparison table """
+    from .holes import HoleOverlaps
+    from .session import thread_session
+
+    start = time.perf_counter()
+    music_box = _worker["music_boxes"][combination["box"]]
+    notes = Parser.transpose(_worker["notes"], combination["shift"])
+    if fold_octaves:
+        notes = Parser.fit_octaves(notes, music_box)
+    # Holes overlap differently with every box and shift
+    overlapping = None
+    if overlaps == "fix":
+        notes, dropped = HoleOverlaps(music_box).fix(notes)
+        overlapping = len(dropped)
+    elif overlaps == "report":
+        overlapping = len(HoleOverlaps(music_box).find(notes))
+    session = thread_session(music_box, paper_size=combination["paper_size"])
+    _, diagnostics = session.render(None, output_file, song_title=song_title, song_author=song_author,
+                                    parsed_notes=notes, columns=columns)
+    return dict(combination,
+                output_file=output_file,
+                pages=diagnostics.pages,
+                dropped=diagnostics.skipped(),
+                notes=len(notes),
+                overlaps=overlapping,
+                size=os.path.getsize(output_file),
+                seconds=time.perf_counter() - start)
+
+
+class RenderMatrix:
+    def __init__(self, notes, music_boxes, boxes, paper_sizes, transpositions, song_title="NO-TITLE",
+                 song_author="NO-AUTHOR", fold_octaves=False, columns=None, overlaps="ignore"):
+        """
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box
+        music_boxes: list
+            MusicBox instances, in musicboxes.yml order
+        boxes: Box indexes starting at 0
+        paper_sizes: (width, height) in mm
+        transpositions: Semitones to shift
+        song_title
+        song_author
+        fold_octaves: Whether to move notes outside the box range by octaves until they fit
+        columns: If given, strips are packed in this many columns (see Renderer.generate_packed)
+        overlaps: "report" to count the pairs of overlapping holes of each combination, "fix" to drop the later hole
+            of each pair (see holes.HoleOverlaps), or "ignore"
+        """
+        self.notes = notes
+        self.music_boxes = list(music_boxes)
+        self.combinations = [{"box": box, "paper_size": tuple(paper_size), "shift": shift}
+                             for box in boxes for paper_size in paper_sizes for shift in transpositions]
+        self.song_title = song_title
+        self.song_author = song_author
+        self.fold_octaves = fold_octaves
+        self.columns = columns
+        self.overlaps = overlaps
+
+    def output_name(self, base_name, combination):
+        """ File name of a combination, like song_kikkerland-30_215.9x279.4_+2.pdf """
+        width, height = combination["paper_size"]
+        return "{}_{}_{:g}x{:g}_{:+d}.pdf".format(base_name, self.music_boxes[combination["box"]].name, width, height,
+                                                  combination["shift"])
+
+    def run(self, output_dir, base_name, workers=None):
+        """
+        Renders every combination on a pool of processes.
+
+        Returns
+        -------
+        list
+            One row per combination, in order: the combination plus output_file, pages, dropped notes, notes,
+            overlapping pairs (or holes dropped by fix, None if ignored), size and seconds
+        """
+        data = NoteArrays.from_notes(self.notes).to_bytes()
+        shared = shared_memory.SharedMemory(create=True, size=len(data))
+        try:
+            shared.buf[:len(data)] = data
+            workers = min(workers or os.cpu_count() or 1, len(self.combinations))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(shared.name, self.music_boxes)) as pool:
+                futures = [pool.submit(_render, combination,
+                                       os.path.join(output_dir, self.output_name(base_name, combination)),
+                                       self.song_title, self.song_author, self.fold_octaves, self.columns,
+                                       self.overlaps)
+                           for combination in self.combinations]
+                return [future.result() for future in futures]
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def table(self, results):
+        """ Comparison table of the results of run """
+        overlaps = {"report": ("Overlaps",), "fix": ("Fixed",)}.get(self.overlaps, ())
+        rows = [("Box", "Paper", "Shift", "Pages", "Dropped") + overlaps + ("Size", "Time")]
+        for result in results:
+            width, height = result["paper_size"]
+            rows.append((self.music_boxes[result["box"]].name,
+                         "{:g}x{:g}".format(width, height),
+                         "{:+d}".format(result["shift"]),
+                         str(result["pages"]),
+                         "{}/{}".format(result["dropped"], result["notes"]))
+                        + tuple(str(result["overlaps"]) for _ in overlaps)
+                        + ("{:.0f}KB".format(result["size"] / 1024),
+                           "{:.0f}ms".format(result["seconds"] * 1000)))
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
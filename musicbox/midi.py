@@ -1,14 +1,60 @@
-import midi
+"""
+Midi parsing helpers.
+
+The midi package (event registry, containers, file reader) is only imported when a file is actually read,
+so tools that only need the note helpers start fast.
+"""
+import heapq
+import io
+import mmap
+import operator
+import os
+import struct
+from array import array
+
+# Bump when the notes read from the same file change, so cached songs are parsed again (see cache.NoteCache)
+PARSER_VERSION = 2
+# Fixed point timeline: note positions are integer ticks of 1/TICKS_PER_BEAT beats. It's a multiple of half of every
+# usual midi resolution (96, 120, 192, 220, 240, 384, 480, 960, 1920...), so those files are placed exactly. Others are
+# rounded to the nearest tick, way under a micrometre on paper
+TICKS_PER_BEAT = 221760
+MIDI_HEADER = b"MThd"
+TRACK_HEADER = b"MTrk"
+# Files under this size are decoded in one process by Parser.render_tracks: starting the workers takes longer
+PARALLEL_MIN_BYTES = 256 * 1024
+# Data bytes of each channel message, by status nibble
+CHANNEL_MESSAGE_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
 
 
 class Parser:
     @staticmethod
-    def file_is_valid(file_path):
+    def has_midi_header(file_path, diagnostics=None):
+        """ Cheap check that only looks at the first bytes of the file. Errors are added to diagnostics, if given """
+        try:
+            with open(file_path, "rb") as f:
+                return f.read(len(MIDI_HEADER)) == MIDI_HEADER
+        except OSError as e:
+            if diagnostics is not None:
+                diagnostics.add(diagnostics.INVALID_FILE, str(e))
+            return False
+
+    @staticmethod
+    def as_file(midi_file):
+        """ Wraps midi bytes in a file object. Paths and file objects are returned as they are """
+        if isinstance(midi_file, (bytes, bytearray, memoryview)):
+            return io.BytesIO(midi_file)
+        return midi_file
+
+    @staticmethod
+    def file_is_valid(file_path, diagnostics=None):
+        """ Fully reads the file. Errors are added to diagnostics, if given """
+        import midi
         try:
-            midi.read_midifile(file_path)
+            midi.read_midifile(Parser.as_file(file_path))
             return True
         except Exception as e:
-            print(e)
+            if diagnostics is not None:
+                diagnostics.add(diagnostics.INVALID_FILE, str(e))
             return False
 
     @staticmethod
@@ -17,9 +63,86 @@ class Parser:
         pass
 
     @staticmethod
-    def fit_octaves(midi_object, start_note, end_note):
-        """ Force notes on extreme octaves to be inside a range (inclusive) """
-        pass
+    def fit_octaves(notes, music_box):
+        """ Force notes on extreme octaves to be inside the range of a box (see MusicBox.fold_pitch) """
+        return [Parser._with_pitch(note, music_box.fold_pitch(note["raw_pitch"])) for note in notes]
+
+    @staticmethod
+    def iter_fitted(notes, semitones=0, music_box=None):
+        """
+        Lazy transpose, then fit_octaves if music_box is given.
+        For notes that are read as a stream and never held in memory.
+        """
+        for note in notes:
+            pitch = note["raw_pitch"] + semitones
+            if music_box is not None:
+                pitch = music_box.fold_pitch(pitch)
+            yield note if pitch == note["raw_pitch"] else Parser._with_pitch(note, pitch)
+
+    @staticmethod
+    def transpose(notes, semitones):
+        """ Shifts every note by the given amount of semitones """
+        if semitones == 0:
+            return list(notes)
+        return [Parser._with_pitch(note, note["raw_pitch"] + semitones) for note in notes]
+
+    @staticmethod
+    def pitch_histogram(notes):
+        """ Counts how many times each midi pitch is played """
+        histogram = [0] * 128
+        for note in notes:
+            histogram[note["raw_pitch"]] += 1
+        return histogram
+
+    @staticmethod
+    def score_transpositions(histogram, music_box, shifts, fold_octaves=False):
+        """
+        Scores each transposition by the amount of notes the box would be able to play.
+
+        Only the histogram is visited, so the cost doesn't depend on the song length.
+
+        Parameters
+        ----------
+        histogram: list
+            Notes count per midi pitch, as returned by pitch_histogram
+        music_box: MusicBox
+        shifts: iterable
+            Semitone shifts to evaluate
+        fold_octaves: bool
+            Whether out of range notes will be moved by octaves into the box range
+
+        Returns
+        -------
+        dict
+            shift -> playable notes
+        """
+        # Pad the mask so shifted pitches never go out of bounds
+        padding = max(abs(shift) for shift in shifts) if shifts else 0
+        mask = music_box.playable_mask(fold_octaves, size=128 + padding)
+        used = [(pitch, count) for pitch, count in enumerate(histogram) if count > 0]
+        scores = dict()
+        for shift in shifts:
+            scores[shift] = sum(count for pitch, count in used if 0 <= pitch + shift and mask[pitch + shift])
+        return scores
+
+    @staticmethod
+    def best_transposition(notes, music_box, max_shift=12, fold_octaves=False, histogram=None):
+        """
+        Finds the shift in [-max_shift, max_shift] that maximizes playable notes.
+        Ties are resolved in favour of the smallest shift.
+        If the pitch_histogram of the notes is given, notes are not read.
+
+        Returns
+        -------
+        tuple
+            (shift, playable notes count)
+        """
+        shifts = sorted(range(-max_shift, max_shift + 1), key=lambda s: (abs(s), s < 0))
+        if histogram is None:
+            histogram = Parser.pitch_histogram(notes)
+        scores = Parser.score_transpositions(histogram, music_box, shifts, fold_octaves)
+        best = max(shifts, key=lambda s: scores[s])
+        return best, scores[best]
 
     @staticmethod
     def round_beats(midi_object, min_delay):
@@ -39,6 +162,64 @@ class Parser:
     def note_to_pitch(note, octave):
         return 12 * (octave + 1) + "C C# D D# E F F# G G# A A# B".split(" ").index(note)
 
+    @staticmethod
+    def best_box(notes, music_boxes, max_shift=0, fold_octaves=False, histogram=None):
+        """
+        Finds the music box able to play most of the song.
+
+        The histogram is computed once and every box is scored against its own pitch table.
+        Ties go to the smallest shift, then to the first box in the list.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by render_to_box
+        music_boxes: list
+            MusicBox instances to choose from
+        max_shift: int
+            Semitones to try in either direction. 0 disables transposition
+        fold_octaves: bool
+        histogram: list
+            pitch_histogram of the notes. If given, notes are not read
+
+        Returns
+        -------
+        tuple
+            (box index, shift, playable notes count)
+        """
+        if histogram is None:
+            histogram = Parser.pitch_histogram(notes)
+        shifts = sorted(range(-max_shift, max_shift + 1), key=lambda s: (abs(s), s < 0))
+        best = None
+        for index, music_box in enumerate(music_boxes):
+            scores = Parser.score_transpositions(histogram, music_box, shifts, fold_octaves)
+            shift = max(shifts, key=lambda s: scores[s])
+            if best is None or (scores[shift], -abs(shift)) > (best[2], -abs(best[1])):
+                best = (index, shift, scores[shift])
+        return best
+
+    @staticmethod
+    def midi_tick_to_tick(midi_tick, resolution):
+        """ Tick of the fixed point timeline for a tick of a midi file, with resolution ticks per quarter note """
+        return (2 * TICKS_PER_BEAT * midi_tick + resolution // 2) // resolution
+
+    @staticmethod
+    def make_note(pitch, tick):
+        """ Note as returned by render_to_box. beat is kept for display and for code working in beats """
+        note, octave = Parser.pitch_to_note(pitch)
+        return {"note": note, "octave": octave, "beat": tick / TICKS_PER_BEAT, "tick": tick, "raw_pitch": pitch}
+
+    @staticmethod
+    def at_tick(note, tick):
+        """ Returns a copy of a rendered note moved to another tick """
+        return dict(note, beat=tick / TICKS_PER_BEAT, tick=tick)
+
+    @staticmethod
+    def _with_pitch(note, pitch):
+        """ Returns a copy of a rendered note with a different pitch """
+        name, octave = Parser.pitch_to_note(pitch)
+        return dict(note, note=name, octave=octave, raw_pitch=pitch)
+
     @staticmethod
     def render_to_box(midi_file):
         """
@@ -46,26 +227,190 @@ class Parser:
 
         Parameters
         ----------
-        midi_object: midi.Pattern
+        midi_file: Path, binary file object or bytes
 
         Returns
         -------
         dict
 
         """
-        midi_object = midi.read_midifile(midi_file)
+        import midi
+        midi_object = midi.read_midifile(Parser.as_file(midi_file))
         midi_object.make_ticks_abs()
         resolution = midi_object.resolution
         rendered = list()
         for track in midi_object:
             for event in track:
                 if isinstance(event, midi.NoteOnEvent) and event.get_velocity() > 0:
-                    note, octave = Parser.pitch_to_note(event.get_pitch())
-                    rendered.append({
-                        "note": note,
-                        "octave": octave,
-                        "beat": event.tick / resolution * 2,
-                        "raw_pitch": event.get_pitch()
-                    })
-        rendered = sorted(rendered, key=lambda k: k["beat"])
-        return rendered
\ No newline at end of file
+                    rendered.append(Parser.make_note(event.get_pitch(),
+                                                     Parser.midi_tick_to_tick(event.tick, resolution)))
+        rendered = sorted(rendered, key=lambda k: k["tick"])
+        return rendered
+
+    @staticmethod
+    def iter_notes(midi_file, chunk_size=64 * 1024):
+        """
+        Reads the notes of a midi file incrementally, in beat order, without loading the file or its events.
+        Gives the same notes as render_to_box, in the same order.
+
+        Each track is decoded by its own generator, reading chunk_size bytes at a time, and tracks are merged by
+        beat. Memory depends on the amount of tracks, not on the song length.
+
+        Parameters
+        ----------
+        midi_file: Path, bytes, or binary file object that supports seek
+
+        Returns
+        -------
+        generator
+            Notes as returned by render_to_box
+        """
+        f = open(midi_file, "rb") if isinstance(midi_file, str) else Parser.as_file(midi_file)
+        try:
+            resolution, chunks = Parser.track_chunks(f)
+            tracks = [Parser._track_notes(Parser._track_bytes(f, offset, length, chunk_size), resolution)
+                      for offset, length in chunks]
+            # merge is stable, so notes at the same beat keep the track order, like sorting all of them
+            yield from heapq.merge(*tracks, key=lambda note: note["tick"])
+        finally:
+            if f is not midi_file:
+                f.close()
+
+    @staticmethod
+    def track_chunks(f):
+        """
+        Finds the tracks of a midi file from the chunk headers, without decoding any event.
+
+        Parameters
+        ----------
+        f: Binary file object that supports seek
+
+        Returns
+        -------
+        tuple
+            (resolution, list of (offset, length) of the data of each track)
+        """
+        if f.read(4) != MIDI_HEADER:
+            raise TypeError("Bad header in MIDI file.")
+        header_size, _, tracks_count, resolution = struct.unpack(">LHHH", f.read(10))
+        offset = 8 + header_size
+        chunks = list()
+        for _ in range(tracks_count):
+            f.seek(offset)
+            magic, track_size = struct.unpack(">4sL", f.read(8))
+            if magic != TRACK_HEADER:
+                raise TypeError("Bad track header in MIDI file: " + repr(magic))
+            chunks.append((offset + 8, track_size))
+            offset += 8 + track_size
+        return resolution, chunks
+
+    @staticmethod
+    def render_tracks(midi_file, workers=None):
+        """
+        Same as render_to_box, decoding the tracks concurrently in a process pool. The tracks are found from their
+        chunk headers (see track_chunks) and each worker decodes one, from a memory map of the file when it's a path.
+        The tracks come back as arrays of ticks and pitches and are merged by tick.
+
+        Parameters
+        ----------
+        midi_file: Path, binary file object or bytes
+        workers: Processes decoding tracks. Defaults to the amount of cores. Small files (see PARALLEL_MIN_BYTES) and
+            files with a single track are decoded in this process
+        """
+        if isinstance(midi_file, str):
+            with open(midi_file, "rb") as f:
+                resolution, chunks = Parser.track_chunks(f)
+                size = os.fstat(f.fileno()).st_size
+            jobs = [(midi_file, offset, length) for offset, length in chunks]
+        else:
+            content = Parser.as_file(midi_file).read()
+            resolution, chunks = Parser.track_chunks(io.BytesIO(content))
+            size = len(content)
+            jobs = [(content[offset:offset + length], 0, length) for offset, length in chunks]
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers < 2 or size < PARALLEL_MIN_BYTES:
+            tracks = [Parser._decode_track(*job, resolution) for job in jobs]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                tracks = list(pool.map(Parser._decode_track, *zip(*jobs), [resolution] * len(jobs)))
+        # merge is stable, so notes at the same tick keep the track order, like render_to_box
+        merged = heapq.merge(*(zip(ticks, pitches) for ticks, pitches in tracks), key=operator.itemgetter(0))
+        return [Parser.make_note(pitch, tick) for tick, pitch in merged]
+
+    @staticmethod
+    def _decode_track(source, offset, length, resolution):
+        """ Ticks (array of int64) and pitches (bytes) of the notes of a track, from a path or the track bytes """
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                if length == 0 or os.fstat(f.fileno()).st_size <= offset:
+                    return array("q"), b""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    source = mapped[offset:offset + length]
+        else:
+            source = source[offset:offset + length]
+        ticks = array("q")
+        pitches = bytearray()
+        for note in Parser._track_notes(iter(source), resolution):
+            ticks.append(note["tick"])
+            pitches.append(note["raw_pitch"])
+        return ticks, bytes(pitches)
+
+    @staticmethod
+    def _track_bytes(f, offset, length, chunk_size):
+        """ Bytes of a track, read a chunk at a time. Tracks can share the file object """
+        while length > 0:
+            f.seek(offset)
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                return
+            offset += len(chunk)
+            length -= len(chunk)
+            yield from chunk
+
+    @staticmethod
+    def _track_notes(data, resolution):
+        """
+        Notes of a track, from an iterator over its bytes.
+        Follows the same rules as the midi package reader (running status survives meta events, sysex data goes
+        up to 0xF7 and a track ends wherever its data ends), so both give the same notes.
+        """
+        tick = 0
+        running_status = None
+        while True:
+            try:
+                # Delta time, as a variable length quantity
+                delta = 0
+                byte = 0x80
+                while byte & 0x80:
+                    byte = next(data)
+                    delta = (delta << 7) | (byte & 0x7F)
+                tick += delta
+                status = next(data)
+                if status == 0xFF:
+                    next(data)
+                    length = 0
+                    byte = 0x80
+                    while byte & 0x80:
+                        byte = next(data)
+                        length = (length << 7) | (byte & 0x7F)
+                    for _ in range(length):
+                        next(data)
+                    continue
+                if status == 0xF0:
+                    while next(data) != 0xF7:
+                        pass
+                    continue
+                kind = status & 0xF0
+                if kind in CHANNEL_MESSAGE_LENGTHS:
+                    running_status = status
+                    values = [next(data) for _ in range(CHANNEL_MESSAGE_LENGTHS[kind])]
+                else:
+                    # Data byte of a message that reuses the last status
+                    assert running_status, "Bad byte value"
+                    kind = running_status & 0xF0
+                    values = [status] + [next(data) for _ in range(CHANNEL_MESSAGE_LENGTHS[kind] - 1)]
+            except StopIteration:
+                return
+            if kind == 0x90 and values[1] > 0:
+                yield Parser.make_note(values[0], Parser.midi_tick_to_tick(tick, resolution))
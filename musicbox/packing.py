@@ -0,0 +1,76 @@
+"""Packs strip segments of a fixed height into rows ("shelves") and pages."""
+import bisect
+
+
+class ShelfPacker:
+    """
+    Places strip segments side by side in shelves, and shelves one below the other in pages.
+    All units in mm.
+
+    Every segment has the same height (the strip width), so this is a 1D bin packing of segment
+    lengths into shelves, solved with best-fit decreasing: longest segments first, each in the shelf it fills the
+    most. Pinned segments (like the header of a song) are placed first, in their order, so the first one starts the
+    first shelf. Sorting is O(n log n); finding the shelf is a bisection, but keeping the shelves sorted by room
+    moves O(shelves) items, so packing is O(n * shelves) in the worst case.
+    """
+
+    def __init__(self, shelf_length, shelves_per_page, gap=0):
+        """
+
+        Parameters
+        ----------
+        shelf_length: Length available in each shelf
+        shelves_per_page: How many shelves fit in a page
+        gap: Space left between two segments in the same shelf
+        """
+        if shelves_per_page < 1:
+            raise ValueError("Strips don't fit in the page")
+        self.shelf_length = shelf_length
+        self.shelves_per_page = shelves_per_page
+        self.gap = gap
+
+    def pack(self, lengths, pinned=()):
+        """
+        Assigns a position to each segment.
+
+        Parameters
+        ----------
+        lengths: list
+            Length of each segment
+        pinned: Indexes of the segments placed before the others, in this order
+
+        Returns
+        -------
+        list
+            (page, shelf, x offset) for each segment, in the same order as lengths
+        """
+        # A gap is reserved after every segment, so the shelf gets one extra gap of room
+        capacity = self.shelf_length + self.gap
+        # Remaining room per shelf, kept sorted as (room, shelf) so the tightest fit is found by bisection
+        free = list()
+        used = list()
+        positions = [None] * len(lengths)
+        # Stable, so segments of the same length keep their order
+        pinned = list(pinned)
+        is_pinned = set(pinned)
+        order = pinned + sorted((i for i in range(len(lengths)) if i not in is_pinned), key=lambda i: -lengths[i])
+        for i in order:
+            size = lengths[i] + self.gap
+            if size > capacity + 1e-9:
+                raise ValueError(f"Segment of {lengths[i]}mm doesn't fit in a {self.shelf_length}mm shelf")
+            index = bisect.bisect_left(free, (size - 1e-9, -1))
+            if index < len(free):
+                room, shelf = free.pop(index)
+            else:
+                shelf = len(used)
+                used.append(0)
+                room = capacity
+            positions[i] = (shelf // self.shelves_per_page, shelf % self.shelves_per_page, used[shelf])
+            used[shelf] += size
+            bisect.insort(free, (room - size, shelf))
+        return positions
+
+    def pages_needed(self, lengths, pinned=()):
+        """ Amount of pages pack would use """
+        positions = self.pack(lengths, pinned)
+        return max((page for page, _, _ in positions), default=-1) + 1
@@ -0,0 +1,9 @@
+"""Paper sizes. Kept apart from the layout code so the command line can list them without loading fpdf."""
+
+# Common paper sizes (mm), portrait
+PAPER_SIZES = {
+    "letter": (215.9, 279.4),
+    "legal": (215.9, 355.6),
+    "a4": (210.0, 297.0),
+    "a3": (297.0, 420.0),
+}
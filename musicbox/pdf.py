@@ -1,13 +1,34 @@
-from .midi import Parser
+import bisect
+import collections
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .diagnostics import Diagnostics
+from .midi import Parser, TICKS_PER_BEAT
+from .packing import ShelfPacker
 from fpdf import FPDF
+from fpdf.php import UTF8ToUTF16BE
+
+RES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "res")
+# Operators in a content stream: words that aren't numbers or names
+CONTENT_OPERATOR = re.compile(r"(?<![\w/.-])[A-Za-z*']+(?!\w)")
+# zlib level of the content streams, the one FPDF uses. 0 writes them uncompressed
+DEFAULT_COMPRESSION_LEVEL = 6
 
 class Renderer(FPDF):
     """
     Represents a music box document.
     All units in mm except for fonts, which are in points.
     """
+    # left, top, right
+    MARGINS = (8, 6, 8)
+    BOTTOM_MARGIN = 0
 
-    def __init__(self, music_box_object, paper_size=(279.4, 215.9), strip_separation=0, style={}):
+    def __init__(self, music_box_object, paper_size=(279.4, 215.9), strip_separation=0, style={}, orientation="l",
+                 share_strips=False, compression_level=DEFAULT_COMPRESSION_LEVEL, compression_workers=None):
         """
 
         Parameters
@@ -15,60 +36,372 @@ class Renderer(FPDF):
         music_box_object: MusicBox
         paper_size: Size of the paper where the file will be printed to
         strip_separation: Separation between strips in the paper
+        orientation: "l" for landscape, "p" for portrait
+        share_strips: Draw each strip grid and each pattern of holes once, and reuse them (see draw_shared_strip)
+        compression_level: zlib level of the content streams, from 1 to 9. 0 leaves them uncompressed: bigger files,
+            but faster to write, for local previews
+        compression_workers: Threads compressing the content streams. Defaults to the amount of cores
         """
-        super().__init__("l", "mm", paper_size)
+        super().__init__(orientation, "mm", paper_size)
         self.set_author("Mexomagno")
-        self.set_auto_page_break(True)
-        self.set_margins(8, 6, 8)
+        self.set_auto_page_break(True, self.BOTTOM_MARGIN)
+        self.set_margins(*self.MARGINS)
         self.alias_nb_pages()
-        self.set_compression(True)
+        self.set_compression(compression_level > 0)
+        self.compression_level = compression_level
+        self.compression_workers = compression_workers
         self.music_box_object = music_box_object
         self.strip_separation = strip_separation
         self.generated = False
+        # Notes that couldn't be drawn, filled by generate
+        self.diagnostics = Diagnostics()
+        # Form XObjects by content key, in creation order. None if strips aren't shared
+        self.strip_forms = dict() if share_strips else None
+        self.sharing = {"strips": 0, "inline_bytes": 0, "inline_operators": 0, "inline_seconds": 0.0,
+                        "shared_bytes": 0, "shared_operators": 0, "seconds": 0.0}
 
         # Styles
         self.styles = style
 
-    def generate(self, midi_file, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR"):
+    def generate(self, midi_file, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR", parsed_notes=None,
+                 columns=None):
+        """
+
+        Parameters
+        ----------
+        midi_file: Path, binary file object or bytes of the midi file
+        output_file: Path or binary file object where the pdf will be written. If None, the pdf bytes are returned
+        song_title
+        song_author
+        parsed_notes: Notes as returned by Parser.render_to_box. If given, midi_file is not parsed again
+        columns: If given, strips are cut in this many columns and packed in the pages (see generate_packed)
+        """
+        if columns is not None:
+            return self.generate_packed([{"midi_file": midi_file,
+                                          "song_title": song_title,
+                                          "song_author": song_author,
+                                          "parsed_notes": parsed_notes}],
+                                        output_file, columns=columns)
         if self.generated:
             raise RuntimeError("Document was already generated!")
 
         self.set_title("{} - {} ({}x{})".format(song_title, song_author, self.w, self.h))
-        # Parse midi file
-        # Beware: Complex, giant midi files will be brought to memory all at once with this step!
-        parsed_notes = Parser.render_to_box(midi_file)
+        if parsed_notes is None:
+            # Parse midi file
+            # Beware: Complex, giant midi files will be brought to memory all at once with this step!
+            # See StreamingRenderer for those
+            parsed_notes = Parser.render_to_box(midi_file)
+        else:
+            parsed_notes = list(parsed_notes)
+        self.diagnostics.check_notes(parsed_notes, self.music_box_object)
 
         self.add_page()
         strip_generator = StripGenerator(music_box_object=self.music_box_object,
                                          song_title=song_title,
                                          song_author=song_author,
-                                         styles=self.styles)
-        # Add notes to strip
-        current_y = - strip_generator.get_height() / 2 - self.strip_separation + self.t_margin
+                                         styles=self.styles,
+                                         diagnostics=self.diagnostics)
+        strip_generator.draw_strips(self, parsed_notes, self.strip_separation)
 
-        drawn_beats = 0
-        while len(parsed_notes) > 0:
-            # print("> Created new strip")
-            new_strip = strip_generator.new_strip(drawn_beats)
-            current_y += strip_generator.get_height() + self.strip_separation
-            if current_y + strip_generator.get_height() / 2 > self.h - self.b_margin:
-                # print("> Had to add page")
+        self.generated = True
+        self.diagnostics.pages = self.page
+        return self.write_output(output_file)
+
+    def generate_packed(self, songs, output_file, columns=1, column_gap=2):
+        """
+        Cuts the strips of one or more songs in segments and packs them to use as few pages as possible (see
+        ShelfPacker). The last segment of each song only takes the beats it needs. The header of the first song
+        starts the first page, and every other segment is labelled with its song and place in it, like "Title 2/5",
+        to put the strips back together.
+
+        Parameters
+        ----------
+        songs: list
+            dicts with "song_title", "song_author" and either "parsed_notes" or "midi_file"
+        output_file: Path or binary file object where the pdf will be written. If None, the pdf bytes are returned
+        columns: Segments that fit across a page. Headers and trimmed segments may share a row with others
+        column_gap: Space between two segments in the same row
+        """
+        if self.generated:
+            raise RuntimeError("Document was already generated!")
+
+        titles = [f"{song['song_title']} - {song['song_author']}" for song in songs]
+        self.set_title("{} ({}x{})".format(", ".join(titles), self.w, self.h))
+
+        BEAT_WIDTH = self.music_box_object.beat_width
+        STRIP_HEIGHT = Strip.height(self.music_box_object)
+        shelf_length = self.w - self.l_margin - self.r_margin
+        column_length = (shelf_length - (columns - 1) * column_gap) / columns
+        shelves_per_page = int((self.h - self.t_margin - self.b_margin - STRIP_HEIGHT) /
+                               (STRIP_HEIGHT + self.strip_separation)) + 1
+
+        segments = list()
+        headers = list()
+        for song in songs:
+            headers.append(len(segments))
+            segments += self._song_segments(song, column_length)
+        lengths = [segment["header_width"] + segment["beats"] * BEAT_WIDTH for segment in segments]
+        positions = ShelfPacker(shelf_length, shelves_per_page, column_gap).pack(lengths, pinned=headers)
+
+        # Draw page by page
+        placed = sorted(zip(positions, segments, lengths), key=lambda item: item[0])
+        current_page = -1
+        for (page, shelf, x_offset), segment, length in placed:
+            while current_page < page:
                 self.add_page()
-                current_y = strip_generator.get_height() / 2 + self.t_margin
-            parsed_notes, total_strip_beats = new_strip.draw(pdf=self,
-                                                             x0=self.l_margin,
-                                                             x1=self.w - self.r_margin,
-                                                             y=current_y,
-                                                             notes=parsed_notes)
-            drawn_beats += total_strip_beats
-            # print("> Drew a strip")
+                current_page += 1
+            x0 = self.l_margin + x_offset
+            y = self.t_margin + STRIP_HEIGHT / 2 + shelf * (STRIP_HEIGHT + self.strip_separation)
+            segment["strip"].draw(pdf=self, x0=x0, x1=x0 + length, y=y, notes=segment["notes"])
+            if segment["label"]:
+                # In the margin above the grid
+                self.set_font("Arial", "", Strip.LABEL_FONT_SIZE)
+                self.text(x=x0 + 1, y=y - STRIP_HEIGHT / 2 + 1 + self.font_size, txt=segment["label"])
 
         self.generated = True
-        self.output(output_file, "F")
+        self.diagnostics.pages = self.page
+        return self.write_output(output_file)
+
+    def write_output(self, output_file=None):
+        """ Writes the pdf to a path or a binary file object. Without output_file, returns the pdf bytes """
+        if isinstance(output_file, (str, os.PathLike)):
+            self.output(output_file, "F")
+            return None
+        data = self.output(dest="S").encode("latin1")
+        if output_file is None:
+            return data
+        output_file.write(data)
+
+    def draw_shared_strip(self, strip, x0, x1, y, notes):
+        """
+        Draws a strip without header as references to Form XObjects: one with the grid, shared by every strip of the
+        same length, and one with the holes, shared by the strips with the same holes at the same relative beats
+        (like repeated choruses). Looks the same as Strip.draw, and returns the same.
+        """
+        start_time = time.perf_counter()
+        BEAT_WIDTH = self.music_box_object.beat_width
+        total_strip_beats = Strip.beats_in(x1 - x0, BEAT_WIDTH)
+        first_tick = strip.first_beat * TICKS_PER_BEAT
+        max_tick = first_tick + total_strip_beats * TICKS_PER_BEAT
+        start = 0
+        while start < len(notes) and notes[start]["tick"] < first_tick:
+            if strip.diagnostics is not None:
+                strip.diagnostics.add(Diagnostics.BEFORE_STRIP, Diagnostics.format_note(notes[start]))
+            start += 1
+        end = start
+        while end < len(notes) and notes[end]["tick"] <= max_tick:
+            end += 1
+        strip_notes = notes[start:end]
+        holes = tuple((note["tick"] - first_tick, note["raw_pitch"]) for note in strip_notes
+                      if Diagnostics.classify_pitch(self.music_box_object, note["raw_pitch"]) is None)
+
+        # Forms are drawn with the strip starting at x=0 and centered at y=0 in PDF units, and placed with a translation
+        width = x1 - x0
+        names = [self._strip_form(("grid", round(width, 6)), lambda: strip._draw_body(self, 0, width, self.h))]
+        if holes:
+            names.append(self._strip_form(("holes", round(width, 6), holes),
+                                          lambda: strip._draw_notes(self, 0, width, self.h, list(strip_notes))))
+        invocation = "q 1 0 0 1 %.2f %.2f cm %s Q" % (x0 * self.k, (self.h - y) * self.k,
+                                                      " ".join("/{} Do".format(name) for name in names))
+        self._out(invocation)
+        self.sharing["strips"] += 1
+        self.sharing["shared_bytes"] += len(invocation) + 1
+        self.sharing["shared_operators"] += len(CONTENT_OPERATOR.findall(invocation))
+        self.sharing["seconds"] += time.perf_counter() - start_time
+        return notes[end:], total_strip_beats
+
+    def _strip_form(self, key, draw):
+        """ Name of the form with the given key. Calls draw to fill its content if it's new """
+        form = self.strip_forms.get(key)
+        if form is None:
+            page_content = self.pages[self.page]
+            self.pages[self.page] = ""
+            start_time = time.perf_counter()
+            draw()
+            content = self.pages[self.page]
+            form = {"name": "S{}".format(len(self.strip_forms) + 1),
+                    "content": content,
+                    "operators": len(CONTENT_OPERATOR.findall(content)),
+                    "seconds": time.perf_counter() - start_time,
+                    "height": Strip.height(self.music_box_object),
+                    "width": key[1]}
+            self.pages[self.page] = page_content
+            self.strip_forms[key] = form
+        self.sharing["inline_bytes"] += len(form["content"])
+        self.sharing["inline_operators"] += form["operators"]
+        self.sharing["inline_seconds"] += form["seconds"]
+        return form["name"]
+
+    def sharing_summary(self):
+        """ What sharing strips saved, against drawing every strip inline. The time of inline strips is estimated """
+        forms = list(self.strip_forms.values()) if self.strip_forms else []
+        forms_bytes = sum(len(form["content"]) for form in forms)
+        forms_operators = sum(form["operators"] for form in forms)
+        forms_seconds = sum(form["seconds"] for form in forms)
+        return {"strips": self.sharing["strips"],
+                "forms": len(forms),
+                "operators_saved": self.sharing["inline_operators"] - self.sharing["shared_operators"] - forms_operators,
+                "bytes_saved": self.sharing["inline_bytes"] - self.sharing["shared_bytes"] - forms_bytes,
+                "seconds_saved": self.sharing["inline_seconds"] - self.sharing["seconds"] + forms_seconds}
+
+    def compress_streams(self, contents):
+        """
+        Compresses content streams (str, as FPDF keeps them) in parallel, as zlib releases the GIL while compressing.
+        Yields the compressed streams in order, as they're done. At most two per thread are compressed ahead of the one
+        being written, so they aren't all held at once
+        """
+        def _compress(content):
+            return zlib.compress(content.encode("latin1"), self.compression_level)
+
+        workers = min(self.compression_workers or os.cpu_count() or 1, len(contents))
+        if workers < 2:
+            yield from map(_compress, contents)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = collections.deque()
+            for content in contents:
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(_compress, content))
+            while pending:
+                yield pending.popleft().result()
+
+    @property
+    def buffer(self):
+        """ The pdf written so far. Kept as a list of lines, joined when read: FPDF adds every line to one string,
+        which copies all of it each time and makes big documents slow to write """
+        if len(self._lines) > 1:
+            self._lines = ["".join(self._lines)]
+        return self._lines[0]
+
+    @buffer.setter
+    def buffer(self, value):
+        self._lines = [value]
+        self._buffer_size = len(value)
+
+    def _out(self, s):
+        if self.state == 2:
+            return super()._out(s)
+        if isinstance(s, bytes):
+            s = s.decode("latin1")
+        line = str(s) + "\n"
+        self._lines.append(line)
+        self._buffer_size += len(line)
+
+    def _newobj(self):
+        self.n += 1
+        self.offsets[self.n] = self._buffer_size
+        self._out(str(self.n) + " 0 obj")
+
+    def _putpages(self):
+        """ Same objects as FPDF._putpages, with the pages compressed in parallel by compress_streams """
+        if not self.compress or self.page_links:
+            return super()._putpages()
+        nb = self.page
+        if hasattr(self, "str_alias_nb_pages"):
+            alias, replacement = UTF8ToUTF16BE(self.str_alias_nb_pages, False), UTF8ToUTF16BE(str(nb), False)
+            for n in range(1, nb + 1):
+                self.pages[n] = self.pages[n].replace(alias, replacement).replace(self.str_alias_nb_pages, str(nb))
+        if self.def_orientation == "P":
+            w_pt, h_pt = self.fw_pt, self.fh_pt
+        else:
+            w_pt, h_pt = self.fh_pt, self.fw_pt
+        contents = self.compress_streams([self.pages[n] for n in range(1, nb + 1)])
+        for n, content in enumerate(contents, 1):
+            self._newobj()
+            self._out("<</Type /Page")
+            self._out("/Parent 1 0 R")
+            if n in self.orientation_changes:
+                self._out("/MediaBox [0 0 %.2f %.2f]" % (h_pt, w_pt))
+            self._out("/Resources 2 0 R")
+            if self.pdf_version > "1.3":
+                self._out("/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>")
+            self._out("/Contents " + str(self.n + 1) + " 0 R>>")
+            self._out("endobj")
+            self._newobj()
+            self._out("<</Filter /FlateDecode /Length " + str(len(content)) + ">>")
+            self._putstream(content)
+            self._out("endobj")
+        self.offsets[1] = self._buffer_size
+        self._out("1 0 obj")
+        self._out("<</Type /Pages")
+        self._out("/Kids [" + "".join(str(3 + 2 * i) + " 0 R " for i in range(nb)) + "]")
+        self._out("/Count " + str(nb))
+        self._out("/MediaBox [0 0 %.2f %.2f]" % (w_pt, h_pt))
+        self._out(">>")
+        self._out("endobj")
+
+    def _putresources(self):
+        forms = list((self.strip_forms or {}).values())
+        contents = [form["content"] for form in forms]
+        if self.compress:
+            contents = self.compress_streams(contents)
+        # Forms go before the resources dictionary, which lists them
+        for form, content in zip(forms, contents):
+            margin = 5 * self.k
+            self._newobj()
+            form["n"] = self.n
+            self._out("<</Type /XObject /Subtype /Form /BBox [%.2f %.2f %.2f %.2f] /Resources <<>>" % (
+                -margin, -form["height"] / 2 * self.k - margin, form["width"] * self.k + margin,
+                form["height"] / 2 * self.k + margin))
+            self._out(("/Filter /FlateDecode " if self.compress else "") + "/Length " + str(len(content)) + ">>")
+            self._putstream(content)
+            self._out("endobj")
+        super()._putresources()
+
+    def _putxobjectdict(self):
+        super()._putxobjectdict()
+        for form in (self.strip_forms or {}).values():
+            self._out("/{} {} 0 R".format(form["name"], form["n"]))
+
+    def _song_segments(self, song, column_length):
+        """ Splits a song in strips no longer than column_length, each with its own slice of notes """
+        BEAT_WIDTH = self.music_box_object.beat_width
+        notes = song.get("parsed_notes")
+        if notes is None:
+            notes = Parser.render_to_box(song["midi_file"])
+        self.diagnostics.check_notes(notes, self.music_box_object)
+        ticks = [note["tick"] for note in notes]
+        last_tick = ticks[-1] if ticks else 0
+        header_width = Strip.header_width(Strip.title_font_size(self.music_box_object,
+                                                                song["song_title"], song["song_author"]))
+        segment_beats = Strip.beats_in(column_length, BEAT_WIDTH)
+        first_segment_beats = Strip.beats_in(column_length - header_width, BEAT_WIDTH)
+        if first_segment_beats < 1:
+            raise ValueError("Columns are too narrow to fit the song header")
+
+        segments = list()
+        start_beat = 0
+        start_index = 0
+        while not segments or start_beat * TICKS_PER_BEAT < last_tick:
+            is_first = not segments
+            strip_beats = first_segment_beats if is_first else segment_beats
+            # Don't draw empty beats after the end of the song
+            strip_beats = min(strip_beats, max(1, -((start_beat * TICKS_PER_BEAT - last_tick) // TICKS_PER_BEAT)))
+            # Notes right on the end of a strip are drawn in that strip
+            end_index = bisect.bisect_right(ticks, (start_beat + strip_beats) * TICKS_PER_BEAT)
+            if is_first:
+                strip = Strip(self.music_box_object,
+                              header={"song_title": song["song_title"], "song_author": song["song_author"]},
+                              styles=self.styles, diagnostics=self.diagnostics)
+            else:
+                strip = Strip(self.music_box_object, first_beat=start_beat, styles=self.styles,
+                              diagnostics=self.diagnostics)
+            segments.append({
+                "strip": strip,
+                "notes": notes[start_index:end_index],
+                "beats": strip_beats,
+                "header_width": header_width if is_first else 0,
+            })
+            start_beat += strip_beats
+            start_index = end_index
+        for number, segment in enumerate(segments, 1):
+            segment["label"] = None if number == 1 else f"{song['song_title']} {number}/{len(segments)}"
+        return segments
 
 
 class StripGenerator:
-    def __init__(self, music_box_object, song_title=None, song_author=None, styles={}):
+    def __init__(self, music_box_object, song_title=None, song_author=None, styles={}, diagnostics=None):
         """
 
         Parameters
@@ -76,12 +409,14 @@ class StripGenerator:
         music_box_object: MusicBox
         song_title
         song_author
+        diagnostics: Diagnostics where the strips count the notes they drop
         """
         self.music_box_object = music_box_object
         self.song_title = song_title
         self.song_author = song_author
         self.has_header = False
         self.styles = styles
+        self.diagnostics = diagnostics
 
     def new_strip(self, first_beat_position):
         if not self.has_header:
@@ -89,21 +424,96 @@ class StripGenerator:
             return Strip(music_box_object=self.music_box_object,
                          header={"song_title": self.song_title,
                                  "song_author": self.song_author},
-                        styles=self.styles)
+                        styles=self.styles,
+                        diagnostics=self.diagnostics)
         else:
             return Strip(self.music_box_object,
                          first_beat=first_beat_position,
-                         styles=self.styles)
+                         styles=self.styles,
+                         diagnostics=self.diagnostics)
 
     def get_height(self):
-        pw = self.music_box_object.pin_width
-        nc = self.music_box_object.notes_count
-        sm = self.music_box_object.get_margins()
-        return pw * (nc - 1) + sum(sm)
+        return Strip.height(self.music_box_object)
+
+    def strip_positions(self, pdf, strip_separation=0):
+        """ Yields (page index, y) of each strip drawn by draw_strips, starting from the current page """
+        height = self.get_height()
+        page = 0
+        current_y = - height / 2 - strip_separation + pdf.t_margin
+        while True:
+            current_y += height + strip_separation
+            if current_y + height / 2 > pdf.h - pdf.b_margin:
+                page += 1
+                current_y = height / 2 + pdf.t_margin
+            yield page, current_y
+
+    @staticmethod
+    def strip_windows(notes, first_strip_beats, strip_beats):
+        """
+        Splits the notes in strips the way draw_strips does, without drawing them.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box, sorted by beat
+        first_strip_beats: Beats that fit in the first strip, after its header
+        strip_beats: Beats that fit in the rest of strips
+
+        Returns
+        -------
+        list
+            (first beat, start index, end index) of the notes of each strip
+        """
+        ticks = [note["tick"] for note in notes]
+        windows = list()
+        start_beat = 0
+        start_index = 0
+        while start_index < len(notes):
+            window_beats = first_strip_beats if not windows else strip_beats
+            # Notes right on the end of a strip are drawn in that strip
+            end_index = bisect.bisect_right(ticks, (start_beat + window_beats) * TICKS_PER_BEAT)
+            windows.append((start_beat, start_index, end_index))
+            start_beat += window_beats
+            start_index = end_index
+        return windows
+
+    def draw_strips(self, pdf, notes, strip_separation=0):
+        """
+        Draws the notes in strips one below the other, adding pages as they fill up.
+
+        Parameters
+        ----------
+        pdf: Renderer, or any document with the same drawing methods (see svg.SvgDocument). Must have a page
+        notes: list
+            Notes as returned by Parser.render_to_box. Consumed while drawing
+        strip_separation: Separation between strips in the paper
+        """
+        positions = self.strip_positions(pdf, strip_separation)
+        current_page = 0
+        drawn_beats = 0
+        while len(notes) > 0:
+            new_strip = self.new_strip(drawn_beats)
+            page, current_y = next(positions)
+            if page != current_page:
+                pdf.add_page()
+                current_page = page
+            notes, total_strip_beats = new_strip.draw(pdf=pdf,
+                                                      x0=pdf.l_margin,
+                                                      x1=pdf.w - pdf.r_margin,
+                                                      y=current_y,
+                                                      notes=notes)
+            drawn_beats += total_strip_beats
 
 
 class Strip:
-    def __init__(self, music_box_object, first_beat=0, header=None, styles={}):
+    # Header elements, in mm
+    TRIANGLE_SIZE = (8, 8)
+    TRIANGLE_MARGIN_T = 4
+    # Fonts, in points
+    TITLE_FONT_SIZE = 30
+    LABEL_FONT_SIZE = 6
+
+    def __init__(self, music_box_object, first_beat=0, header=None, styles={}, diagnostics=None):
         """
         Creates a "Strip" representing a paper strip which will contain the notes
 
@@ -114,6 +524,9 @@ class Strip:
             Relative position of this strip's first beat
         header: dict
             Dictionary with header elements if present. None otherwise
+        diagnostics: Diagnostics
+            Where notes before the strip start are counted. Notes the box can't play are skipped silently, as
+            Diagnostics.check_notes counts them up front
 
         """
         self.music_box_object = music_box_object
@@ -121,12 +534,55 @@ class Strip:
         self.song_title = header["song_title"] if self.is_first and "song_title" in header else "NO-TITLE"
         self.song_author = header["song_author"] if self.is_first and "song_author" in header else "NO-TITLE"
         self.first_beat = first_beat
+        self.diagnostics = diagnostics
 
         for param in ['v_line_width', 'h_line_width', 'highlight_width']:
             setattr(self, param, 0.2 if param not in styles else styles[param])
 
+    @staticmethod
+    def height(music_box_object):
+        """ Width of the paper strip, which is drawn horizontally """
+        pw = music_box_object.pin_width
+        nc = music_box_object.notes_count
+        sm = music_box_object.get_margins()
+        return pw * (nc - 1) + sum(sm)
+
+    @staticmethod
+    def title_font_size(music_box_object, song_title, song_author):
+        """
+        Largest title font size (pt) for which title and author fit across the strip.
+        Courier is monospaced (600/1000 em per char), so no font metrics are needed.
+        """
+        STRIP_MARGINS = music_box_object.get_margins()
+        MAX_TITLE_WIDTH = music_box_object.pin_width * music_box_object.notes_count + sum(STRIP_MARGINS) - 4
+        longest = max(len(song_title), len(song_author))
+        font_size = Strip.TITLE_FONT_SIZE
+        while longest * 600 * (font_size / (72 / 25.4)) / 1000 > MAX_TITLE_WIDTH:
+            font_size -= 0.1
+        return font_size
+
+    @staticmethod
+    def header_width(title_font_size=TITLE_FONT_SIZE, label_font_size=LABEL_FONT_SIZE):
+        """
+        Length taken by the header of the first strip, as drawn by _draw_header.
+        The title font shrinks for long titles (see title_font_size), so the default is an upper bound.
+        """
+        pt = 25.4 / 72
+        return Strip.TRIANGLE_MARGIN_T + Strip.TRIANGLE_SIZE[1] + 2 * title_font_size * pt + 5 + 10 \
+            + label_font_size * pt + 1
+
+    @staticmethod
+    def beats_in(length, beat_width):
+        """
+        Whole beats that fit in a length. Lengths are compared in integer micrometres, so float error in the
+        geometry (like a header width) can't cut a beat off a strip
+        """
+        return round(length * 1000) // round(beat_width * 1000)
+
     def draw(self, pdf, x0, x1, y, notes):
         """ Draws the strip in the pdf document """
+        if not self.is_first and getattr(pdf, "strip_forms", None) is not None:
+            return pdf.draw_shared_strip(self, x0, x1, y, notes)
         x_start = x0
         BEAT_WIDTH = self.music_box_object.beat_width
 
@@ -149,7 +605,7 @@ class Strip:
 
         notes_left = self._draw_notes(pdf, x_start, x1, y, notes)
 
-        total_strip_beats = int((x1 - x_start) / BEAT_WIDTH)
+        total_strip_beats = Strip.beats_in(x1 - x_start, BEAT_WIDTH)
         return notes_left, total_strip_beats
 
     def _draw_header(self, pdf, x0, y):
@@ -160,9 +616,9 @@ class Strip:
         # Coordinates are the same, but are drawn rotated
         current_y = y
         # draw triangle
-        TRIANGLE_SIZE = (8, 8)
-        TRIANGLE_MARGIN_T = 4
-        pdf.image(name="res/triangle_tiny.png",
+        TRIANGLE_SIZE = self.TRIANGLE_SIZE
+        TRIANGLE_MARGIN_T = self.TRIANGLE_MARGIN_T
+        pdf.image(name=os.path.join(RES_DIR, "triangle_tiny.png"),
                   x=x0 - TRIANGLE_SIZE[0] / 2,
                   y=current_y + TRIANGLE_MARGIN_T,
                   w=TRIANGLE_SIZE[0],
@@ -172,11 +628,7 @@ class Strip:
         STRIP_MARGINS = self.music_box_object.get_margins()
         PIN_WIDTH = self.music_box_object.pin_width
         N_NOTES = self.music_box_object.notes_count
-        MAX_TITLE_WIDTH = PIN_WIDTH * N_NOTES + sum(STRIP_MARGINS) - 4
-        pdf.set_font("courier", "B", 30)
-
-        while max(pdf.get_string_width(self.song_title), pdf.get_string_width(self.song_author)) > MAX_TITLE_WIDTH:
-            pdf.set_font_size(pdf.font_size_pt - 0.1)
+        pdf.set_font("courier", "B", Strip.title_font_size(self.music_box_object, self.song_title, self.song_author))
         pdf.text(x=x0 - pdf.get_string_width(self.song_title) / 2,
                  y=current_y + TRIANGLE_SIZE[1] + pdf.font_size + 5,
                  txt=self.song_title)
@@ -207,7 +659,7 @@ class Strip:
         pdf.line(x0, y + 4, x0_strip_angle, y + STRIP_WIDTH / 2)
         return x0_adjusted
 
-    def _draw_note_labels(self, pdf, x0, y, font_size=6):
+    def _draw_note_labels(self, pdf, x0, y, font_size=LABEL_FONT_SIZE):
         pdf.set_font("Arial", "B", font_size)
         notes = self.music_box_object.notes
 
@@ -254,12 +706,12 @@ class Strip:
             # else:
             pdf.set_line_width(self.highlight_width if self.music_box_object.is_note_highlighted(note) else self.h_line_width)
             pdf.line(x0, y - STRIP_WIDTH / 2 + PIN_WIDTH * index + PIN_WIDTH / 2,
-                     x0 + (x1 - x0) - ((x1 - x0) % BEAT_WIDTH),
+                     x0 + Strip.beats_in(x1 - x0, BEAT_WIDTH) * BEAT_WIDTH,
                      y - STRIP_WIDTH / 2 + PIN_WIDTH * index + PIN_WIDTH / 2)
 
         # Draw vertical lines
         pdf.set_line_width(self.v_line_width)
-        for v_line in range(int((x1 - x0) / BEAT_WIDTH) + 1):
+        for v_line in range(Strip.beats_in(x1 - x0, BEAT_WIDTH) + 1):
             line_x = x0 + v_line * BEAT_WIDTH
             y_half = STRIP_WIDTH / 2 - PIN_WIDTH / 2
             if v_line % 2 == 0:
@@ -285,20 +737,18 @@ class Strip:
         STRIP_WIDTH = (N_NOTES - 1) * PIN_WIDTH
         pdf.set_draw_color(0, 0, 0)
 
-        NOTE_RADIUS = 1.5
-        total_strip_beats = int((x1 - x0) / BEAT_WIDTH)
-        min_beat = self.first_beat
-        max_beat = min_beat + total_strip_beats
+        HOLE_DIAMETER = 2 * self.music_box_object.hole_radius
+        total_strip_beats = Strip.beats_in(x1 - x0, BEAT_WIDTH)
+        # Strip bounds in ticks, exact. Notes are only converted to mm when drawn
+        min_tick = self.first_beat * TICKS_PER_BEAT
+        max_tick = min_tick + total_strip_beats * TICKS_PER_BEAT
 
         # To filter out notes out of admitted pitch
-        first_note = self.music_box_object.notes[0]
-        last_note = self.music_box_object.notes[-1]
-        min_pitch = Parser.note_to_pitch(first_note[0], first_note[1])
-        max_pitch = Parser.note_to_pitch(last_note[0], last_note[1])
+        min_pitch = self.music_box_object.min_pitch
+        max_pitch = self.music_box_object.max_pitch
 
         # print("This strip: Beats: {} - {}, Note range: {} - {}. Notes left: {}"
-        #       .format(min_beat, max_beat, Parser.pitch_to_note(min_pitch), Parser.pitch_to_note(max_pitch), len(notes)))
-        print("> Notes left: {}".format(len(notes)))
+        #       .format(min_tick, max_tick, Parser.pitch_to_note(min_pitch), Parser.pitch_to_note(max_pitch), len(notes)))
 
         def debug_circle(x, y):
             last_color = pdf.fill_color
@@ -307,42 +757,38 @@ class Strip:
             pdf.ellipse(x - RADIUS / 2, y - RADIUS / 2, RADIUS, RADIUS, "B")
             pdf.fill_color = last_color
 
-        def beat_to_x(beat):
-            return x0 + (beat - min_beat) * BEAT_WIDTH - NOTE_RADIUS / 2
+        def tick_to_x(tick):
+            return x0 + (tick - min_tick) / TICKS_PER_BEAT * BEAT_WIDTH - HOLE_DIAMETER / 2
 
-        def note_to_y(note, octave):
+        def note_to_y(pitch):
             note_y0 = y + STRIP_WIDTH / 2
-            note_position = self.music_box_object.find_note((note, octave))
-            return note_y0 - (note_position * PIN_WIDTH) - NOTE_RADIUS / 2
+            note_position = self.music_box_object.find_pitch(pitch)
+            return note_y0 - (note_position * PIN_WIDTH) - HOLE_DIAMETER / 2
 
         # Remove trailing beats before (error caused?)
-        while notes and notes[0]["beat"] < min_beat:
-            print("deleted note because it had time {}, which is outside {} - {}".format(notes[0]["beat"], min_beat,
-                                                                                         max_beat))
+        while notes and notes[0]["tick"] < min_tick:
+            if self.diagnostics is not None:
+                self.diagnostics.add(Diagnostics.BEFORE_STRIP, Diagnostics.format_note(notes[0]))
             notes.pop(0)
         # Draw notes inside strip
         pdf.set_fill_color(0, 0, 0)
         last_line_width = pdf.line_width
-        pdf.set_line_width(NOTE_RADIUS * 0.6)
+        pdf.set_line_width(HOLE_DIAMETER * 0.6)
         while len(notes) > 0:
             note = notes.pop(0)
             # pprint.pprint(note)
-            n_beat = note["beat"]
-            n_note = note["note"]
-            n_octave = note["octave"]
+            n_tick = note["tick"]
             n_pitch = note["raw_pitch"]
-            if n_beat > max_beat:
-                # print("Reached out of strip note: {}:{}{}".format(n_beat, n_note, n_octave))
+            if n_tick > max_tick:
+                # print("Reached out of strip note: {}:{}{}".format(n_tick, note["note"], note["octave"]))
                 notes = [note] + notes
                 break
             if not min_pitch <= n_pitch <= max_pitch:
-                print(f"Cannot draw note: {Parser.pitch_to_note(n_pitch)} is outside [{self.music_box_object.notes[0]} - {self.music_box_object.notes[-1]}]")
                 continue
             # Draw note
-            if not self.music_box_object.has_note(f"{n_note}{n_octave}"):
-                print(f"Skipped {n_note}{n_octave} (not present in music box)")
+            if not self.music_box_object.has_pitch(n_pitch):
                 continue
-            note_y_pos = note_to_y(n_note, n_octave)
-            pdf.ellipse(beat_to_x(n_beat), note_y_pos, NOTE_RADIUS, NOTE_RADIUS, "B")
+            note_y_pos = note_to_y(n_pitch)
+            pdf.ellipse(tick_to_x(n_tick), note_y_pos, HOLE_DIAMETER, HOLE_DIAMETER, "B")
         pdf.set_line_width(last_line_width)
         return notes
\ No newline at end of file
@@ -0,0 +1,350 @@
+"""
+Machine output to punch the strips on a CNC or plotter, as G-code or DXF.
+
+Holes come from the same Strip code as the PDF, and are punched strip by strip in an order that keeps the tool
+travel short: nearest neighbour over a grid index, then 2-opt over each hole's closest neighbours.
+"""
+import collections
+import math
+
+from .pdf import Strip, StripGenerator
+
+
+class HoleCollector:
+    """
+    Stands in for the PDF document while a strip is drawn, keeping only the holes.
+    Implements the subset of the FPDF API used by Strip; everything but ellipses is ignored.
+    """
+
+    def __init__(self):
+        self.holes = list()
+        self.hole_size = None
+        self.line_width = 0.2
+        self.fill_color = None
+        self.font_size = 0
+
+    def ellipse(self, x, y, w, h, style=""):
+        self.holes.append((x + w / 2, y + h / 2))
+        self.hole_size = w
+
+    def set_font(self, family, style="", size=0):
+        self.set_font_size(size)
+
+    def set_font_size(self, size):
+        self.font_size = size * 25.4 / 72
+
+    def get_string_width(self, s):
+        return 0
+
+    def set_line_width(self, width):
+        self.line_width = width
+
+    def set_draw_color(self, r, g=-1, b=-1):
+        pass
+
+    def set_fill_color(self, r, g=-1, b=-1):
+        pass
+
+    def rotate(self, angle, x=None, y=None):
+        pass
+
+    def line(self, x1, y1, x2, y2):
+        pass
+
+    def dashed_line(self, x1, y1, x2, y2, dash_length=1, space_length=1):
+        pass
+
+    def text(self, x, y, txt=""):
+        pass
+
+    def image(self, name, x=None, y=None, w=0, h=0, type="", link=""):
+        pass
+
+
+class TravelOptimizer:
+    """ Orders points to shorten an open path starting at a given position. Distances are euclidean """
+
+    @staticmethod
+    def distance(points, order, start=(0, 0)):
+        """ Length of the path visiting points in the given order """
+        total = 0
+        x0, y0 = start
+        for i in order:
+            x1, y1 = points[i]
+            total += math.hypot(x1 - x0, y1 - y0)
+            x0, y0 = x1, y1
+        return total
+
+    @staticmethod
+    def optimize(points, start=(0, 0), neighbours=8, max_passes=10):
+        """
+        Nearest neighbour path and the given order, both improved with 2-opt. Returns the shortest.
+
+        Parameters
+        ----------
+        points: list
+            (x, y) tuples, in their current order
+        start: Tool position before the first point
+        neighbours: Closest points considered for each 2-opt move
+        max_passes: Limits 2-opt to this many looks at each point, on average
+
+        Returns
+        -------
+        list
+            Indexes of points, in visiting order
+        """
+        if len(points) < 3:
+            return TravelOptimizer.nearest_neighbour(points, start)
+        cell_size = TravelOptimizer._cell_size(points)
+        grid = TravelOptimizer._grid(points, cell_size)
+        neighbour_lists = TravelOptimizer._neighbours(points, grid, cell_size, neighbours)
+        # Nearest neighbour is usually better, but melodies are often already short in beat order
+        orders = [TravelOptimizer.two_opt(points, order, start, neighbour_lists, max_passes)
+                  for order in (TravelOptimizer.nearest_neighbour(points, start, grid, cell_size),
+                                list(range(len(points))))]
+        return min(orders, key=lambda order: TravelOptimizer.distance(points, order, start))
+
+    @staticmethod
+    def nearest_neighbour(points, start=(0, 0), grid=None, cell_size=None):
+        """ Path that always moves to the closest point not visited yet """
+        if not points:
+            return list()
+        if grid is None:
+            cell_size = TravelOptimizer._cell_size(points)
+            grid = TravelOptimizer._grid(points, cell_size)
+        # Copy the cells, visited points are removed from them
+        grid = {cell: list(members) for cell, members in grid.items()}
+        order = list()
+        x0, y0 = start
+        while len(order) < len(points):
+            cx, cy = int(x0 // cell_size), int(y0 // cell_size)
+            best = None
+            best_distance = math.inf
+            ring = 0
+            # Search rings of cells around the current position until no closer point can be found
+            while best is None or (ring - 1) * cell_size < best_distance:
+                for cell in TravelOptimizer._ring(cx, cy, ring):
+                    for i in grid.get(cell, ()):
+                        d = math.hypot(points[i][0] - x0, points[i][1] - y0)
+                        if d < best_distance:
+                            best, best_distance = i, d
+                ring += 1
+            cell = (int(points[best][0] // cell_size), int(points[best][1] // cell_size))
+            grid[cell].remove(best)
+            if not grid[cell]:
+                del grid[cell]
+            order.append(best)
+            x0, y0 = points[best]
+        return order
+
+    @staticmethod
+    def two_opt(points, order, start=(0, 0), neighbour_lists=None, max_passes=10):
+        """
+        Reverses parts of the path while that makes it shorter.
+        Only moves joining a point with one of its neighbours (closest first) are tried.
+        """
+        # Position 0 is the start of the path, which never moves
+        coords = [start] + [points[i] for i in order]
+        tour = list(range(len(coords)))
+        if neighbour_lists is None:
+            cell_size = TravelOptimizer._cell_size(points)
+            neighbour_lists = TravelOptimizer._neighbours(points, TravelOptimizer._grid(points, cell_size), cell_size)
+        # Neighbour lists refer to points, the tour to coords
+        node_of = {point: n + 1 for n, point in enumerate(order)}
+        neighbours = [[]] + [[node_of[j] for j in neighbour_lists[i]] for i in order]
+        position = list(range(len(coords)))
+        last = len(coords) - 1
+        xs = [x for x, _ in coords]
+        ys = [y for _, y in coords]
+        hypot = math.hypot
+
+        def gain(i, j):
+            # Of reversing tour[i + 1:j + 1], with i < j
+            a, b, c = tour[i], tour[i + 1], tour[j]
+            before = hypot(xs[a] - xs[b], ys[a] - ys[b])
+            after = hypot(xs[a] - xs[c], ys[a] - ys[c])
+            if j < last:
+                d = tour[j + 1]
+                before += hypot(xs[c] - xs[d], ys[c] - ys[d])
+                after += hypot(xs[b] - xs[d], ys[b] - ys[d])
+            return before - after
+
+        # Points to look at again, because one of their edges changed ("don't look bits")
+        queue = collections.deque(range(1, len(coords)))
+        queued = [False] + [True] * last
+        budget = max_passes * last
+        while queue and budget > 0:
+            a = queue.popleft()
+            queued[a] = False
+            budget -= 1
+            i = position[a]
+            pred, succ = tour[i - 1], tour[i + 1] if i < last else tour[i - 1]
+            # A move can only pay off if the new edge a-c is shorter than one of the edges of a it replaces
+            reach = max(hypot(xs[a] - xs[pred], ys[a] - ys[pred]), hypot(xs[a] - xs[succ], ys[a] - ys[succ]))
+            for c in neighbours[a]:
+                if hypot(xs[a] - xs[c], ys[a] - ys[c]) >= reach:
+                    break
+                # Both moves make a and c consecutive
+                j = position[c]
+                move = (i, j) if j > i + 1 else (j, i) if i > j + 1 else None
+                if move is None or gain(*move) <= 1e-9:
+                    continue
+                start, end = move
+                touched = [tour[start], tour[start + 1], tour[end]] + ([tour[end + 1]] if end < last else [])
+                tour[start + 1:end + 1] = tour[start + 1:end + 1][::-1]
+                for k in range(start + 1, end + 1):
+                    position[tour[k]] = k
+                for node in touched:
+                    if node and not queued[node]:
+                        queued[node] = True
+                        queue.append(node)
+                break
+        return [order[n - 1] for n in tour[1:]]
+
+    @staticmethod
+    def _cell_size(points):
+        # About two points per cell
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        area = max(max(xs) - min(xs), 1) * max(max(ys) - min(ys), 1)
+        return max(math.sqrt(2 * area / len(points)), 1e-3)
+
+    @staticmethod
+    def _grid(points, cell_size):
+        grid = dict()
+        for i, (x, y) in enumerate(points):
+            grid.setdefault((int(x // cell_size), int(y // cell_size)), []).append(i)
+        return grid
+
+    @staticmethod
+    def _ring(cx, cy, ring):
+        """ Cells at a Chebyshev distance of ring cells from (cx, cy) """
+        if ring == 0:
+            return [(cx, cy)]
+        cells = [(cx + dx, cy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+        cells += [(cx + dx, cy + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+        return cells
+
+    @staticmethod
+    def _neighbours(points, grid, cell_size, count=8):
+        """ Up to count closest points to each point, from the 3x3 cells around it """
+        lists = list()
+        for i, (x, y) in enumerate(points):
+            cx, cy = int(x // cell_size), int(y // cell_size)
+            candidates = sorted(((points[j][0] - x) ** 2 + (points[j][1] - y) ** 2, j)
+                                for dx in (-1, 0, 1) for dy in (-1, 0, 1) for j in grid.get((cx + dx, cy + dy), ())
+                                if j != i)
+            lists.append([j for _, j in candidates[:count]])
+        return lists
+
+
+class PunchJob:
+    """
+    Holes of a song, strip by strip, in punching order.
+    Coordinates are in mm from the start of each strip (x, along it) and its bottom edge (y, across it).
+    """
+
+    def __init__(self, music_box_object, notes, strip_length, song_title="NO-TITLE", song_author="NO-AUTHOR",
+                 style={}):
+        """
+
+        Parameters
+        ----------
+        music_box_object: MusicBox
+        notes: list
+            Notes as returned by Parser.render_to_box
+        strip_length: Length of each strip, including the header of the first one
+        song_title
+        song_author
+        style: Box style, as used by the PDF
+        """
+        self.music_box_object = music_box_object
+        self.song_title = song_title
+        self.song_author = song_author
+        self.strip_length = strip_length
+        self.strip_height = Strip.height(music_box_object)
+        # As Strip draws them, also for songs without holes
+        self.hole_size = 2 * music_box_object.hole_radius
+        # Holes of each strip, in beat order as Strip draws them
+        self.strips = list()
+        header = {"song_title": song_title, "song_author": song_author}
+        # The header length depends on font metrics, so it's measured by drawing an empty header strip once
+        _, first_strip_beats = Strip(music_box_object, header=header, styles=style).draw(HoleCollector(), 0,
+                                                                                         strip_length, 0, [])
+        windows = StripGenerator.strip_windows(notes, first_strip_beats,
+                                               Strip.beats_in(strip_length, music_box_object.beat_width))
+        for index, (first_beat, start, end) in enumerate(windows):
+            if index == 0:
+                strip = Strip(music_box_object, header=header, styles=style)
+            else:
+                strip = Strip(music_box_object, first_beat=first_beat, styles=style)
+            collector = HoleCollector()
+            strip.draw(collector, 0, strip_length, 0, notes[start:end])
+            self.strips.append([(x, self.strip_height / 2 - y) for x, y in collector.holes])
+            self.hole_size = collector.hole_size or self.hole_size
+        self.orders = [list(range(len(holes))) for holes in self.strips]
+
+    def optimize(self, neighbours=8, max_passes=10):
+        """ Reorders the holes of every strip to shorten the tool travel """
+        self.orders = [TravelOptimizer.optimize(holes, neighbours=neighbours, max_passes=max_passes)
+                       for holes in self.strips]
+
+    def travel(self):
+        """ (travel with the current order, travel in beat order) in mm, over all strips """
+        current = sum(TravelOptimizer.distance(holes, order) for holes, order in zip(self.strips, self.orders))
+        naive = sum(TravelOptimizer.distance(holes, range(len(holes))) for holes in self.strips)
+        return current, naive
+
+    def holes_count(self):
+        return sum(len(holes) for holes in self.strips)
+
+    def ordered_strips(self):
+        return [[holes[i] for i in order] for holes, order in zip(self.strips, self.orders)]
+
+    def write_gcode(self, f, safe_z=2, punch_z=-1, feed=300):
+        """
+        Writes G-code punching every hole with a plunge. Pauses (M0) between strips to load the next one.
+
+        Parameters
+        ----------
+        f: Text file object
+        safe_z: Height to travel at
+        punch_z: Depth of the plunge
+        feed: Plunge speed, in mm/min
+        """
+        f.write(f"(Music box strips: {self.song_title} - {self.song_author})\n")
+        f.write(f"(Box: {self.music_box_object.description}. Hole diameter {self.hole_size}mm)\n")
+        f.write(f"G21\nG90\nG0 Z{safe_z:.3f}\n")
+        for index, holes in enumerate(self.ordered_strips()):
+            f.write(f"(Strip {index + 1}/{len(self.strips)}: {len(holes)} holes)\n")
+            if index > 0:
+                f.write("G0 X0 Y0\nM0 (Load next strip)\n")
+            for x, y in holes:
+                f.write(f"G0 X{x:.3f} Y{y:.3f}\nG1 Z{punch_z:.3f} F{feed}\nG0 Z{safe_z:.3f}\n")
+        f.write("G0 X0 Y0\nM2\n")
+
+    def write_dxf(self, f, strip_gap=5):
+        """
+        Writes an ASCII DXF (R12) with the outline of every strip in layer OUTLINE and its holes in layer
+        STRIP_<n>, in punching order. Strips are placed one above the other.
+
+        Parameters
+        ----------
+        f: Text file object
+        strip_gap: Space between two strips in the drawing
+        """
+        def entity(kind, layer, *groups):
+            f.write(f"0\n{kind}\n8\n{layer}\n")
+            for code, value in groups:
+                f.write(f"{code}\n{value:.3f}\n")
+
+        f.write("0\nSECTION\n2\nENTITIES\n")
+        for index, holes in enumerate(self.ordered_strips()):
+            y0 = index * (self.strip_height + strip_gap)
+            corners = [(0, y0), (self.strip_length, y0), (self.strip_length, y0 + self.strip_height),
+                       (0, y0 + self.strip_height)]
+            for (x1, y1), (x2, y2) in zip(corners, corners[1:] + corners[:1]):
+                entity("LINE", "OUTLINE", (10, x1), (20, y1), (30, 0), (11, x2), (21, y2), (31, 0))
+            for x, y in holes:
+                entity("CIRCLE", f"STRIP_{index + 1}", (10, x), (20, y0 + y), (30, 0), (40, self.hole_size / 2))
+        f.write("0\nENDSEC\n0\nEOF\n")
@@ -0,0 +1,161 @@
+"""
+Registry of the music boxes defined in musicboxes.yml.
+
+Definitions are validated and compiled into MusicBox instances once, then kept in a pickle cache. The cache is
+reused while the definitions file keeps its mtime and size, or at least its content hash, so yaml is only
+imported and parsed when the file actually changes.
+"""
+import hashlib
+import os
+import pickle
+
+from .box import MusicBox
+
+DEFAULT_SETTINGS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "musicboxes.yml")
+# Bump when MusicBox or the compiled format changes, so old caches are discarded
+REGISTRY_VERSION = 3
+
+REQUIRED_KEYS = {
+    "meta": ["manufacturer", "description"],
+    "dimensions": ["pin_width", "start_margin", "end_margin", "hole_radius", "beat_width"],
+    "music_props": ["notes", "clef"],
+}
+
+
+class BoxRegistry:
+    def __init__(self, boxes, version=None, settings_file=None):
+        """
+
+        Parameters
+        ----------
+        boxes: list
+            MusicBox instances, in definition order
+        version: Version of the definitions file
+        settings_file: Path the definitions were read from
+        """
+        self.boxes = list(boxes)
+        self.version = version
+        self.settings_file = settings_file
+        self._by_name = {box.name.lower(): box for box in self.boxes}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __iter__(self):
+        return iter(self.boxes)
+
+    def by_index(self, index):
+        """ Box at a 1-based index, as shown to users """
+        if not 1 <= index <= len(self.boxes):
+            raise KeyError(f"Box index {index} out of range ({len(self.boxes)} boxes were found in definition)")
+        return self.boxes[index - 1]
+
+    def by_name(self, name):
+        try:
+            return self._by_name[name.strip().lower()]
+        except KeyError:
+            raise KeyError(f"No box named '{name}'. Available: {', '.join(box.name for box in self.boxes)}")
+
+    def find(self, key):
+        """ Box by 1-based index (int or digits) or by name """
+        if isinstance(key, int) or key.strip().isdigit():
+            return self.by_index(int(key))
+        return self.by_name(key)
+
+    def index_of(self, music_box):
+        """ 1-based index of a box of this registry """
+        return self.boxes.index(music_box) + 1
+
+    @staticmethod
+    def compile(settings_dict, settings_file=None):
+        """ Validates parsed definitions and builds the registry. Raises ValueError on bad definitions """
+        boxes = list()
+        for index, box_def in enumerate(settings_dict.get("boxes") or []):
+            for section, keys in REQUIRED_KEYS.items():
+                missing = [key for key in keys if key not in (box_def.get(section) or {})]
+                if missing:
+                    raise ValueError(f"Box {index + 1}: missing {section} {', '.join(missing)}")
+            try:
+                box = MusicBox(**box_def)
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"Box {index + 1}: invalid notes ({e})")
+            if box.pitches != sorted(box.pitches) or len(set(box.pitches)) != len(box.pitches):
+                raise ValueError(f"Box {index + 1}: notes must go from low to high without repetitions")
+            boxes.append(box)
+        if not boxes:
+            raise ValueError("No boxes were found in definition")
+        names = [box.name.lower() for box in boxes]
+        duplicated = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicated:
+            raise ValueError(f"Repeated box names: {', '.join(duplicated)}")
+        return BoxRegistry(boxes, version=settings_dict.get("version"), settings_file=settings_file)
+
+    @staticmethod
+    def load(settings_file=DEFAULT_SETTINGS_FILE, cache_dir=None, use_cache=True):
+        """
+        Loads the registry, from the cache when it's still valid.
+
+        Parameters
+        ----------
+        settings_file: Definitions file. Relative paths are resolved from the repository, not the CWD
+        cache_dir: Where to keep the compiled registry. Defaults to ~/.cache/musicbox (or $XDG_CACHE_HOME)
+        use_cache: Set to False to always parse the definitions file
+        """
+        if not os.path.isabs(settings_file):
+            settings_file = os.path.join(os.path.dirname(DEFAULT_SETTINGS_FILE), settings_file)
+        if not os.path.isfile(settings_file) or not settings_file.strip().lower().endswith(".yml"):
+            raise IOError("No valid music boxes config file could be found!!")
+
+        stat = os.stat(settings_file)
+        cache_file = BoxRegistry._cache_file(settings_file, cache_dir) if use_cache else None
+        cached = BoxRegistry._read_cache(cache_file) if cache_file else None
+        if cached is not None and (cached["mtime"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+            return cached["registry"]
+
+        with open(settings_file, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if cached is not None and cached["hash"] == digest:
+            # Touched but unchanged
+            registry = cached["registry"]
+        else:
+            import yaml
+            registry = BoxRegistry.compile(yaml.safe_load(content), settings_file)
+        if cache_file:
+            BoxRegistry._write_cache(cache_file, {"version": REGISTRY_VERSION,
+                                                  "mtime": stat.st_mtime_ns,
+                                                  "size": stat.st_size,
+                                                  "hash": digest,
+                                                  "registry": registry})
+        return registry
+
+    @staticmethod
+    def _cache_file(settings_file, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))),
+                                     "musicbox")
+        key = hashlib.sha1(os.path.abspath(settings_file).encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, f"boxes-{key}.pickle")
+
+    @staticmethod
+    def _read_cache(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, AttributeError, ImportError):
+            return None
+        if not isinstance(cached, dict) or cached.get("version") != REGISTRY_VERSION:
+            return None
+        return cached
+
+    @staticmethod
+    def _write_cache(cache_file, cached):
+        # Write and rename, so concurrent readers never see half a file. A read-only cache is not an error
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
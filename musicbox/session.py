@@ -0,0 +1,110 @@
+"""
+Render sessions: any number of songs rendered with the same box and paper, set up once.
+
+A Renderer is an FPDF document and generates a single song. Most of what it loads doesn't depend on the song, though:
+the core font metrics and the image of the strip header (parsing res/triangle_tiny.png takes longer than drawing a
+short song). A session loads them once, on a scratch document, and gives every new document its own copy.
+
+    session = RenderSession(music_box, paper_size=(215.9, 279.4), style=music_box.style)
+    for song in songs:
+        pdf, diagnostics = session.render(song, None, song_title="Song", song_author="Author")
+"""
+import threading
+
+from .pdf import DEFAULT_COMPRESSION_LEVEL, Renderer, Strip
+
+# Sessions kept per thread by thread_session, the least recently used are dropped
+MAX_THREAD_SESSIONS = 16
+_local = threading.local()
+
+
+class RenderSession:
+    """
+    Makes Renderer documents that share the fonts and images loaded by the session.
+    A session isn't thread safe: it belongs to the first thread that uses it, and raises RuntimeError in any other.
+    Use one session per thread.
+    """
+
+    def __init__(self, music_box_object, paper_size=(279.4, 215.9), strip_separation=0, style={}, orientation="l",
+                 share_strips=False, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        """
+
+        Parameters
+        ----------
+        music_box_object: MusicBox
+        paper_size: Size of the paper where the files will be printed to
+        strip_separation: Separation between strips in the paper
+        style
+        orientation: "l" for landscape, "p" for portrait
+        share_strips: See Renderer
+        compression_level: See Renderer
+        """
+        self.music_box_object = music_box_object
+        self.settings = {"paper_size": paper_size,
+                         "strip_separation": strip_separation,
+                         "style": style,
+                         "orientation": orientation,
+                         "share_strips": share_strips,
+                         "compression_level": compression_level}
+        # Drawing a header strip loads every font and image a document uses, in the same order
+        scratch = Renderer(music_box_object, **self.settings)
+        scratch.add_page()
+        Strip(music_box_object, header={"song_title": "NO-TITLE", "song_author": "NO-AUTHOR"},
+              styles=scratch.styles).draw(pdf=scratch, x0=scratch.l_margin, x1=scratch.w - scratch.r_margin,
+                                          y=scratch.t_margin + Strip.height(music_box_object) / 2, notes=[])
+        self.fonts = scratch.fonts
+        self.images = scratch.images
+        # Images with transparency need PDF 1.4
+        self.pdf_version = scratch.pdf_version
+        # Songs rendered so far
+        self.renders = 0
+        self._thread = None
+
+    def document(self):
+        """ A new Renderer with the fonts and images of the session, to generate one song """
+        thread = threading.get_ident()
+        if self._thread is None:
+            self._thread = thread
+        elif self._thread != thread:
+            raise RuntimeError("A RenderSession can only be used from one thread")
+        doc = Renderer(self.music_box_object, **self.settings)
+        # Output numbers fonts and images in place and drops the image data, so each document gets its own copy
+        doc.fonts = {key: dict(font) for key, font in self.fonts.items()}
+        doc.images = {name: dict(image) for name, image in self.images.items()}
+        doc.pdf_version = self.pdf_version
+        return doc
+
+    def render(self, midi_file, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR", parsed_notes=None,
+               columns=None):
+        """
+        Renders a song on a new document, like Renderer.generate.
+
+        Returns
+        -------
+        tuple
+            (pdf bytes or None, like Renderer.generate, Diagnostics of the song)
+        """
+        doc = self.document()
+        pdf = doc.generate(midi_file, output_file, song_title=song_title, song_author=song_author,
+                           parsed_notes=parsed_notes, columns=columns)
+        self.renders += 1
+        return pdf, doc.diagnostics
+
+
+def thread_session(music_box_object, paper_size=(279.4, 215.9), orientation="l"):
+    """
+    Session of the calling thread for a box and paper, with the box style. Made on first use, so workers that render
+    many songs only set up each box and paper once
+    """
+    sessions = _local.__dict__.setdefault("sessions", dict())
+    # The box itself is part of the key, so it's kept alive and its id can't be reused by another box
+    key = (music_box_object, tuple(paper_size), orientation)
+    session = sessions.pop(key, None)
+    if session is None:
+        session = RenderSession(music_box_object, paper_size=paper_size, style=music_box_object.style,
+                                orientation=orientation)
+        if len(sessions) >= MAX_THREAD_SESSIONS:
+            sessions.pop(next(iter(sessions)))
+    # Most recently used last
+    sessions[key] = session
+    return session
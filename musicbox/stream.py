@@ -0,0 +1,202 @@
+"""
+Bounded memory rendering for giant songs.
+
+Notes are pulled from an iterator (see Parser.iter_notes) only as far as the strip being drawn needs, and every
+page is written to the output as soon as the next one is done, so memory doesn't grow with the song length. Each page
+is compressed on a background thread while the next one is drawn.
+"""
+import io
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .midi import Parser, TICKS_PER_BEAT
+from .pdf import DEFAULT_COMPRESSION_LEVEL, Renderer, Strip, StripGenerator
+
+
+class StreamingRenderer(Renderer):
+    """
+    Renderer that writes pages as they are completed.
+    Pages are written with the same objects and in the same order FPDF would write them at the end.
+    Page number aliases are not replaced.
+    """
+
+    def __init__(self, music_box_object, paper_size=(279.4, 215.9), strip_separation=0, style={}, orientation="l",
+                 share_strips=False, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        super().__init__(music_box_object, paper_size=paper_size, strip_separation=strip_separation, style=style,
+                         orientation=orientation, share_strips=share_strips, compression_level=compression_level)
+        self._output = None
+        self._compressor = None
+        # Content of the last completed page, or the Future compressing it, until it's written
+        self._pending = None
+        # Bytes already written to the output. FPDF offsets only count what's in the buffer
+        self._written = 0
+
+    def generate(self, midi_file, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR", parsed_notes=None):
+        """
+
+        Parameters
+        ----------
+        midi_file: Path, seekable binary file object or bytes of the midi file. Read incrementally
+        output_file: Path or binary file object where the pdf will be written, page by page.
+            If None, the pdf bytes are returned
+        song_title
+        song_author
+        parsed_notes: Any iterable of notes sorted by beat, like Parser.iter_notes. If given, midi_file is not read
+        """
+        notes = parsed_notes if parsed_notes is not None else Parser.iter_notes(midi_file)
+        output = io.BytesIO() if output_file is None else output_file
+        for _ in self.iter_strips(notes, output, song_title, song_author):
+            pass
+        if output_file is None:
+            return output.getvalue()
+
+    def iter_strips(self, notes, output_file, song_title="NO-TITLE", song_author="NO-AUTHOR"):
+        """
+        Draws the strips one at a time, yielding the page index of each one after drawing it.
+        The document is closed once the notes run out. Closing the generator early leaves the output incomplete.
+
+        Parameters
+        ----------
+        notes: Any iterable of notes sorted by beat
+        output_file: Path or binary file object where the pdf will be written, page by page
+        song_title
+        song_author
+        """
+        if self.generated:
+            raise RuntimeError("Document was already generated!")
+        self.set_title("{} - {} ({}x{})".format(song_title, song_author, self.w, self.h))
+        notes = self.diagnostics.iter_checked(notes, self.music_box_object)
+
+        self._output = open(output_file, "wb") if isinstance(output_file, str) else output_file
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        try:
+            self.add_page()
+            strip_generator = StripGenerator(music_box_object=self.music_box_object,
+                                             song_title=song_title,
+                                             song_author=song_author,
+                                             styles=self.styles,
+                                             diagnostics=self.diagnostics)
+            positions = strip_generator.strip_positions(self, self.strip_separation)
+            x0, x1 = self.l_margin, self.w - self.r_margin
+            # No strip takes more beats than one without header
+            max_strip_beats = Strip.beats_in(x1 - x0, self.music_box_object.beat_width)
+            # Notes read but not drawn yet
+            pending = list()
+            exhausted = False
+            current_page = 0
+            drawn_beats = 0
+            while True:
+                # Read until every note of the next strip is pending
+                while not exhausted and (not pending or pending[-1]["tick"] <= (drawn_beats + max_strip_beats) * TICKS_PER_BEAT):
+                    note = next(notes, None)
+                    if note is None:
+                        exhausted = True
+                    else:
+                        pending.append(note)
+                if not pending:
+                    break
+                new_strip = strip_generator.new_strip(drawn_beats)
+                page, current_y = next(positions)
+                if page != current_page:
+                    self.add_page()
+                    current_page = page
+                pending, total_strip_beats = new_strip.draw(pdf=self, x0=x0, x1=x1, y=current_y, notes=pending)
+                drawn_beats += total_strip_beats
+                yield current_page
+
+            self.generated = True
+            self.diagnostics.pages = self.page
+            self.close()
+        finally:
+            self._compressor.shutdown()
+            if self._output is not output_file:
+                self._output.close()
+
+    def _endpage(self):
+        super()._endpage()
+        content = self.pages[self.page].encode("latin1")
+        self.pages[self.page] = ""
+        if self.compress:
+            content = self._compressor.submit(zlib.compress, content, self.compression_level)
+        self._putpending()
+        self._pending = content
+
+    def _putpending(self):
+        """ Writes the previous page, waiting for its compression """
+        if self._pending is not None:
+            content = self._pending
+            self._pending = None
+            self._putpage(content.result() if isinstance(content, Future) else content)
+
+    def _putpage(self, content):
+        """ Writes the next page, given its content stream. Same objects as FPDF._putpages """
+        if self._written == 0:
+            self._putheader()
+        self._newobj()
+        self._out("<</Type /Page")
+        self._out("/Parent 1 0 R")
+        self._out("/Resources 2 0 R")
+        if self.pdf_version > "1.3":
+            self._out("/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>")
+        self._out("/Contents " + str(self.n + 1) + " 0 R>>")
+        self._out("endobj")
+        self._newobj()
+        self._out("<<" + ("/Filter /FlateDecode " if self.compress else "") + "/Length " + str(len(content)) + ">>")
+        self._putstream(content)
+        self._out("endobj")
+        self._flush()
+
+    def _newobj(self):
+        self.n += 1
+        self.offsets[self.n] = self._written + self._buffer_size
+        self._out(str(self.n) + " 0 obj")
+
+    def _flush(self):
+        data = self.buffer.encode("latin1")
+        self._output.write(data)
+        self._written += len(data)
+        self.buffer = ""
+
+    def _enddoc(self):
+        # Same as FPDF._enddoc, but every page except the last was already written
+        self._putpending()
+        if self.def_orientation == "P":
+            w_pt, h_pt = self.fw_pt, self.fh_pt
+        else:
+            w_pt, h_pt = self.fh_pt, self.fw_pt
+        self.offsets[1] = self._written + self._buffer_size
+        self._out("1 0 obj")
+        self._out("<</Type /Pages")
+        self._out("/Kids [" + "".join(str(3 + 2 * i) + " 0 R " for i in range(self.page)) + "]")
+        self._out("/Count " + str(self.page))
+        self._out("/MediaBox [0 0 %.2f %.2f]" % (w_pt, h_pt))
+        self._out(">>")
+        self._out("endobj")
+        self._putresources()
+        # FPDF takes the offset of the resources dictionary from the buffer only
+        self.offsets[2] += self._written
+        self._newobj()
+        self._out("<<")
+        self._putinfo()
+        self._out(">>")
+        self._out("endobj")
+        self._newobj()
+        self._out("<<")
+        self._putcatalog()
+        self._out(">>")
+        self._out("endobj")
+        xref = self._written + self._buffer_size
+        self._out("xref")
+        self._out("0 " + str(self.n + 1))
+        self._out("0000000000 65535 f ")
+        for i in range(1, self.n + 1):
+            self._out("%010d 00000 n " % self.offsets[i])
+        self._out("trailer")
+        self._out("<<")
+        self._puttrailer()
+        self._out(">>")
+        self._out("startxref")
+        self._out(xref)
+        self._out("%%EOF")
+        self.state = 3
+        self._flush()
@@ -0,0 +1,255 @@
+"""
+SVG previews of paper strips.
+
+Strips are drawn by the same Strip code as the PDF: SvgDocument implements the few FPDF drawing methods Strip
+uses and records them as SVG elements, so both outputs share the geometry.
+"""
+import base64
+import bisect
+import math
+
+from .midi import TICKS_PER_BEAT
+from .pdf import Renderer, Strip, StripGenerator
+
+# Average advance of a character in em, for fonts other than courier (only used to center text)
+DEFAULT_CHAR_WIDTH = 0.5
+FONT_FAMILIES = {"courier": "Courier, monospace", "arial": "Arial, Helvetica, sans-serif"}
+
+_images = {}
+
+
+def _image_uri(path):
+    """ PNG file as a data URI, read once per process """
+    if path not in _images:
+        with open(path, "rb") as f:
+            _images[path] = "data:image/png;base64," + base64.b64encode(f.read()).decode()
+    return _images[path]
+
+
+def _num(value):
+    return f"{value:.3f}".rstrip("0").rstrip(".")
+
+
+class SvgDocument:
+    """
+    Pages drawn with the subset of the FPDF API used by Strip.
+    All units in mm except for fonts, which are in points, like in Renderer.
+    """
+
+    def __init__(self, width, height, margins=Renderer.MARGINS, bottom_margin=Renderer.BOTTOM_MARGIN):
+        """
+
+        Parameters
+        ----------
+        width: Page width
+        height: Page height
+        margins: left, top, right
+        bottom_margin
+        """
+        self.w = width
+        self.h = height
+        self.l_margin, self.t_margin, self.r_margin = margins
+        self.b_margin = bottom_margin
+        self.k = 72 / 25.4
+        self.pages = list()
+        self.page = 0
+        self.angle = 0
+        self.line_width = 0.567 / self.k
+        self.draw_color = "#000"
+        self.fill_color = "#000"
+        self.font_family = "courier"
+        self.font_style = ""
+        self.font_size_pt = 12
+        self.font_size = self.font_size_pt / self.k
+        self._dash = None
+
+    def add_page(self):
+        self.pages.append(list())
+        self.page += 1
+        # FPDF drops the rotation with the page
+        self.angle = 0
+
+    def to_svg(self, page=1):
+        """ SVG markup of a page, 1-based like FPDF pages """
+        elements = self.pages[page - 1]
+        if self.angle != 0 and page == self.page:
+            elements = elements + ["</g>"]
+        return ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                f'width="{_num(self.w)}mm" height="{_num(self.h)}mm" viewBox="0 0 {_num(self.w)} {_num(self.h)}">'
+                f'<rect width="100%" height="100%" fill="#fff"/>{"".join(elements)}</svg>')
+
+    # Drawing state
+
+    def set_line_width(self, width):
+        self.line_width = width
+
+    def set_draw_color(self, r, g=-1, b=-1):
+        self.draw_color = self._color(r, g, b)
+
+    def set_fill_color(self, r, g=-1, b=-1):
+        self.fill_color = self._color(r, g, b)
+
+    def set_font(self, family, style="", size=0):
+        self.font_family = family.lower()
+        self.font_style = style.upper()
+        if size:
+            self.set_font_size(size)
+
+    def set_font_size(self, size):
+        self.font_size_pt = size
+        self.font_size = size / self.k
+
+    def get_string_width(self, s):
+        em = 0.6 if self.font_family == "courier" else DEFAULT_CHAR_WIDTH
+        return len(s) * em * self.font_size
+
+    def rotate(self, angle, x=None, y=None):
+        """ Counterclockwise, around (x, y). Lasts until the next rotate call """
+        if self.angle != 0:
+            self._out("</g>")
+        self.angle = angle
+        if angle != 0:
+            self._out(f'<g transform="rotate({_num(-angle)} {_num(x)} {_num(y)})">')
+
+    # Drawing
+
+    def line(self, x1, y1, x2, y2):
+        self._out(f'<line x1="{_num(x1)}" y1="{_num(y1)}" x2="{_num(x2)}" y2="{_num(y2)}"{self._stroke()}/>')
+
+    def dashed_line(self, x1, y1, x2, y2, dash_length=1, space_length=1):
+        self._dash = (dash_length, space_length)
+        self.line(x1, y1, x2, y2)
+        self._dash = None
+
+    def ellipse(self, x, y, w, h, style=""):
+        """ Ellipse inside the given box. Same styles as FPDF: "F" fills, "FD" or "DF" fill and draw, else draw """
+        fill = self.fill_color if style in ("F", "FD", "DF") else "none"
+        stroke = self._stroke() if style != "F" else ""
+        self._out(f'<ellipse cx="{_num(x + w / 2)}" cy="{_num(y + h / 2)}" rx="{_num(w / 2)}" ry="{_num(h / 2)}" '
+                  f'fill="{fill}"{stroke}/>')
+
+    def text(self, x, y, txt=""):
+        """ Text with its baseline starting at (x, y) """
+        weight = ' font-weight="bold"' if "B" in self.font_style else ""
+        txt = txt.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        self._out(f'<text x="{_num(x)}" y="{_num(y)}" font-family="{FONT_FAMILIES.get(self.font_family, "sans-serif")}" '
+                  f'font-size="{_num(self.font_size)}"{weight}>{txt}</text>')
+
+    def image(self, name, x=None, y=None, w=0, h=0, type="", link=""):
+        self._out(f'<image x="{_num(x)}" y="{_num(y)}" width="{_num(w)}" height="{_num(h)}" '
+                  f'preserveAspectRatio="none" xlink:href="{_image_uri(name)}"/>')
+
+    def _stroke(self):
+        dash = f' stroke-dasharray="{_num(self._dash[0])} {_num(self._dash[1])}"' if self._dash else ""
+        return f' stroke="{self.draw_color}" stroke-width="{_num(self.line_width)}"{dash}'
+
+    def _out(self, element):
+        self.pages[-1].append(element)
+
+    @staticmethod
+    def _color(r, g=-1, b=-1):
+        if g == -1:
+            g = b = r
+        return f"#{int(r):02x}{int(g):02x}{int(b):02x}"
+
+
+class SvgPreview:
+    """
+    Draws parts of a song laid out like Renderer.generate: a page, a strip or any window of beats.
+    Only what's asked for gets drawn, so previews stay fast for long songs.
+    """
+
+    def __init__(self, music_box_object, song_title="NO-TITLE", song_author="NO-AUTHOR", paper_size=(279.4, 215.9),
+                 strip_separation=0, style={}, orientation="l"):
+        self.music_box_object = music_box_object
+        self.song_title = song_title
+        self.song_author = song_author
+        self.strip_separation = strip_separation
+        self.styles = style
+        # Same orientation rules as FPDF
+        width, height = paper_size
+        self.paper_size = (height, width) if orientation.lower() in ("l", "landscape") else (width, height)
+        self.strip_generator = StripGenerator(music_box_object, song_title, song_author, style)
+        self.strip_height = Strip.height(music_box_object)
+        page = self.new_document()
+        self.x0 = page.l_margin
+        self.x1 = page.w - page.r_margin
+        # The header length depends on font metrics, so it's measured by drawing an empty header strip once
+        _, self.first_strip_beats = self._header_strip().draw(page, self.x0, self.x1, self.strip_height / 2, [])
+        self.strip_beats = Strip.beats_in(self.x1 - self.x0, music_box_object.beat_width)
+
+    def new_document(self):
+        """ Empty document with a first page, the size of the paper """
+        doc = SvgDocument(*self.paper_size)
+        doc.add_page()
+        return doc
+
+    def strip_windows(self, notes):
+        """ (first beat, start index, end index) of the notes of each strip """
+        return StripGenerator.strip_windows(notes, self.first_strip_beats, self.strip_beats)
+
+    def pages_count(self, notes):
+        positions = self.strip_generator.strip_positions(self.new_document(), self.strip_separation)
+        pages = 0
+        for _ in self.strip_windows(notes):
+            pages = next(positions)[0] + 1
+        return pages
+
+    def render_page(self, notes, page=1):
+        """ SVG of a page (starting at 1), with only the strips that go in it """
+        doc = self.new_document()
+        positions = self.strip_generator.strip_positions(doc, self.strip_separation)
+        for index, (first_beat, start, end) in enumerate(self.strip_windows(notes)):
+            strip_page, y = next(positions)
+            if strip_page + 1 > page:
+                break
+            if strip_page + 1 == page:
+                self._strip(index, first_beat).draw(doc, self.x0, self.x1, y, notes[start:end])
+        return doc.to_svg()
+
+    def render_pages(self, notes):
+        """ SVG of every page """
+        doc = self.new_document()
+        strip_generator = StripGenerator(self.music_box_object, self.song_title, self.song_author, self.styles)
+        strip_generator.draw_strips(doc, list(notes), self.strip_separation)
+        return [doc.to_svg(page) for page in range(1, doc.page + 1)]
+
+    def render_strip(self, notes, index):
+        """ SVG of a single strip (starting at 0), as wide as the page """
+        windows = self.strip_windows(notes)
+        if not 0 <= index < len(windows):
+            raise IndexError(f"Strip {index} out of range ({len(windows)} strips)")
+        first_beat, start, end = windows[index]
+        doc = self._strip_document(self.paper_size[0])
+        self._strip(index, first_beat).draw(doc, self.x0, self.x1, doc.h / 2, notes[start:end])
+        return doc.to_svg()
+
+    def render_window(self, notes, first_beat, last_beat):
+        """
+        SVG of a strip covering only the beats in [first_beat, last_beat]. Like Strip.draw, notes right on either end
+        are drawn
+        """
+        ticks = [note["tick"] for note in notes]
+        start = bisect.bisect_left(ticks, first_beat * TICKS_PER_BEAT)
+        end = bisect.bisect_right(ticks, last_beat * TICKS_PER_BEAT)
+        length = (last_beat - first_beat) * self.music_box_object.beat_width
+        doc = self._strip_document(self.x0 + length + (self.paper_size[0] - self.x1))
+        strip = Strip(self.music_box_object, first_beat=first_beat, styles=self.styles)
+        strip.draw(doc, self.x0, self.x0 + length, doc.h / 2, notes[start:end])
+        return doc.to_svg()
+
+    def _strip_document(self, width):
+        # One mm above and below the strip
+        doc = SvgDocument(width, math.ceil(self.strip_height) + 2)
+        doc.add_page()
+        return doc
+
+    def _header_strip(self):
+        return Strip(self.music_box_object,
+                     header={"song_title": self.song_title, "song_author": self.song_author},
+                     styles=self.styles)
+
+    def _strip(self, index, first_beat):
+        if index == 0:
+            return self._header_strip()
+        return Strip(self.music_box_object, first_beat=first_beat, styles=self.styles)
@@ -0,0 +1,152 @@
+"""Watch mode: keeps a song laid out in memory and only redraws the strips whose notes changed."""
+import bisect
+import copy
+import os
+import time
+
+from .midi import TICKS_PER_BEAT
+from .pdf import DEFAULT_COMPRESSION_LEVEL, Renderer, Strip
+
+
+class IncrementalRenderer:
+    """
+    Renders a song strip by strip, keeping the PDF content of each strip.
+
+    Strip windows and positions only depend on the paper and the box, so strip i always covers the same beats at
+    the same place. When the notes change, only the strips whose notes differ are drawn again; the rest of the
+    document is reassembled from the stored content.
+    """
+
+    def __init__(self, music_box_object, song_title="NO-TITLE", song_author="NO-AUTHOR", paper_size=(279.4, 215.9),
+                 strip_separation=0, style={}, orientation="l", compression_level=DEFAULT_COMPRESSION_LEVEL):
+        self.music_box_object = music_box_object
+        self.song_title = song_title
+        self.song_author = song_author
+        self.settings = {"paper_size": paper_size,
+                         "strip_separation": strip_separation,
+                         "style": style,
+                         "orientation": orientation,
+                         "compression_level": compression_level}
+        # Strips are drawn on a scratch document, which also owns the fonts and images they use
+        self.scratch = Renderer(music_box_object, **self.settings)
+        self.scratch.add_page()
+        self.x0 = self.scratch.l_margin
+        self.x1 = self.scratch.w - self.scratch.r_margin
+        self._positions = list()
+        # The header length depends on font metrics, so it's measured by drawing an empty header strip once
+        _, self.first_strip_beats = self._draw(0, [])
+        self.strip_beats = Strip.beats_in(self.x1 - self.x0, music_box_object.beat_width)
+        # Per strip: {"key": notes drawn, "content": PDF operators, "page": page index}
+        self.strips = list()
+
+    def update(self, notes):
+        """
+        Lays out the notes, drawing only strips that changed since the last update.
+
+        Parameters
+        ----------
+        notes: list
+            Notes as returned by Parser.render_to_box, sorted by beat
+
+        Returns
+        -------
+        int
+            Amount of strips that were drawn again
+        """
+        ticks = [note["tick"] for note in notes]
+        strips = list()
+        redrawn = 0
+        start_beat = 0
+        start_index = 0
+        while start_index < len(notes):
+            index = len(strips)
+            strip_beats = self.first_strip_beats if index == 0 else self.strip_beats
+            # Notes right on the end of a strip are drawn in that strip
+            end_index = bisect.bisect_right(ticks, (start_beat + strip_beats) * TICKS_PER_BEAT)
+            strip_notes = notes[start_index:end_index]
+            key = tuple((note["tick"], note["raw_pitch"]) for note in strip_notes)
+            if index < len(self.strips) and self.strips[index]["key"] == key:
+                strips.append(self.strips[index])
+            else:
+                content, _ = self._draw(index, strip_notes, start_beat)
+                strips.append({"key": key, "content": content, "page": self._position(index)[0]})
+                redrawn += 1
+            start_beat += strip_beats
+            start_index = end_index
+        self.strips = strips
+        return redrawn
+
+    def write(self, output_file=None):
+        """ Writes the current document to a path or a binary file object. Without output_file, returns its bytes """
+        doc = Renderer(self.music_box_object, **self.settings)
+        doc.set_title("{} - {} ({}x{})".format(self.song_title, self.song_author, doc.w, doc.h))
+        # Content refers to fonts and images by the index they got in the scratch document.
+        # Output numbers them in place, so each document gets its own copy
+        doc.fonts = copy.deepcopy(self.scratch.fonts)
+        doc.images = copy.deepcopy(self.scratch.images)
+        doc.pdf_version = self.scratch.pdf_version
+        doc.add_page()
+        for strip in self.strips:
+            while doc.page <= strip["page"]:
+                doc.add_page()
+            doc.pages[doc.page] += strip["content"]
+        doc.generated = True
+        return doc.write_output(output_file)
+
+    def _position(self, index):
+        """ (page index, y) of a strip, following the same steps as Renderer.generate """
+        pdf = self.scratch
+        height = Strip.height(self.music_box_object)
+        if self._positions:
+            page, current_y = self._positions[-1]
+        else:
+            page, current_y = 0, - height / 2 - pdf.strip_separation + pdf.t_margin
+        while len(self._positions) <= index:
+            current_y += height + pdf.strip_separation
+            if current_y + height / 2 > pdf.h - pdf.b_margin:
+                page += 1
+                current_y = height / 2 + pdf.t_margin
+            self._positions.append((page, current_y))
+        return self._positions[index]
+
+    def _draw(self, index, notes, first_beat=0):
+        """ Draws a strip on the scratch page and returns its content and its length in beats """
+        pdf = self.scratch
+        if index == 0:
+            strip = Strip(self.music_box_object,
+                          header={"song_title": self.song_title, "song_author": self.song_author},
+                          styles=pdf.styles)
+        else:
+            strip = Strip(self.music_box_object, first_beat=first_beat, styles=pdf.styles)
+        start = len(pdf.pages[pdf.page])
+        _, total_strip_beats = strip.draw(pdf=pdf, x0=self.x0, x1=self.x1, y=self._position(index)[1],
+                                          notes=list(notes))
+        content = pdf.pages[pdf.page][start:]
+        pdf.pages[pdf.page] = pdf.pages[pdf.page][:start]
+        return content, total_strip_beats
+
+
+def watch_file(path, callback, interval=0.2):
+    """
+    Calls callback() every time the file changes, until interrupted.
+    Polls the file, so it doesn't need any platform specific notification service.
+    """
+    def _signature():
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    last = _signature()
+    while True:
+        time.sleep(interval)
+        current = _signature()
+        if current is None or current == last:
+            continue
+        # Wait for the writer to finish
+        time.sleep(interval)
+        if _signature() != current:
+            continue
+        last = current
+        callback()
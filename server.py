@@ -0,0 +1,254 @@
+# coding=utf-8
+
+"""
+Local HTTP service that renders paper strips on a pool of warm worker processes.
+
+    POST /render?title=...&author=...[&box=2|name|auto&paper_size=215.9x279.4&transpose=0&auto_transpose=1
+                 &transpose_range=12&fold_octaves=1&columns=2&format=pdf|svg&page=1]
+        Body: the MIDI file. Responds with the PDF, or with an SVG preview of one page. The X-Render-Diagnostics
+        header has the notes that couldn't be drawn, as JSON (see musicbox.diagnostics.Diagnostics.to_dict).
+    GET /boxes
+        Lists the available music boxes.
+"""
+import argparse
+import functools
+import io
+import json
+import os
+import shutil
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from main import load_music_boxes, fit_song
+from musicbox.midi import Parser
+
+CHUNK_SIZE = 64 * 1024
+MAX_MIDI_SIZE = 16 * 1024 * 1024
+
+# Per worker process state, filled once by _init_worker
+_worker = {}
+
+
+def _init_worker(music_boxes, use_cache=False):
+    """ Loads everything a render needs, so requests only pay for the render itself """
+    from fpdf import FPDF
+    from musicbox.session import thread_session
+    from musicbox.svg import SvgPreview
+    from musicbox.midi import Parser
+    from musicbox.diagnostics import Diagnostics
+    from musicbox.cache import NoteCache
+
+    # Core font metrics are loaded on first use
+    warm_up = FPDF()
+    warm_up.set_font("courier", "B", 10)
+    warm_up.set_font("Arial", "B", 10)
+
+    _worker["music_boxes"] = music_boxes
+    # One render session per box and paper keeps their fonts and images loaded between requests
+    _worker["session"] = thread_session
+    _worker["preview"] = SvgPreview
+    _worker["diagnostics"] = Diagnostics
+    # With the cache, the same song rendered for several boxes or papers is parsed once. Requests already run on every
+    # core, so tracks are decoded in the worker itself
+    if use_cache:
+        _worker["read_notes"] = functools.partial(NoteCache().render_to_box, workers=1)
+    else:
+        _worker["read_notes"] = functools.partial(Parser.render_tracks, workers=1)
+
+
+def check_midi(midi_bytes):
+    """
+    Checks the structure of an uploaded MIDI file: its header, and track chunks that are all inside the body.
+    Raises ValueError with a readable message. Events aren't decoded here
+    """
+    try:
+        _, chunks = Parser.track_chunks(io.BytesIO(midi_bytes))
+    except (TypeError, struct.error) as e:
+        raise ValueError(f"Unable to process midi file: {e}")
+    if not chunks:
+        raise ValueError("Unable to process midi file: no tracks")
+    offset, length = chunks[-1]
+    if offset + length > len(midi_bytes):
+        raise ValueError(f"Unable to process midi file: truncated, {offset + length - len(midi_bytes)} bytes missing")
+
+
+def _render(midi_bytes, params):
+    """
+    Runs in a worker. Returns the PDF or SVG bytes and the diagnostics as a dict. Doesn't touch the disk, unless the
+    service uses the parse cache
+    """
+    notes = _worker["read_notes"](midi_bytes)
+    box_index, notes, _ = fit_song(notes, _worker["music_boxes"], params["box"],
+                                   transpose=params["transpose"],
+                                   auto_transpose=params["auto_transpose"],
+                                   transpose_range=params["transpose_range"],
+                                   fold_octaves=params["fold_octaves"])
+    music_box = _worker["music_boxes"][box_index]
+    if params["format"] == "svg":
+        preview = _worker["preview"](music_box,
+                                     song_title=params["title"],
+                                     song_author=params["author"],
+                                     paper_size=params["paper_size"],
+                                     style=music_box.style)
+        diagnostics = _worker["diagnostics"]()
+        diagnostics.check_notes(notes, music_box)
+        diagnostics.pages = preview.pages_count(notes)
+        return preview.render_page(notes, params["page"]).encode(), diagnostics.to_dict()
+    session = _worker["session"](music_box, paper_size=params["paper_size"])
+    pdf, diagnostics = session.render(midi_file=None,
+                                      output_file=None,
+                                      song_title=params["title"],
+                                      song_author=params["author"],
+                                      parsed_notes=notes,
+                                      columns=params["columns"])
+    return pdf, diagnostics.to_dict()
+
+
+def parse_render_params(query, registry):
+    """ Validates the query string of a render request. Raises ValueError with a readable message """
+    def _get(name, default=None):
+        return query[name][-1] if name in query else default
+
+    def _flag(name):
+        return _get(name, "0").lower() in ("1", "true", "yes")
+
+    params = {
+        "title": _get("title", "NO-TITLE"),
+        "author": _get("author", "NO-AUTHOR"),
+        "transpose": int(_get("transpose", 0)),
+        "auto_transpose": _flag("auto_transpose"),
+        "transpose_range": int(_get("transpose_range", 12)),
+        "fold_octaves": _flag("fold_octaves"),
+        "columns": int(_get("columns")) if _get("columns") else None,
+        "paper_size": tuple(float(v) for v in _get("paper_size", "215.9x279.4").lower().split("x")),
+        "format": _get("format", "pdf").lower(),
+        "page": int(_get("page", 1)),
+    }
+    for name in ("title", "author"):
+        if not 1 <= len(params[name]) <= 50:
+            raise ValueError(f"Length of {name} is out of range [1, 50]")
+    if len(params["paper_size"]) != 2:
+        raise ValueError("paper_size must look like WIDTHxHEIGHT")
+    if params["format"] not in ("pdf", "svg"):
+        raise ValueError("format must be pdf or svg")
+    if params["format"] == "svg" and params["columns"] is not None:
+        raise ValueError("SVG previews don't support columns")
+    if params["page"] < 1:
+        raise ValueError("page starts at 1")
+    if params["transpose_range"] < 0:
+        raise ValueError("transpose_range can't be negative")
+    box = _get("box", str(len(registry)))
+    if box.lower() == "auto":
+        params["box"] = "auto"
+    else:
+        try:
+            params["box"] = registry.index_of(registry.find(box))
+        except KeyError as e:
+            raise ValueError(e.args[0])
+    return params
+
+
+class RenderService:
+    """ Owns the worker pool. Rejects requests once max_pending renders are waiting """
+
+    def __init__(self, registry, workers=None, max_pending=None, use_cache=False):
+        workers = workers or os.cpu_count() or 1
+        self.registry = registry
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                        initargs=(list(registry), use_cache))
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * workers)
+        # Start every worker now instead of on the first requests
+        for future in [self.pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    def render(self, midi_bytes, params):
+        """ Blocks until the PDF is ready. Returns (body, diagnostics), or None if the service is saturated """
+        if not self.slots.acquire(blocking=False):
+            return None
+        try:
+            return self.pool.submit(_render, midi_bytes, params).result()
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/boxes":
+            return self.send_error(404)
+        boxes = [{"index": index + 1, "name": box.name, "manufacturer": box.manufacturer,
+                  "description": box.description} for index, box in enumerate(self.service.registry)]
+        self._send(200, "application/json", io.BytesIO(json.dumps(boxes).encode()))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/render":
+            return self.send_error(404)
+        length = int(self.headers.get("Content-Length", 0))
+        if not 0 < length <= MAX_MIDI_SIZE:
+            return self.send_error(413 if length else 400, "Send the MIDI file as the request body")
+        midi_bytes = self.rfile.read(length)
+        try:
+            params = parse_render_params(parse_qs(url.query), self.service.registry)
+            check_midi(midi_bytes)
+        except ValueError as e:
+            return self.send_error(400, str(e))
+
+        try:
+            result = self.service.render(midi_bytes, params)
+        except Exception as e:
+            return self.send_error(500, str(e))
+        if result is None:
+            return self.send_error(503, "Too many renders in progress")
+        body, diagnostics = result
+        self._send(200, "image/svg+xml" if params["format"] == "svg" else "application/pdf", io.BytesIO(body),
+                   {"X-Render-Diagnostics": json.dumps(diagnostics)})
+
+    def _send(self, status, content_type, body, headers={}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body.getbuffer())))
+        self.end_headers()
+        shutil.copyfileobj(body, self.wfile, CHUNK_SIZE)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Local HTTP service rendering music box paper strips")
+    ap.add_argument("--host", help="Address to listen on", default="127.0.0.1")
+    ap.add_argument("--port", "-p", help="Port to listen on", type=int, default=8000)
+    ap.add_argument("--workers", "-w", help="Render processes. Defaults to the CPU count", type=int)
+    ap.add_argument("--max-pending", help="Renders accepted at once before answering 503. Defaults to twice the "
+                                          "workers", type=int)
+    ap.add_argument("--cache", help="Reuse the notes of midi files seen before, from the parse cache on disk. By default "
+                                    "requests never touch the disk",
+                    action="store_true")
+    return ap.parse_args()
+
+
+def main():
+    parsed_args = parse_args()
+    service = RenderService(load_music_boxes(verbose=False), workers=parsed_args.workers, max_pending=parsed_args.max_pending,
+                            use_cache=parsed_args.cache)
+    RenderHandler.service = service
+    httpd = ThreadingHTTPServer((parsed_args.host, parsed_args.port), RenderHandler)
+    print(f"Serving on http://{parsed_args.host}:{parsed_args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()